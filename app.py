@@ -2,39 +2,108 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import cv2
 import numpy as np
-from PIL import Image, ImageTk
 import threading
 import time
 import os
+import multiprocessing
 from pathlib import Path
 
+from auto_sync import AutoSync
+from encoders import DEFAULT_PROFILE, EXPORT_PROFILES
+from display import CanvasDisplay
+from engine import (EXPORT_MODES, PREVIEW_SIZE, ShadowSession, VideoLoader, fit_size,
+                    prepare_preview)
+from export_stats import format_duration
+from filmstrip import Filmstrip
+from frame_index import IndexBuilder
+from frame_store import (FrameStore, FrameStoreBuilder, check_budget, remove_stale_stores,
+                         store_bytes)
+from ghost import BackgroundBuilder
+from playback import PlaybackClock, RenderWorker
+from project import PROJECT_SUFFIX, Project
+from proxy import ProxyBuilder
+from splits import FINISH, START, GateDetector, next_gate, ordered, write_csv
+from splits_window import SplitsWindow
+from start_gate import GateSync, normalize_roi
+from thumbnails import ThumbnailBuilder
+from time_warp import TimeWarpBuilder
+from tracking import TrackBuilder
+
+# How often playback checks whether a new frame is due
+PLAYBACK_TICK_MS = 5
+
+# Outline colours of the boxes dragged on the videos, by canvas tag
+BOX_COLORS = {"roi": "yellow", "gate": "orange", "rider": "cyan"}
+
 class GymkhanaVideoAnalyzer:
     def __init__(self, root):
         self.root = root
         self.root.title("Gymkhana Video Analyzer")
         self.root.geometry("1400x1000")
         
-        # Video variables
-        self.video1_path = None
-        self.video2_path = None
-        self.video1_cap = None
-        self.video2_cap = None
-        self.video1_fps = 0
-        self.video2_fps = 0
-        self.video1_total_frames = 0
-        self.video2_total_frames = 0
-        self.video1_duration = 0
-        self.video2_duration = 0
-        
-        # Playback variables
+        # Videos, sync offset and shadow opacity live in the headless engine
+        self.session = ShadowSession(sync_offset=0, shadow_opacity=0.5)
+        
+        # Playback variables; direction is 1 forward, -1 backward
         self.current_frame = 0
         self.is_playing = False
-        self.sync_offset = 0  # Time offset between videos
-        self.shadow_opacity = 0.5
+        self.play_direction = 1
+        
+        # Wall-clock playback and background rendering of preview frames, at
+        # the largest size with the main video's aspect ratio that fits the
+        # canvases
+        self.playback_clock = PlaybackClock(None)
+        self.preview_size = PREVIEW_SIZE
+        self.render_worker = RenderWorker(
+            lambda frame_num: self.session.render(frame_num, self.preview_size),
+            self._on_frame_rendered)
+        # What the last render request was for, to skip requests that would
+        # draw the same picture again
+        self._requested_view = None
+        self._resize_job = None
+        
+        # Background work per video (frame index, proxy), keyed by
+        # (video number, task name), and the status text each task shows
+        self.background_tasks = {}
+        self.video_status = {1: {}, 2: {}}
+        
+        # Videos being opened on a background thread, by video number; the
+        # generation tells a stale load's result from the current one
+        self.loading_tasks = {}
+        self.load_generation = {1: 0, 2: 0}
+        
+        # Extra shadow videos being opened, and the control row of each
+        # loaded layer by ShadowTrack
+        self.layer_loaders = []
+        self.layer_rows = {}
+        # Background computations of layers for the ghost composite, by ShadowTrack
+        self.layer_background_tasks = {}
+        
+        # Sync offset estimation in progress (audio or start gate), and the
+        # start gate box drawn on the main video in 0..1 frame coordinates
+        self.auto_sync_task = None
+        self.start_gate_roi = None
+        # Boxes over the gates on the main video, in course order, for
+        # detecting the split markers
+        self.gate_rois = []
+        # (video number, tag, canvas item, x, y) of a box being dragged on a canvas
+        self._drag = None
+        
+        # Split table window while it is open
+        self.splits_window = None
+        
+        # Time warp alignment being computed for the loaded pair
+        self.time_warp_task = None
+        
+        # Open project file, if any; its layers and time warp are applied
+        # once both of its videos are loaded
+        self.project = None
+        self.pending_project = None
         
         # Export variables
         self.is_exporting = False
         self.export_progress = 0
+        self.exporter = None
         
         # GUI setup
         self.setup_gui()
@@ -64,10 +133,30 @@ class GymkhanaVideoAnalyzer:
         upload_frame = ttk.Frame(control_frame)
         upload_frame.pack(fill=tk.X, pady=(0, 10))
         
-        ttk.Button(upload_frame, text="Upload Video 1 (Main)", 
-                  command=self.upload_video1).pack(side=tk.LEFT, padx=(0, 10))
-        ttk.Button(upload_frame, text="Upload Video 2 (Shadow)", 
-                  command=self.upload_video2).pack(side=tk.LEFT, padx=(0, 10))
+        # While a video is loading its button cancels the load instead
+        self.upload_buttons = {
+            1: ttk.Button(upload_frame, text="Upload Video 1 (Main)", 
+                          command=self.upload_video1),
+            2: ttk.Button(upload_frame, text="Upload Video 2 (Shadow)", 
+                          command=self.upload_video2),
+        }
+        for button in self.upload_buttons.values():
+            button.pack(side=tk.LEFT, padx=(0, 10))
+        
+        # More riders stacked over the shadow, each with its own offset and opacity
+        ttk.Button(upload_frame, text="Add Shadow Layer",
+                   command=self.add_shadow_layer).pack(side=tk.LEFT, padx=(0, 10))
+        
+        # Videos, settings and analysis results saved together
+        ttk.Button(upload_frame, text="Open Project",
+                   command=self.open_project).pack(side=tk.LEFT, padx=(10, 5))
+        ttk.Button(upload_frame, text="Save Project",
+                   command=self.save_project).pack(side=tk.LEFT, padx=(0, 10))
+        
+        # Preview from low-resolution proxies (export still uses the originals)
+        self.use_proxies_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(upload_frame, text="Use preview proxies", variable=self.use_proxies_var,
+                        command=self.toggle_proxies).pack(side=tk.LEFT, padx=(10, 0))
         
         # Video info labels
         info_frame = ttk.Frame(control_frame)
@@ -79,14 +168,25 @@ class GymkhanaVideoAnalyzer:
         self.video2_info = ttk.Label(info_frame, text="Video 2: Not loaded")
         self.video2_info.pack(side=tk.LEFT)
         
+        # One row of controls per extra shadow layer
+        self.layers_frame = ttk.Frame(control_frame)
+        self.layers_frame.pack(fill=tk.X)
+        
         # Playback controls
         playback_frame = ttk.Frame(control_frame)
         playback_frame.pack(fill=tk.X, pady=(10, 0))
         
         ttk.Button(playback_frame, text="⏮", command=self.first_frame, width=3).pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Button(playback_frame, text="⏪", command=self.play_reverse, width=3).pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Button(playback_frame, text="◀", command=lambda: self.step_frame(-1), width=3).pack(side=tk.LEFT, padx=(0, 5))
         ttk.Button(playback_frame, text="⏯", command=self.play_pause, width=3).pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Button(playback_frame, text="▶", command=lambda: self.step_frame(1), width=3).pack(side=tk.LEFT, padx=(0, 5))
         ttk.Button(playback_frame, text="⏭", command=self.last_frame, width=3).pack(side=tk.LEFT, padx=(0, 5))
         
+        # Arrow keys step one frame
+        self.root.bind('<Left>', lambda event: self.step_frame(-1, event))
+        self.root.bind('<Right>', lambda event: self.step_frame(1, event))
+        
         # Sync offset control
         ttk.Label(playback_frame, text="Sync Offset (s):").pack(side=tk.LEFT, padx=(20, 5))
         self.offset_var = tk.DoubleVar(value=0.0)
@@ -94,8 +194,8 @@ class GymkhanaVideoAnalyzer:
         # Create validation command
         vcmd = (self.root.register(self.validate_sync_offset), '%P')
         
-        offset_spin = ttk.Spinbox(playback_frame, from_=-60, to=60, increment=0.1, 
-                                 textvariable=self.offset_var, width=8, format="%.1f",
+        offset_spin = ttk.Spinbox(playback_frame, from_=-60, to=60, increment=0.01, 
+                                 textvariable=self.offset_var, width=8, format="%.3f",
                                  validate='key', validatecommand=vcmd)
         offset_spin.pack(side=tk.LEFT, padx=(0, 10))
         offset_spin.bind('<KeyRelease>', self.update_sync_offset)
@@ -103,6 +203,21 @@ class GymkhanaVideoAnalyzer:
         offset_spin.bind('<Return>', self.update_sync_offset)    # Update when Enter is pressed
         offset_spin.bind('<ButtonRelease-1>', self.update_sync_offset)  # Update when using arrows
         
+        # Estimate the offset from the audio tracks
+        self.auto_sync_button = ttk.Button(playback_frame, text="Auto Sync", command=self.auto_sync)
+        self.auto_sync_button.pack(side=tk.LEFT, padx=(0, 5))
+        
+        # Or from the launch inside the start gate box drawn on the main video
+        self.gate_sync_button = ttk.Button(playback_frame, text="Gate Sync", command=self.gate_sync)
+        self.gate_sync_button.pack(side=tk.LEFT, padx=(0, 5))
+        
+        # Follow the riders along the whole run instead of one constant offset
+        self.time_warp_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(playback_frame, text="Time warp", variable=self.time_warp_var,
+                        command=self.toggle_time_warp).pack(side=tk.LEFT, padx=(0, 5))
+        self.auto_sync_label = ttk.Label(playback_frame, text="")
+        self.auto_sync_label.pack(side=tk.LEFT, padx=(0, 10))
+        
         # Shadow opacity control
         ttk.Label(playback_frame, text="Shadow Opacity:").pack(side=tk.LEFT, padx=(20, 5))
         self.opacity_var = tk.DoubleVar(value=0.5)
@@ -111,6 +226,22 @@ class GymkhanaVideoAnalyzer:
         opacity_scale.pack(side=tk.LEFT, padx=(0, 10))
         opacity_scale.bind('<ButtonRelease-1>', self.update_shadow_opacity)
         
+        # Overlay only the moving rider instead of the whole shadow frame
+        self.ghost_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(playback_frame, text="Ghost rider", variable=self.ghost_var,
+                        command=self.toggle_ghost).pack(side=tk.LEFT, padx=(0, 10))
+        
+        # Warp the shadow onto the main video when the cameras moved
+        self.register_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(playback_frame, text="Align cameras", variable=self.register_var,
+                        command=self.toggle_registration).pack(side=tk.LEFT, padx=(0, 10))
+        
+        # Draw the tracked riders' racing lines; while on, dragging a box on
+        # a video picks the rider to track in it
+        self.paths_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(playback_frame, text="Rider paths", variable=self.paths_var,
+                        command=self.toggle_paths).pack(side=tk.LEFT, padx=(0, 10))
+        
     def setup_video_display(self, parent):
         video_frame = ttk.LabelFrame(parent, text="Video Comparison", padding=10)
         video_frame.pack(fill=tk.BOTH, expand=True, pady=(0, 10))
@@ -127,6 +258,18 @@ class GymkhanaVideoAnalyzer:
         self.video2_canvas = tk.Canvas(display_frame, bg="black", width=640, height=360)
         self.video2_canvas.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True, padx=(5, 0))
         
+        # Drag on the main video to mark the start gate for Gate Sync, or with
+        # rider paths on, around the rider on either video to track it
+        for video_num, canvas in ((1, self.video1_canvas), (2, self.video2_canvas)):
+            canvas.bind('<ButtonPress-1>', lambda event, n=video_num: self._start_box(n, event))
+            canvas.bind('<B1-Motion>', lambda event, n=video_num: self._drag_box(n, event))
+            canvas.bind('<ButtonRelease-1>', lambda event, n=video_num: self._finish_box(n, event))
+        
+        # One image item per canvas, updated in place
+        self.display1 = CanvasDisplay(self.video1_canvas)
+        self.display2 = CanvasDisplay(self.video2_canvas)
+        self.video1_canvas.bind('<Configure>', self._on_canvas_resize)
+        
         # Labels for video displays
         ttk.Label(display_frame, text="Main Video", anchor="center").pack(side=tk.LEFT, padx=(0, 5))
         ttk.Label(display_frame, text="Shadow Video", anchor="center").pack(side=tk.RIGHT, padx=(5, 0))
@@ -151,6 +294,29 @@ class GymkhanaVideoAnalyzer:
                                    textvariable=self.end_time_var, width=8)
         end_time_spin.pack(side=tk.LEFT, padx=(0, 20))
         
+        # Export mode (segmented runs parallel processes and needs ffmpeg)
+        ttk.Label(time_range_frame, text="Export Mode:").pack(side=tk.LEFT, padx=(0, 5))
+        self.export_mode_var = tk.StringVar(value="pipelined")
+        ttk.Combobox(time_range_frame, textvariable=self.export_mode_var,
+                     values=EXPORT_MODES, width=11, state="readonly").pack(side=tk.LEFT)
+        
+        # Codec, size and frame rate of the exported file
+        ttk.Label(time_range_frame, text="Profile:").pack(side=tk.LEFT, padx=(20, 5))
+        self.export_profile_var = tk.StringVar(value=DEFAULT_PROFILE)
+        profile_combo = ttk.Combobox(time_range_frame, textvariable=self.export_profile_var,
+                                     values=list(EXPORT_PROFILES), width=9, state="readonly")
+        profile_combo.pack(side=tk.LEFT)
+        self.export_profile_label = ttk.Label(time_range_frame,
+                                              text=EXPORT_PROFILES[DEFAULT_PROFILE].description)
+        self.export_profile_label.pack(side=tk.LEFT, padx=(5, 0))
+        profile_combo.bind('<<ComboboxSelected>>', lambda event: self.export_profile_label.config(
+            text=EXPORT_PROFILES[self.export_profile_var.get()].description))
+        
+        # Decode the range once into a memory-mapped file for frame-by-frame work
+        self.analysis_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(time_range_frame, text="Analysis mode", variable=self.analysis_var,
+                        command=self.toggle_analysis).pack(side=tk.LEFT, padx=(20, 0))
+        
         # Export button and progress
         export_controls_frame = ttk.Frame(export_frame)
         export_controls_frame.pack(fill=tk.X)
@@ -186,6 +352,11 @@ class GymkhanaVideoAnalyzer:
         self.timeline_slider.pack(fill=tk.X, pady=(0, 10))
         self.timeline_slider.bind('<ButtonRelease-1>', self.seek_to_position)
         
+        # Keyframe thumbnails of both videos along the timeline; hover to
+        # preview, click to seek
+        self.filmstrip = Filmstrip(timeline_frame, self.seek_to_time)
+        self.filmstrip.canvas.pack(fill=tk.X, pady=(0, 10))
+        
         # Time display and frame info
         time_frame = ttk.Frame(timeline_frame)
         time_frame.pack(fill=tk.X)
@@ -193,9 +364,21 @@ class GymkhanaVideoAnalyzer:
         self.time_label = ttk.Label(time_frame, text="Time: 00:00 / 00:00")
         self.time_label.pack(side=tk.LEFT)
         
+        # Split markers on the frames shown
+        self.marker_label = ttk.Label(time_frame, text="")
+        self.marker_label.pack(side=tk.LEFT, padx=(20, 0))
+        
         self.frame_label = ttk.Label(time_frame, text="Frame: 0 / 0")
         self.frame_label.pack(side=tk.RIGHT)
         
+        # Achieved playback rate and frames skipped to keep up
+        self.playback_label = ttk.Label(time_frame, text="")
+        self.playback_label.pack(side=tk.RIGHT, padx=(0, 20))
+        
+        # Frame cache hit rates, to help tune the cache budget
+        self.cache_label = ttk.Label(time_frame, text="")
+        self.cache_label.pack(side=tk.RIGHT, padx=(0, 20))
+        
         # Speed control
         speed_frame = ttk.Frame(timeline_frame)
         speed_frame.pack(fill=tk.X, pady=(10, 0))
@@ -207,6 +390,13 @@ class GymkhanaVideoAnalyzer:
         speed_combo.pack(side=tk.LEFT, padx=(5, 0))
         speed_combo.bind('<<ComboboxSelected>>', self.update_playback_speed)
         
+        # Split times from markers dropped with the keyboard or found in gate boxes
+        self.gates_var = tk.BooleanVar(value=False)
+        self.split_sync_var = tk.BooleanVar(value=False)
+        ttk.Button(speed_frame, text="Splits", command=self.show_splits).pack(side=tk.LEFT,
+                                                                             padx=(20, 0))
+        self._bind_marker_keys(self.root)
+        
     def upload_video1(self):
         file_path = filedialog.askopenfilename(
             title="Select Main Video",
@@ -224,173 +414,989 @@ class GymkhanaVideoAnalyzer:
             self.load_video(file_path, 2)
             
     def load_video(self, file_path, video_num):
-        try:
-            cap = cv2.VideoCapture(file_path)
-            if not cap.isOpened():
+        """Open a video on a background thread; it replaces the current one once ready"""
+        self.cancel_loading(video_num)
+        self.load_generation[video_num] += 1
+        generation = self.load_generation[video_num]
+        
+        def on_done(source, error):
+            self.root.after(0, self._video_loaded, video_num, generation, source, error)
+            
+        # Decode the first frame at the size it will be shown at
+        if video_num == 2 and self.session.video1:
+            preview_size = self.preview_size
+        else:
+            bounds = self.display1.canvas_size()
+            preview_size = lambda source: fit_size(source.width, source.height, *bounds)
+        self.loading_tasks[video_num] = VideoLoader(file_path, on_done, preview_size)
+        info_label = self.video1_info if video_num == 1 else self.video2_info
+        info_label.config(text=f"Video {video_num}: loading {Path(file_path).name}...")
+        self.upload_buttons[video_num].config(
+            text=f"Cancel Loading Video {video_num}",
+            command=lambda: self.cancel_loading(video_num))
+        
+    def cancel_loading(self, video_num):
+        """Stop opening a video; the one loaded before (if any) stays"""
+        task = self.loading_tasks.pop(video_num, None)
+        if not task:
+            return
+        task.cancel()
+        self.load_generation[video_num] += 1
+        self._reset_upload_button(video_num)
+        self.update_video_info(video_num)
+            
+    def _reset_upload_button(self, video_num):
+        if video_num == 1:
+            self.upload_buttons[1].config(text="Upload Video 1 (Main)",
+                                          command=self.upload_video1)
+        else:
+            self.upload_buttons[2].config(text="Upload Video 2 (Shadow)",
+                                          command=self.upload_video2)
+            
+    def _video_loaded(self, video_num, generation, video, error):
+        """Install a video opened by a VideoLoader (must be done in main thread)"""
+        if generation != self.load_generation[video_num]:
+            # Cancelled or superseded by a newer load
+            if video is not None:
+                video.release()
+            return
+        self.loading_tasks.pop(video_num, None)
+        self._reset_upload_button(video_num)
+        if error is not None:
+            self.update_video_info(video_num)
+            if isinstance(error, IOError):
                 messagebox.showerror("Error", f"Could not open video {video_num}")
-                return
-                
-            fps = cap.get(cv2.CAP_PROP_FPS)
-            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            duration = total_frames / fps if fps > 0 else 0
-            
-            if video_num == 1:
-                if self.video1_cap:
-                    self.video1_cap.release()
-                self.video1_cap = cap
-                self.video1_path = file_path
-                self.video1_fps = fps
-                self.video1_total_frames = total_frames
-                self.video1_duration = duration
-                self.video1_info.config(text=f"Video 1: {Path(file_path).name} ({duration:.1f}s)")
             else:
-                if self.video2_cap:
-                    self.video2_cap.release()
-                self.video2_cap = cap
-                self.video2_path = file_path
-                self.video2_fps = fps
-                self.video2_total_frames = total_frames
-                self.video2_duration = duration
-                self.video2_info.config(text=f"Video 2: {Path(file_path).name} ({duration:.1f}s)")
-                
-            # Update timeline if both videos are loaded
-            if self.video1_cap and self.video2_cap:
-                self.update_timeline()
-                self.display_current_frame()
+                messagebox.showerror("Error", f"Error loading video: {str(error)}")
+            self._apply_pending_project()
+            return
+            
+        # Keep the playhead at the same time if the playhead's video changes
+        previous_main = self.session.main_video
+        current_time = previous_main.time_of(self.current_frame) if previous_main else 0.0
+        for task_video_num, name in list(self.background_tasks):
+            if task_video_num == video_num:
+                self.cancel_background_task(video_num, name)
+        self.session.set_video(video, video_num)
+        main_video = self.session.main_video
+        if main_video is not previous_main:
+            self.current_frame = main_video.frame_at(current_time)
+            if self.is_playing:
+                self.playback_clock.start(self.current_frame, timing=main_video.timing)
                 
-        except Exception as e:
-            messagebox.showerror("Error", f"Error loading video: {str(e)}")
+        self.video_status[video_num].clear()
+        self.update_video_info(video_num)
+        # The session dropped the warp of the previous pair
+        self.cancel_time_warp()
+        self.refresh_splits()
+        self.stop_analysis()
+        self.start_background_task(video, video_num, "indexing", IndexBuilder,
+                                   self._index_ready, store=self.session.artifacts)
+        if self.use_proxies_var.get():
+            self.start_background_task(video, video_num, "proxy", ProxyBuilder,
+                                       self._proxy_ready)
+        if video_num == 2 and self.ghost_var.get():
+            self.start_background_task(video, video_num, "background", BackgroundBuilder,
+                                       self._background_ready, store=self.session.artifacts)
             
-    def update_timeline(self):
-        if not (self.video1_cap and self.video2_cap):
+        # Preview right away, even before the other video is loaded; the
+        # first frame is already decoded
+        self.update_timeline()
+        self._update_preview_size()
+        self.display_current_frame()
+        self._apply_pending_project()
+            
+    def add_shadow_layer(self):
+        """Open another shadow video on a background thread and stack it over the shadow"""
+        if not self.session.ready:
+            messagebox.showerror("Error", "Please load both videos first")
             return
+        file_path = filedialog.askopenfilename(
+            title="Select Shadow Layer Video",
+            filetypes=[("Video files", "*.mp4 *.avi *.mov *.mkv"), ("All files", "*.*")]
+        )
+        if file_path:
+            self.load_shadow_layer(file_path, 0.0, self.session.shadow_opacity)
             
-        # Use the longer video duration for timeline
-        max_duration = max(self.video1_duration, self.video2_duration)
-        self.timeline_slider.config(to=max_duration)
+    def load_shadow_layer(self, file_path, sync_offset, opacity):
+        """Open a layer video on a background thread; it is stacked once ready"""
+        def on_done(source, error):
+            self.root.after(0, self._layer_loaded, loader, source, error, sync_offset, opacity)
+            
+        loader = VideoLoader(file_path, on_done, self.preview_size)
+        self.layer_loaders.append(loader)
+        
+    def _layer_loaded(self, loader, video, error, sync_offset, opacity):
+        """Add a layer opened by a VideoLoader (must be done in main thread)"""
+        if loader not in self.layer_loaders:
+            if video is not None:
+                video.release()
+            return
+        self.layer_loaders.remove(loader)
+        if error is not None:
+            messagebox.showerror("Error", f"Error loading video: {str(error)}")
+            return
+        track = self.session.add_layer(video, sync_offset=sync_offset, opacity=opacity)
         
-    def display_current_frame(self):
-        if not (self.video1_cap and self.video2_cap):
+        row = ttk.Frame(self.layers_frame)
+        row.pack(fill=tk.X, pady=(5, 0))
+        ttk.Label(row, text=f"Layer: {track.name}").pack(side=tk.LEFT, padx=(0, 10))
+        
+        ttk.Label(row, text="Offset (s):").pack(side=tk.LEFT, padx=(0, 5))
+        offset_var = tk.DoubleVar(value=track.sync_offset)
+        vcmd = (self.root.register(self.validate_sync_offset), '%P')
+        offset_spin = ttk.Spinbox(row, from_=-60, to=60, increment=0.01,
+                                  textvariable=offset_var, width=8, format="%.3f",
+                                  validate='key', validatecommand=vcmd)
+        offset_spin.pack(side=tk.LEFT, padx=(0, 10))
+        update_offset = lambda event: self.update_layer_offset(track, offset_var)
+        for sequence in ('<KeyRelease>', '<FocusOut>', '<Return>', '<ButtonRelease-1>'):
+            offset_spin.bind(sequence, update_offset)
+            
+        ttk.Label(row, text="Opacity:").pack(side=tk.LEFT, padx=(0, 5))
+        opacity_var = tk.DoubleVar(value=track.opacity)
+        opacity_scale = ttk.Scale(row, from_=0.0, to=1.0, variable=opacity_var,
+                                  orient=tk.HORIZONTAL, length=100)
+        opacity_scale.pack(side=tk.LEFT, padx=(0, 10))
+        opacity_scale.bind('<ButtonRelease-1>',
+                           lambda event: self.update_layer_opacity(track, opacity_var))
+        
+        ttk.Button(row, text="Remove",
+                   command=lambda: self.remove_shadow_layer(track)).pack(side=tk.LEFT)
+        self.layer_rows[track] = row
+        if self.ghost_var.get():
+            self._build_layer_background(track)
+        self.display_current_frame()
+        
+    def update_layer_offset(self, track, offset_var):
+        """Apply a layer's offset spinbox, resetting it if the text is not a number"""
+        try:
+            track.sync_offset = float(offset_var.get())
+        except (ValueError, TypeError, tk.TclError):
+            offset_var.set(track.sync_offset)
             return
+        self.display_current_frame()
+        
+    def update_layer_opacity(self, track, opacity_var):
+        track.opacity = opacity_var.get()
+        self.display_current_frame()
+        
+    def remove_shadow_layer(self, track):
+        # The session waits for a render that may be reading the layer's video
+        task = self.layer_background_tasks.pop(track, None)
+        if task:
+            task.cancel()
+        self.session.remove_layer(track)
+        self.layer_rows.pop(track).destroy()
+        self.display_current_frame()
+        
+    def update_video_info(self, video_num):
+        """Show the name and duration of a video, plus any background task status"""
+        video = self.session.video1 if video_num == 1 else self.session.video2
+        info_label = self.video1_info if video_num == 1 else self.video2_info
+        if video is None:
+            info_label.config(text=f"Video {video_num}: Not loaded")
+            return
+        text = (f"Video {video_num}: {video.name} ({video.duration:.1f}s, "
+                f"{video.width}x{video.height} {video.codec or '?'} {video.fps:.2f} fps")
+        if video.rotation:
+            text += f", rotated {video.rotation}°"
+        text += ")"
+        for status in self.video_status[video_num].values():
+            text += f" - {status}"
+        info_label.config(text=text)
+        
+    def start_background_task(self, video, video_num, name, task_class, on_ready, **options):
+        """Run a per-video background task, showing its progress in the info label
+        
+        `task_class(path, on_done, on_progress, **options)` starts the work
+        on its own thread; `on_ready(video, video_num, result)` runs on the
+        main thread once it succeeds.
+        """
+        self.cancel_background_task(video_num, name)
+            
+        def on_progress(progress):
+            self.root.after(0, self._background_progress, video, video_num, name, progress)
+            
+        def on_done(result, error):
+            self.root.after(0, self._background_done, video, video_num, name,
+                            result, error, on_ready)
+            
+        self.video_status[video_num][name] = f"{name}..."
+        self.update_video_info(video_num)
+        self.background_tasks[(video_num, name)] = task_class(video.path, on_done, on_progress,
+                                                              **options)
+        
+    def cancel_background_task(self, video_num, name):
+        task = self.background_tasks.pop((video_num, name), None)
+        if task:
+            task.cancel()
+        self.video_status[video_num].pop(name, None)
+        
+    def _is_current_video(self, video, video_num):
+        return video is (self.session.video1 if video_num == 1 else self.session.video2)
+        
+    def _background_progress(self, video, video_num, name, progress):
+        """Show background task progress (must be done in main thread)"""
+        if self._is_current_video(video, video_num) and (video_num, name) in self.background_tasks:
+            self.video_status[video_num][name] = f"{name} {progress:.0f}%"
+            self.update_video_info(video_num)
+            
+    def _background_done(self, video, video_num, name, result, error, on_ready):
+        """Hand a finished background task's result to its handler"""
+        if not self._is_current_video(video, video_num):
+            return
+        self.background_tasks.pop((video_num, name), None)
+        if error is not None:
+            self.video_status[video_num][name] = f"{name} failed"
+            print(f"Background {name} error: {error}")
+        else:
+            self.video_status[video_num].pop(name, None)
+            on_ready(video, video_num, result)
+        self.update_video_info(video_num)
+            
+    def _index_ready(self, video, video_num, index):
+        """Switch a video to exact timing once its index is available"""
+        with self.session.lock:
+            video.set_index(index)
+            # Registered transforms are keyed by the old frame numbers
+            self.session.reset_registration()
+        if self.is_playing and video is self.session.main_video:
+            self.playback_clock.start(self.current_frame, timing=video.timing)
+        # Frame numbers changed, so the video's analysis store was dropped
+        if self.analysis_var.get():
+            self.start_analysis()
+        # Keyframes are known now, so the filmstrip can sample just those
+        if video.thumbnails is None:
+            self.start_background_task(video, video_num, "thumbnails", ThumbnailBuilder,
+                                       self._thumbnails_ready, index=index,
+                                       store=self.session.artifacts)
+        if self.session.loaded:
+            self.current_frame = self.session.main_video.clamp(self.current_frame)
+            self.update_timeline()
+            self.display_current_frame()
+            
+    def _thumbnails_ready(self, video, video_num, strip):
+        video.thumbnails = strip
+        self.update_filmstrip()
+        
+    def _proxy_ready(self, video, video_num, proxy_path):
+        """Preview a video from its proxy once the transcode is done"""
+        with self.session.lock:
+            video.set_proxy(proxy_path)
+        self.display_current_frame()
+        
+    def toggle_ghost(self):
+        """Switch between blending whole shadow frames and only their moving riders
+        
+        The background of each shadow video is computed (or loaded from the
+        cache) the first time; until it is ready that video is blended whole.
+        """
+        self.session.ghost = self.ghost_var.get()
+        if self.session.ghost:
+            video2 = self.session.video2
+            if (video2 and video2.background is None
+                    and (2, "background") not in self.background_tasks):
+                self.start_background_task(video2, 2, "background", BackgroundBuilder,
+                                           self._background_ready,
+                                           store=self.session.artifacts)
+            for track in self.session.layers:
+                self._build_layer_background(track)
+        self.display_current_frame()
+        
+    def _background_ready(self, video, video_num, background):
+        with self.session.lock:
+            video.background = background
+        self.display_current_frame()
+        
+    def _build_layer_background(self, track):
+        """Compute a layer's background on a background thread unless it is known"""
+        if track.source.background is not None or track in self.layer_background_tasks:
+            return
+        
+        def on_done(background, error):
+            self.root.after(0, self._layer_background_ready, track, background, error)
             
-        # Calculate frame numbers for both videos
-        time1 = self.current_frame / self.video1_fps
-        time2 = time1 + self.sync_offset
+        self.layer_background_tasks[track] = BackgroundBuilder(track.source.path, on_done,
+                                                               store=self.session.artifacts)
         
-        frame1 = int(time1 * self.video1_fps)
-        frame2 = int(time2 * self.video2_fps)
+    def _layer_background_ready(self, track, background, error):
+        """Use a layer's background once computed (must be done in main thread)"""
+        if self.layer_background_tasks.pop(track, None) is None:
+            return
+        if error is not None:
+            print(f"Background error for {track.name}: {error}")
+            return
+        with self.session.lock:
+            track.source.background = background
+        self.display_current_frame()
         
-        # Ensure frame numbers are within bounds
-        frame1 = max(0, min(frame1, self.video1_total_frames - 1))
-        frame2 = max(0, min(frame2, self.video2_total_frames - 1))
+    def toggle_registration(self):
+        """Turn camera motion compensation of the shadow videos on or off"""
+        with self.session.lock:
+            self.session.register = self.register_var.get()
+        self.display_current_frame()
         
-        # Read frames
-        self.video1_cap.set(cv2.CAP_PROP_POS_FRAMES, frame1)
-        self.video2_cap.set(cv2.CAP_PROP_POS_FRAMES, frame2)
+    def toggle_paths(self):
+        """Show or hide the tracked riders' paths"""
+        with self.session.lock:
+            self.session.show_paths = self.paths_var.get()
+        videos = [video for video in (self.session.video1, self.session.video2) if video]
+        if self.session.show_paths and all(video.trajectory is None for video in videos):
+            messagebox.showinfo("Rider Paths", "Drag a box around the rider on each video "
+                                "to track it from the frame shown")
+        self.display_current_frame()
+        
+    def track_rider(self, video_num, box):
+        """Track the rider inside `box` (0..1 frame coordinates) from the frame shown"""
+        video = self.session.video1 if video_num == 1 else self.session.video2
+        if video is None:
+            return
+        start_frame = self.session.frame_numbers(self.current_frame)[video_num - 1]
+        self._start_tracking(video, video_num, box, start_frame)
+        
+    def _start_tracking(self, video, video_num, box, start_frame):
+        self.start_background_task(video, video_num, "tracking", TrackBuilder,
+                                   self._track_ready, box=box, start_frame=start_frame,
+                                   index=video.index, proxy_path=video.proxy_path,
+                                   store=self.session.artifacts)
+        
+    def _track_ready(self, video, video_num, trajectory):
+        with self.session.lock:
+            video.trajectory = trajectory
+        self.display_current_frame()
         
-        ret1, frame1_img = self.video1_cap.read()
-        ret2, frame2_img = self.video2_cap.read()
+    def toggle_proxies(self):
+        """Start or stop previewing from proxies for the loaded videos"""
+        for video_num, video in ((1, self.session.video1), (2, self.session.video2)):
+            if not video:
+                continue
+            if self.use_proxies_var.get():
+                self.start_background_task(video, video_num, "proxy", ProxyBuilder,
+                                           self._proxy_ready)
+            else:
+                self.cancel_background_task(video_num, "proxy")
+                with self.session.lock:
+                    video.clear_proxy()
+                self.update_video_info(video_num)
+        self.display_current_frame()
         
-        if ret1 and ret2:
-            # Resize frames to fit canvas
-            frame1_img = cv2.resize(frame1_img, (640, 360))
-            frame2_img = cv2.resize(frame2_img, (640, 360))
+    def update_timeline(self):
+        if not self.session.loaded:
+            return
+            
+        # Use the longer video duration for timeline
+        self.timeline_slider.config(to=self.session.max_duration)
+        self.update_filmstrip()
+        
+    def update_filmstrip(self):
+        """Lay the thumbnail rows out along the timeline, the shadow's shifted by the sync"""
+        session = self.session
+        if not session.loaded:
+            self.filmstrip.set_rows([], 0.0)
+            return
+        main = session.main_video
+        rows = [(main.thumbnails, lambda time: time if time <= main.duration else None)]
+        if session.ready:
+            video2 = session.video2
             
-            # Convert BGR to RGB
-            frame1_rgb = cv2.cvtColor(frame1_img, cv2.COLOR_BGR2RGB)
-            frame2_rgb = cv2.cvtColor(frame2_img, cv2.COLOR_BGR2RGB)
+            def shadow_time(time):
+                time2 = session.shadow_time(time)
+                return time2 if 0.0 <= time2 <= video2.duration else None
+                
+            rows.append((video2.thumbnails, shadow_time))
+        self.filmstrip.set_rows(rows, session.max_duration)
+        
+    def display_current_frame(self):
+        """Ask the render thread for the current frame; it is shown when ready
+        
+        Nothing is rendered if the picture would be the same as the last one
+        requested.
+        """
+        if not self.session.loaded:
+            return
             
-            # Create shadow effect by blending frames
-            shadow_frame = cv2.addWeighted(frame1_rgb, 1 - self.shadow_opacity, 
-                                         frame2_rgb, self.shadow_opacity, 0)
+        session = self.session
+        view = (session.video1, session.video2, session.frame_numbers(self.current_frame),
+                session.shadow_opacity, self.preview_size,
+                [video.proxy_path for video in (session.video1, session.video2) if video],
+                # A new index changes the timing without changing the frame numbers
+                [video.index for video in [session.video1, session.video2]
+                 + [track.source for track in session.layers] if video],
+                [(track, track.sync_offset, track.opacity) for track in session.layers],
+                session.ghost, session.register, [video.background for video in [session.video2]
+                                + [track.source for track in session.layers] if video],
+                session.show_paths, [video.trajectory for video in (session.video1, session.video2)
+                                     if video])
+        if view == self._requested_view:
+            return
+        self._requested_view = view
+        self.render_worker.request(self.current_frame)
+        
+    def _on_canvas_resize(self, event):
+        """Rescale the preview once the window stops changing size"""
+        if self._resize_job:
+            self.root.after_cancel(self._resize_job)
+        self._resize_job = self.root.after(100, self._update_preview_size)
+        
+    def _update_preview_size(self):
+        """Fit the preview to the canvas and the main video's aspect ratio"""
+        self._resize_job = None
+        self.display1.center()
+        self.display2.center()
+        main_video = self.session.main_video
+        if main_video is None:
+            return
+        size = fit_size(main_video.width, main_video.height, *self.display1.canvas_size())
+        if size != self.preview_size:
+            self.preview_size = size
+            # Stored frames are the old size
+            if self.analysis_var.get():
+                self.start_analysis()
+            self.display_current_frame()
+        self._draw_roi()
+        
+    def _on_frame_rendered(self, frame_num, frames):
+        """Called on the render thread; hand the frame to the main thread"""
+        self.root.after(0, self._show_rendered_frame, frame_num, frames)
+        
+    def _show_rendered_frame(self, frame_num, frames):
+        """Put a rendered frame on the canvases (must be done in main thread)"""
+        if not self.session.loaded:
+            if frames and frames[1] is not None:
+                self.session.release_frame(frames[1])
+            return
             
-            # Convert to PIL Image and then to PhotoImage
-            pil_img1 = Image.fromarray(frame1_rgb)
-            pil_shadow = Image.fromarray(shadow_frame)
+        if frames:
+            frame1_rgb, shadow_frame = frames
             
-            self.photo1 = ImageTk.PhotoImage(pil_img1)
-            self.photo_shadow = ImageTk.PhotoImage(pil_shadow)
+            # Paste into the canvases' images; with one video loaded only its
+            # canvas gets a picture. Cached main frames are never modified,
+            # so the same array means the same picture
+            if frame1_rgb is not None:
+                self.display1.show(frame1_rgb, key=frame1_rgb)
+            if shadow_frame is not None:
+                self.display2.show(shadow_frame)
+                # The PhotoImage holds its own copy, so the buffer can be reused
+                self.session.release_frame(shadow_frame)
             
-            # Display on canvases
-            self.video1_canvas.create_image(320, 180, image=self.photo1, anchor=tk.CENTER)
-            self.video2_canvas.create_image(320, 180, image=self.photo_shadow, anchor=tk.CENTER)
+            if self.is_playing:
+                self.playback_clock.frame_shown(frame_num)
             
         # Update time and frame labels
-        current_time = self.current_frame / self.video1_fps
-        max_time = max(self.video1_duration, self.video2_duration)
+        main_video = self.session.main_video
+        main_frame = main_video.clamp(frame_num)
+        current_time = main_video.time_of(frame_num)
+        
+        self.time_label.config(text=f"Time: {current_time:.3f}s / {self.session.max_duration:.3f}s")
+        self.update_marker_label(frame_num)
+        self.filmstrip.set_playhead(current_time)
+        self.frame_label.config(text=f"Frame: {main_frame} / {main_video.total_frames}")
+        if self.session.time_warp is not None:
+            self.auto_sync_label.config(text=f"Warp offset {self.session.offset_at(frame_num):+.3f}s")
         
-        self.time_label.config(text=f"Time: {current_time:.1f}s / {max_time:.1f}s")
-        self.frame_label.config(text=f"Frame: {frame1} / {self.video1_total_frames}")
+        self.cache_label.config(text="Cache " + " ".join(
+            f"V{n} {stats['hits']}/{stats['misses']} ({stats['hit_rate']:.0%})"
+            for n, stats in enumerate(self.session.cache_stats(), 1) if stats))
         
     def play_pause(self):
-        if not (self.video1_cap and self.video2_cap):
+        self.toggle_playback(1)
+        
+    def play_reverse(self):
+        self.toggle_playback(-1)
+        
+    def toggle_playback(self, direction):
+        """Start playing in `direction`, switch direction, or stop if already playing that way"""
+        if not self.session.loaded:
+            return
+        if self.is_playing and self.play_direction == direction:
+            self.is_playing = False
             return
             
-        self.is_playing = not self.is_playing
-        if self.is_playing:
+        was_playing = self.is_playing
+        self.is_playing = True
+        self.play_direction = direction
+        first, last = self.playback_range()
+        if direction > 0 and self.current_frame >= last:
+            self.current_frame = first
+        elif direction < 0 and self.current_frame <= first:
+            self.current_frame = last
+        self.playback_clock.reset_stats()
+        self.playback_clock.start(self.current_frame, self.speed_var.get() * direction,
+                                  self.session.main_video.timing)
+        if not was_playing:
             self.play_video()
             
+    def playback_range(self):
+        """First and last frame playback loops over: the analysed range, or the whole video"""
+        main_video = self.session.main_video
+        store = main_video.frame_store
+        if store is not None:
+            return store.first_frame, min(store.last_frame, main_video.total_frames - 1)
+        return 0, main_video.total_frames - 1
+        
     def play_video(self):
+        """Show whichever frame the wall clock says is due, skipping late ones"""
         if not self.is_playing:
             return
             
-        # Calculate delay based on speed
-        delay = 1.0 / (self.video1_fps * self.speed_var.get())
-        
-        # Update frame
-        self.current_frame += 1
-        if self.current_frame >= self.video1_total_frames:
-            self.current_frame = 0
+        main_video = self.session.main_video
+        
+        # Loop back to the start at the end (or to the end at the start)
+        target = self.playback_clock.target_frame()
+        first, last = self.playback_range()
+        if target > last or target < first:
+            target = first if self.play_direction > 0 else last
+            self.playback_clock.start(target)
             
-        # Update timeline slider
-        self.timeline_var.set(self.current_frame / self.video1_fps)
-        
-        # Display frame
-        self.display_current_frame()
+        if target != self.current_frame:
+            self.current_frame = target
+            
+            # Update timeline slider
+            self.timeline_var.set(main_video.time_of(self.current_frame))
+            
+            # Display frame (decoded on the render thread)
+            self.display_current_frame()
+            
+        self.playback_label.config(
+            text=f"Playback: {self.playback_clock.achieved_fps:.1f} fps, "
+                 f"{self.playback_clock.dropped} dropped")
         
-        # Schedule next frame
-        self.root.after(int(delay * 1000), self.play_video)
+        # Poll well within a frame; the clock, not this delay, sets the pace
+        self.root.after(PLAYBACK_TICK_MS, self.play_video)
         
     def first_frame(self):
         self.current_frame = 0
         self.timeline_var.set(0)
         self.display_current_frame()
         
+    def step_frame(self, delta, event=None):
+        """Move the playhead by `delta` frames"""
+        if not self.session.loaded:
+            return
+        # Leave arrow keys to text fields that have focus
+        if self._typing(event):
+            return
+            
+        main_video = self.session.main_video
+        self.current_frame = main_video.clamp(self.current_frame + delta)
+        self.timeline_var.set(main_video.time_of(self.current_frame))
+        self.display_current_frame()
+        
+    def _typing(self, event):
+        """True if a key event goes to a text field, which keeps its keys"""
+        return event is not None and isinstance(self.root.focus_get(), (tk.Entry, ttk.Entry))
+        
     def last_frame(self):
-        if self.video1_cap:
-            self.current_frame = self.video1_total_frames - 1
-            self.timeline_var.set(self.video1_duration)
+        main_video = self.session.main_video
+        if main_video:
+            self.current_frame = main_video.total_frames - 1
+            self.timeline_var.set(main_video.duration)
             self.display_current_frame()
             
     def seek_to_position(self, event=None):
-        if not (self.video1_cap and self.video2_cap):
+        if not self.session.loaded:
             return
             
         time_pos = self.timeline_var.get()
-        self.current_frame = int(time_pos * self.video1_fps)
+        self.current_frame = self.session.main_video.frame_at(time_pos)
         self.display_current_frame()
         
+    def seek_to_time(self, time):
+        """Move the playhead to a timeline time, e.g. one clicked on the filmstrip"""
+        self.timeline_var.set(time)
+        self.seek_to_position()
+        
     def update_sync_offset(self, event=None):
         """Update sync offset with error handling"""
         try:
             # Get the current value and validate it
             value = self.offset_var.get()
             if isinstance(value, (int, float)):
-                self.sync_offset = value
+                self.session.sync_offset = value
                 self.display_current_frame()
+                self.update_filmstrip()
             else:
                 # If the value is not a number, try to convert it
                 try:
-                    self.sync_offset = float(value)
+                    self.session.sync_offset = float(value)
                     self.display_current_frame()
+                    self.update_filmstrip()
                 except (ValueError, TypeError):
                     # If conversion fails, reset to previous valid value
-                    self.offset_var.set(self.sync_offset)
+                    self.offset_var.set(self.session.sync_offset)
         except Exception as e:
             # If any error occurs, reset to previous valid value
             print(f"Sync offset error: {e}")
-            self.offset_var.set(self.sync_offset)
+            self.offset_var.set(self.session.sync_offset)
     
+    def auto_sync(self):
+        """Estimate the sync offset from the audio tracks in the background"""
+        self._start_sync("Reading audio...", lambda video1, video2, on_done, on_progress:
+                         AutoSync(video1.path, video2.path, on_done, on_progress))
+        
+    def gate_sync(self):
+        """Estimate the sync offset from the launch at the start gate in the background"""
+        if self.start_gate_roi is None:
+            messagebox.showinfo("Gate Sync", "Drag a box around the start line on the main video first")
+            return
+        roi = self.start_gate_roi
+        self._start_sync("Finding launch...", lambda video1, video2, on_done, on_progress:
+                         GateSync((video1.path, video1.index, video1.proxy_path),
+                                  (video2.path, video2.index, video2.proxy_path),
+                                  roi, on_done, on_progress))
+        
+    def _start_sync(self, status, start_task):
+        """Run an offset estimation task; `start_task(video1, video2, on_done, on_progress)`"""
+        if not self.session.ready:
+            messagebox.showerror("Error", "Please load both videos first")
+            return
+        if self.auto_sync_task:
+            self.auto_sync_task.cancel()
+            
+        video1, video2 = self.session.video1, self.session.video2
+        
+        def on_progress(progress):
+            self.root.after(0, self._auto_sync_progress, progress)
+            
+        def on_done(estimate, error):
+            self.root.after(0, self._auto_sync_done, video1, video2, estimate, error)
+            
+        self.auto_sync_button.config(state='disabled')
+        self.gate_sync_button.config(state='disabled')
+        self.auto_sync_label.config(text=status)
+        self.auto_sync_task = start_task(video1, video2, on_done, on_progress)
+        
+    def _auto_sync_progress(self, progress):
+        """Show sync estimation progress (must be done in main thread)"""
+        if self.auto_sync_task:
+            self.auto_sync_label.config(text=f"Syncing {progress:.0f}%")
+            
+    def _auto_sync_done(self, video1, video2, estimate, error):
+        """Apply an estimated sync offset (must be done in main thread)"""
+        self.auto_sync_task = None
+        self.auto_sync_button.config(state='normal')
+        self.gate_sync_button.config(state='normal')
+        if video1 is not self.session.video1 or video2 is not self.session.video2:
+            # A video was replaced while the estimation was running
+            self.auto_sync_label.config(text="")
+            return
+        if error is not None:
+            self.auto_sync_label.config(text="Sync failed")
+            messagebox.showerror("Sync Error", f"Could not estimate the sync offset: {error}")
+            return
+            
+        self.offset_var.set(round(estimate.offset, 3))
+        self.session.sync_offset = estimate.offset
+        self.auto_sync_label.config(text=f"Confidence {estimate.confidence:.0%}")
+        self.display_current_frame()
+        self.update_filmstrip()
+        
+    def toggle_time_warp(self):
+        """Compute a time warp for the loaded pair, or go back to the constant offset"""
+        if not self.time_warp_var.get():
+            self.cancel_time_warp()
+            self.display_current_frame()
+            return
+        if not self.session.ready:
+            self.time_warp_var.set(False)
+            messagebox.showerror("Error", "Please load both videos first")
+            return
+            
+        if self.session.split_sync:
+            # The time warp replaces the sync to the splits
+            self.cancel_time_warp()
+            self.time_warp_var.set(True)
+        video1, video2 = self.session.video1, self.session.video2
+        
+        def on_progress(progress):
+            self.root.after(0, self._time_warp_progress, progress)
+            
+        def on_done(warp, error):
+            self.root.after(0, self._time_warp_done, video1, video2, warp, error)
+            
+        self.auto_sync_label.config(text="Aligning runs...")
+        self.time_warp_task = TimeWarpBuilder((video1.path, video1.index),
+                                              (video2.path, video2.index),
+                                              self.session.sync_offset, on_done, on_progress,
+                                              store=self.session.artifacts)
+        
+    def cancel_time_warp(self):
+        """Stop any time warp computation and use the constant offset again"""
+        if self.time_warp_task:
+            self.time_warp_task.cancel()
+            self.time_warp_task = None
+        self.time_warp_var.set(False)
+        self.split_sync_var.set(False)
+        with self.session.lock:
+            self.session.time_warp = None
+            self.session.split_sync = False
+        self.auto_sync_label.config(text="")
+        self.update_filmstrip()
+        
+    def _time_warp_progress(self, progress):
+        """Show time warp progress (must be done in main thread)"""
+        if self.time_warp_task:
+            self.auto_sync_label.config(text=f"Aligning {progress:.0f}%")
+            
+    def _time_warp_done(self, video1, video2, warp, error):
+        """Switch the preview and export to a computed time warp (must be done in main thread)"""
+        if video1 is not self.session.video1 or video2 is not self.session.video2:
+            return
+        self.time_warp_task = None
+        if error is not None:
+            self.time_warp_var.set(False)
+            self.auto_sync_label.config(text="Time warp failed")
+            messagebox.showerror("Time Warp Error", f"Could not align the runs: {error}")
+            return
+            
+        with self.session.lock:
+            self.session.time_warp = warp
+        self.display_current_frame()
+        self.update_filmstrip()
+        
+    def _canvas(self, video_num):
+        return self.video1_canvas if video_num == 1 else self.video2_canvas
+        
+    def _start_box(self, video_num, event):
+        """Begin dragging a box: a split gate, a rider with rider paths on, or the start gate"""
+        if self.gates_var.get():
+            tag = "gate"
+        else:
+            tag = "rider" if self.paths_var.get() else "roi"
+        if tag != "rider" and video_num != 1:
+            return
+        canvas = self._canvas(video_num)
+        if tag != "gate":
+            canvas.delete(tag)
+        item = canvas.create_rectangle(event.x, event.y, event.x, event.y,
+                                       outline=BOX_COLORS[tag], dash=(4, 2), width=2, tags=tag)
+        self._drag = (video_num, tag, item, event.x, event.y)
+        
+    def _drag_box(self, video_num, event):
+        if self._drag and self._drag[0] == video_num:
+            _, _, item, x0, y0 = self._drag
+            self._canvas(video_num).coords(item, x0, y0, event.x, event.y)
+            
+    def _finish_box(self, video_num, event):
+        """Track the rider in a dragged box, or store it as a gate or the start gate
+        
+        A click clears the start gate.
+        """
+        if not self._drag or self._drag[0] != video_num:
+            return
+        _, tag, item, x0, y0 = self._drag
+        self._drag = None
+        canvas = self._canvas(video_num)
+        if tag != "roi":
+            # The path drawn over the frames replaces the box, and the
+            # gates are redrawn with their numbers
+            canvas.delete(item)
+        if abs(event.x - x0) < 4 or abs(event.y - y0) < 4:
+            if tag == "roi":
+                canvas.delete(tag)
+                self.start_gate_roi = None
+            return
+        # Canvas to frame coordinates: the frame is centred at preview size
+        display = self.display1 if video_num == 1 else self.display2
+        left, top = display.image_origin()
+        width, height = display.image_size or self.preview_size
+        box = normalize_roi((x0 - left) / width, (y0 - top) / height,
+                            (event.x - left) / width, (event.y - top) / height)
+        if tag == "rider":
+            self.track_rider(video_num, box)
+        elif tag == "gate":
+            self.gate_rois.append(box)
+            self._draw_roi()
+        else:
+            self.start_gate_roi = box
+            self._draw_roi()
+        
+    def _draw_roi(self):
+        """Draw the start gate and split gate boxes on the frame, e.g. after a resize"""
+        if self._drag:
+            return
+        left, top = self.display1.image_origin(self.preview_size)
+        width, height = self.preview_size
+        self.video1_canvas.delete("roi", "gate")
+        boxes = [("roi", "", self.start_gate_roi)] + [
+            ("gate", str(number), box) for number, box in enumerate(self.gate_rois, 1)]
+        for tag, label, box in boxes:
+            if box is None:
+                continue
+            x0, y0, x1, y1 = box
+            self.video1_canvas.create_rectangle(left + x0 * width, top + y0 * height,
+                                                left + x1 * width, top + y1 * height,
+                                                outline=BOX_COLORS[tag], dash=(4, 2), width=2,
+                                                tags=tag)
+            if label:
+                self.video1_canvas.create_text(left + x0 * width + 3, top + y0 * height + 2,
+                                               text=label, anchor=tk.NW, fill=BOX_COLORS[tag],
+                                               tags=tag)
+        
+    def clear_gates(self):
+        """Forget the split gate boxes"""
+        self.gate_rois = []
+        self.video1_canvas.delete("gate")
+        
+    def show_splits(self):
+        """Open the split table window, or bring it to the front"""
+        if self.splits_window is not None:
+            self.splits_window.show()
+            return
+        self.splits_window = SplitsWindow(self.root, self.gates_var, self.split_sync_var,
+                                          self.toggle_split_sync, self.detect_gates,
+                                          self.clear_gates, self.save_splits,
+                                          self._splits_window_closed)
+        # Markers can be dropped with the table in front, too
+        self._bind_marker_keys(self.splits_window.window)
+        self.refresh_splits()
+        
+    def _splits_window_closed(self):
+        self.splits_window = None
+        self.gates_var.set(False)
+        
+    def _bind_marker_keys(self, widget):
+        """S, G and F drop Start, the next gate and Finish, X removes; with Shift on video 2"""
+        for key, name in (("s", START), ("g", None), ("f", FINISH)):
+            widget.bind(f'<Key-{key}>', lambda event, name=name: self.drop_marker(1, name, event))
+            widget.bind(f'<Key-{key.upper()}>',
+                        lambda event, name=name: self.drop_marker(2, name, event))
+        widget.bind('<Key-x>', lambda event: self.remove_markers(1, event))
+        widget.bind('<Key-X>', lambda event: self.remove_markers(2, event))
+        
+    def drop_marker(self, video_num, name=None, event=None):
+        """Mark the frame a video shows as `name`, or as its next gate if None
+        
+        A frame holds one marker, so it replaces any other on that frame.
+        """
+        video = self.session.video1 if video_num == 1 else self.session.video2
+        if video is None or self._typing(event):
+            return
+        frame_num = self.session.frame_numbers(self.current_frame)[video_num - 1]
+        with self.session.lock:
+            name = name or next_gate(video.markers)
+            for other in [other for other, frame in video.markers.items() if frame == frame_num]:
+                del video.markers[other]
+            video.markers[name] = frame_num
+        self.markers_changed()
+        
+    def remove_markers(self, video_num, event=None):
+        """Remove the markers on the frame a video shows"""
+        video = self.session.video1 if video_num == 1 else self.session.video2
+        if video is None or self._typing(event):
+            return
+        frame_num = self.session.frame_numbers(self.current_frame)[video_num - 1]
+        with self.session.lock:
+            video.markers = {name: frame for name, frame in video.markers.items()
+                             if frame != frame_num}
+        self.markers_changed()
+        
+    def markers_changed(self):
+        """Follow new markers in the split table, the split sync and the marker label"""
+        if self.split_sync_var.get():
+            self.apply_split_sync()
+        self.refresh_splits()
+        self.update_marker_label(self.current_frame)
+        
+    def update_marker_label(self, frame_num):
+        """Show the names of the markers on the frames shown at `frame_num`"""
+        if not self.session.loaded:
+            self.marker_label.config(text="")
+            return
+        parts = []
+        videos = (self.session.video1, self.session.video2)
+        for video_num, video, shown in zip((1, 2), videos, self.session.frame_numbers(frame_num)):
+            if video is None:
+                continue
+            names = [name for name in ordered(video.markers)
+                     if video.markers[name] == shown]
+            if names:
+                parts.append(f"V{video_num} {', '.join(names)}")
+        self.marker_label.config(text="  ".join(parts))
+        
+    def refresh_splits(self):
+        """Show the current split table in the splits window, if open"""
+        if self.splits_window is None:
+            return
+        if not self.session.ready:
+            self.splits_window.set_splits([], "Load both videos to compare their splits")
+            return
+        markers1, markers2 = self.session.video1.markers, self.session.video2.markers
+        status = []
+        for label, markers, other in (("main", markers1, markers2), ("shadow", markers2, markers1)):
+            missing = [name for name in ordered(markers) if name not in other]
+            if missing:
+                status.append(f"Only in the {label} video: {', '.join(missing)}")
+        self.splits_window.set_splits(self.session.split_table(), "; ".join(status))
+        
+    def toggle_split_sync(self):
+        """Sync the shadow to the split markers, or go back to the constant offset"""
+        if not self.split_sync_var.get():
+            self.cancel_time_warp()
+            self.display_current_frame()
+            return
+        if not self.session.ready:
+            self.split_sync_var.set(False)
+            messagebox.showerror("Error", "Please load both videos first")
+            return
+        # Replaces the time warp
+        self.cancel_time_warp()
+        self.split_sync_var.set(True)
+        self.apply_split_sync()
+        
+    def apply_split_sync(self):
+        """Sync the shadow to the current split markers"""
+        try:
+            self.session.sync_to_splits()
+        except ValueError as e:
+            self.cancel_time_warp()
+            messagebox.showerror("Split Sync", str(e))
+        self.display_current_frame()
+        self.update_filmstrip()
+        
+    def detect_gates(self):
+        """Find the split gates in the gate boxes of both videos in the background"""
+        if not self.session.loaded:
+            messagebox.showerror("Error", "Please load a video first")
+            return
+        if not self.gate_rois:
+            messagebox.showinfo("Splits", "Turn on Draw gate boxes and drag a box over each "
+                                "gate on the main video, in course order")
+            return
+        for video_num, video in ((1, self.session.video1), (2, self.session.video2)):
+            if video is not None:
+                self.start_background_task(video, video_num, "gates", GateDetector,
+                                           self._gates_ready, rois=list(self.gate_rois),
+                                           index=video.index, proxy_path=video.proxy_path,
+                                           after=video.markers.get(START, -1))
+                
+    def _gates_ready(self, video, video_num, markers):
+        with self.session.lock:
+            video.markers.update(markers)
+        self.markers_changed()
+        
+    def save_splits(self):
+        """Save the split table to a CSV file"""
+        if not self.session.ready:
+            messagebox.showerror("Error", "Please load both videos first")
+            return
+        table = self.session.split_table()
+        if not table:
+            messagebox.showinfo("Splits", "Mark the same points in both videos first")
+            return
+        file_path = filedialog.asksaveasfilename(
+            title="Save Split Times",
+            defaultextension=".csv",
+            filetypes=[("CSV files", "*.csv"), ("All files", "*.*")]
+        )
+        if not file_path:
+            return
+        try:
+            write_csv(file_path, table)
+        except OSError as e:
+            messagebox.showerror("Error", f"Could not save split times: {e}")
+        
     def validate_sync_offset(self, P):
         """Validate sync offset input to prevent invalid characters"""
         if P == "":  # Allow empty string
@@ -404,20 +1410,209 @@ class GymkhanaVideoAnalyzer:
             return False
         
     def update_shadow_opacity(self, event=None):
-        self.shadow_opacity = self.opacity_var.get()
+        self.session.shadow_opacity = self.opacity_var.get()
         self.display_current_frame()
         
     def update_playback_speed(self, event=None):
-        # Speed will be applied on next play
-        pass
+        self.playback_clock.set_speed(self.speed_var.get() * self.play_direction)
         
     def on_closing(self):
-        if self.video1_cap:
-            self.video1_cap.release()
-        if self.video2_cap:
-            self.video2_cap.release()
+        self.is_playing = False
+        self.render_worker.stop()
+        for task in self.loading_tasks.values():
+            task.cancel()
+        for task in self.layer_loaders:
+            task.cancel()
+        for task in self.layer_background_tasks.values():
+            task.cancel()
+        for task in self.background_tasks.values():
+            task.cancel()
+        if self.auto_sync_task:
+            self.auto_sync_task.cancel()
+        if self.time_warp_task:
+            self.time_warp_task.cancel()
+        if self.exporter:
+            self.exporter.cancel()
+        # Delete the decoded frames of analysis mode
+        self.stop_analysis()
+        # Keep the transforms registered this session with the project
+        try:
+            self.session.save_artifacts()
+        except OSError as e:
+            print(f"Could not save project artifacts: {e}")
+        self.session.release()
         self.root.destroy()
+        
+    def open_project(self):
+        """Load the videos and settings of a project file"""
+        file_path = filedialog.askopenfilename(
+            title="Open Project",
+            filetypes=[("Gymkhana projects", "*" + PROJECT_SUFFIX), ("All files", "*.*")]
+        )
+        if not file_path:
+            return
+        try:
+            project = Project.load(file_path)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Error", f"Could not open project: {e}")
+            return
+        if not (project.video1 or project.video2):
+            messagebox.showerror("Error", "The project has no videos")
+            return
+            
+        self.cancel_time_warp()
+        for track in list(self.session.layers):
+            self.remove_shadow_layer(track)
+        for loader in self.layer_loaders:
+            loader.cancel()
+        self.layer_loaders = []
+        self._set_project(project)
+        
+        self.offset_var.set(round(project.sync_offset, 3))
+        self.opacity_var.set(project.shadow_opacity)
+        self.ghost_var.set(project.ghost)
+        self.register_var.set(project.register)
+        self.paths_var.set(project.show_paths)
+        with self.session.lock:
+            self.session.sync_offset = project.sync_offset
+            self.session.shadow_opacity = project.shadow_opacity
+            self.session.ghost = project.ghost
+            self.session.register = project.register
+            self.session.show_paths = project.show_paths
+        if project.export_ranges:
+            self.set_time_range(*project.export_ranges[0])
+            
+        # Layers and the time warp need both videos, so they wait for them
+        self.pending_project = project
+        for video_num, path in ((1, project.video1), (2, project.video2)):
+            if path:
+                self.load_video(path, video_num)
+                
+    def _apply_pending_project(self):
+        """Add an opened project's layers, time warp, riders and markers once its videos are loaded"""
+        project = self.pending_project
+        if project is None or self.loading_tasks:
+            return
+        self.pending_project = None
+        # Tracked before, so the trajectories come from the project's cache
+        for video_num, video in ((1, self.session.video1), (2, self.session.video2)):
+            track = project.tracks.get(f"video{video_num}")
+            if video is not None and track is not None:
+                self._start_tracking(video, video_num, track["box"], int(track.get("frame", 0)))
+            if video is not None:
+                with self.session.lock:
+                    video.markers = dict(project.markers.get(f"video{video_num}", {}))
+        self.markers_changed()
+        if not self.session.ready:
+            return
+        for layer in project.layers:
+            self.load_shadow_layer(layer["video"], float(layer.get("offset", 0.0)),
+                                   float(layer.get("opacity", project.shadow_opacity)))
+        if project.split_sync:
+            self.split_sync_var.set(True)
+            self.toggle_split_sync()
+        elif project.time_warp:
+            self.time_warp_var.set(True)
+            self.toggle_time_warp()
+            
+    def save_project(self):
+        """Save the videos and settings to a project file, with the analysis results next to it"""
+        if not self.session.loaded:
+            messagebox.showerror("Error", "Please load a video first")
+            return
+        initial = self.project.path if self.project else None
+        file_path = filedialog.asksaveasfilename(
+            title="Save Project As",
+            defaultextension=PROJECT_SUFFIX,
+            initialdir=str(initial.parent) if initial else None,
+            initialfile=initial.name if initial else None,
+            filetypes=[("Gymkhana projects", "*" + PROJECT_SUFFIX), ("All files", "*.*")]
+        )
+        if not file_path:
+            return
+            
+        # The GUI edits the first export range; any others are kept
+        export_ranges = [(self.start_time_var.get(), self.end_time_var.get())]
+        if self.project:
+            export_ranges += self.project.export_ranges[1:]
+        project = Project.from_session(self.session, export_ranges)
+        # Saved as on even while it is still being computed
+        project.time_warp = self.time_warp_var.get()
+        try:
+            project.save(file_path)
+        except OSError as e:
+            messagebox.showerror("Error", f"Could not save project: {e}")
+            return
+        self._set_project(project)
+        # Copy what was computed before the project had a cache
+        threading.Thread(target=self.session.save_artifacts, daemon=True).start()
+        
+    def _set_project(self, project):
+        """Make `project` the open project; analysis results go to its cache from now on"""
+        self.project = project
+        try:
+            store = project.artifact_store()
+        except OSError as e:
+            print(f"Could not create the project cache: {e}")
+            store = None
+        with self.session.lock:
+            self.session.artifacts = store
+        self.root.title(f"Gymkhana Video Analyzer - {project.path.name}")
 
+    def toggle_analysis(self):
+        if self.analysis_var.get():
+            self.start_analysis()
+        else:
+            self.stop_analysis()
+        self.display_current_frame()
+        
+    def start_analysis(self):
+        """Decode the export range of both videos at preview size into memory-mapped stores
+        
+        Frames are served from a store as soon as they are decoded, so
+        stepping gets faster while the stores fill.
+        """
+        try:
+            ranges = self.session.analysis_ranges(self.start_time_var.get(),
+                                                  self.end_time_var.get())
+            remove_stale_stores()
+            check_budget(sum(store_bytes(count, self.preview_size) for _, _, count in ranges))
+        except (ValueError, OSError, tk.TclError) as e:
+            self.stop_analysis()
+            messagebox.showerror("Analysis Mode", str(e))
+            return
+            
+        self.stop_analysis(keep_mode=True)
+        size = self.preview_size
+        for video_num, (video, first_frame, frame_count) in zip((1, 2), ranges):
+            try:
+                store = FrameStore(first_frame, frame_count, size)
+            except OSError as e:
+                self.stop_analysis()
+                messagebox.showerror("Analysis Mode", f"Could not create the frame store: {e}")
+                return
+            with self.session.lock:
+                video.set_frame_store(store)
+            self.start_background_task(video, video_num, "analysis", FrameStoreBuilder,
+                                       self._analysis_ready, store=store, index=video.index,
+                                       prepare=lambda frame: prepare_preview(frame, size))
+            
+    def stop_analysis(self, keep_mode=False):
+        """Stop filling the analysis stores and delete them"""
+        for video_num in (1, 2):
+            self.cancel_background_task(video_num, "analysis")
+        with self.session.lock:
+            for video in (self.session.video1, self.session.video2):
+                if video:
+                    video.clear_frame_store()
+        if not keep_mode:
+            self.analysis_var.set(False)
+        for video_num in (1, 2):
+            self.update_video_info(video_num)
+            
+    def _analysis_ready(self, video, video_num, store):
+        self.display_current_frame()
+        
     def set_time_range(self, start, end):
         """Set the export time range"""
         self.start_time_var.set(start)
@@ -425,27 +1620,22 @@ class GymkhanaVideoAnalyzer:
         
     def set_current_range(self):
         """Set export range around current position"""
-        if self.video1_cap:
-            current_time = self.current_frame / self.video1_fps
+        video1 = self.session.video1
+        if video1:
+            current_time = video1.time_of(self.current_frame)
             start_time = max(0, current_time - 5)
-            end_time = min(self.video1_duration, current_time + 5)
+            end_time = min(video1.duration, current_time + 5)
             self.set_time_range(start_time, end_time)
         
     def export_shadow_video(self):
         """Export the shadow video (blended video) for the specified time range"""
-        if not (self.video1_cap and self.video2_cap):
-            messagebox.showerror("Error", "Please load both videos first")
-            return
-            
         start_time = self.start_time_var.get()
         end_time = self.end_time_var.get()
         
-        if start_time >= end_time:
-            messagebox.showerror("Error", "Start time must be less than end time")
-            return
-            
-        if end_time > self.video1_duration:
-            messagebox.showerror("Error", f"End time exceeds video duration ({self.video1_duration:.1f}s)")
+        try:
+            self.session.validate_export_range(start_time, end_time)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
             return
             
         # Ask for output file
@@ -472,74 +1662,18 @@ class GymkhanaVideoAnalyzer:
     def _export_video_thread(self, output_path, start_time, end_time):
         """Export video in separate thread to avoid GUI freezing"""
         try:
-            # Calculate frame ranges
-            start_frame1 = int(start_time * self.video1_fps)
-            end_frame1 = int(end_time * self.video1_fps)
-            
-            start_frame2 = int((start_time + self.sync_offset) * self.video2_fps)
-            end_frame2 = int((end_time + self.sync_offset) * self.video2_fps)
-            
-            # Ensure frame numbers are within bounds
-            start_frame1 = max(0, min(start_frame1, self.video1_total_frames - 1))
-            end_frame1 = max(0, min(end_frame1, self.video1_total_frames - 1))
-            start_frame2 = max(0, min(start_frame2, self.video2_total_frames - 1))
-            end_frame2 = max(0, min(end_frame2, self.video2_total_frames - 1))
-            
-            # Get video properties
-            width = int(self.video1_cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-            height = int(self.video1_cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-            
-            # Create video writer
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            out = cv2.VideoWriter(output_path, fourcc, self.video1_fps, (width, height))
-            
-            total_frames = end_frame1 - start_frame1
-            current_frame = 0
-            
-            # Export frames
-            for frame_num in range(start_frame1, end_frame1):
-                # Read frame from video 1
-                self.video1_cap.set(cv2.CAP_PROP_POS_FRAMES, frame_num)
-                ret1, frame1 = self.video1_cap.read()
-                
-                if not ret1:
-                    continue
-                    
-                # Calculate corresponding frame in video 2
-                frame2_num = start_frame2 + (frame_num - start_frame1)
-                if frame2_num < self.video2_total_frames:
-                    self.video2_cap.set(cv2.CAP_PROP_POS_FRAMES, frame2_num)
-                    ret2, frame2 = self.video2_cap.read()
-                    
-                    if ret2:
-                        # Resize frame2 to match frame1 dimensions
-                        frame2 = cv2.resize(frame2, (width, height))
-                        
-                        # Create shadow effect
-                        shadow_frame = cv2.addWeighted(frame1, 1 - self.shadow_opacity, 
-                                                     frame2, self.shadow_opacity, 0)
-                        
-                        # Write frame
-                        out.write(shadow_frame)
-                    else:
-                        # If video 2 frame can't be read, use only video 1
-                        out.write(frame1)
-                else:
-                    # If video 2 frame is out of bounds, use only video 1
-                    out.write(frame1)
-                
-                # Update progress
-                current_frame += 1
-                progress = (current_frame / total_frames) * 100
-                
-                # Update GUI (must be done in main thread)
-                self.root.after(0, self._update_export_progress, progress)
-                
-            # Clean up
-            out.release()
+            self.exporter = self.session.create_exporter(output_path, start_time, end_time,
+                                                         mode=self.export_mode_var.get(),
+                                                         profile=self.export_profile_var.get())
+            
+            # Update GUI (must be done in main thread); the exporter sends a
+            # few updates per second, not one per frame
+            self.exporter.run(progress_callback=lambda progress: self.root.after(
+                0, self._update_export_progress, progress))
             
             # Export complete
-            self.root.after(0, self._export_complete, output_path)
+            self.root.after(0, self._export_complete, output_path, self.exporter.stats,
+                            self.exporter.report_path)
             
         except Exception as e:
             self.root.after(0, self._export_error, str(e))
@@ -547,17 +1681,30 @@ class GymkhanaVideoAnalyzer:
     def _update_export_progress(self, progress):
         """Update export progress bar"""
         self.export_progress_bar['value'] = progress
-        self.export_status_label.config(text=f"Exporting... {progress:.1f}%")
-        
-    def _export_complete(self, output_path):
+        status = f"Exporting... {progress:.1f}%"
+        if self.exporter:
+            stats = self.exporter.stats
+            status += f"  {stats.fps:.1f} fps  ETA {format_duration(stats.eta)}"
+            # Show how full each pipeline queue is
+            depths = self.exporter.queue_depths()
+            status += "  queues " + " ".join(f"{name} {used}/{size}"
+                                             for name, (used, size) in depths.items())
+        self.export_status_label.config(text=status)
+        
+    def _export_complete(self, output_path, stats, report_path):
         """Handle export completion"""
         self.is_exporting = False
         self.export_button.config(state='normal')
-        self.export_status_label.config(text="Export complete!")
+        average_fps = stats.frames_written / stats.elapsed if stats.elapsed > 0 else 0.0
+        self.export_status_label.config(
+            text=f"Export complete! {stats.frames_written} frames in "
+                 f"{format_duration(stats.elapsed)} ({average_fps:.1f} fps)")
         self.export_progress_bar['value'] = 100
         
-        messagebox.showinfo("Export Complete", 
-                          f"Shadow video exported successfully!\nSaved to: {output_path}")
+        message = f"Shadow video exported successfully!\nSaved to: {output_path}"
+        if report_path:
+            message += f"\nTiming report: {report_path}"
+        messagebox.showinfo("Export Complete", message)
         
     def _export_error(self, error_msg):
         """Handle export error"""
@@ -569,6 +1716,9 @@ class GymkhanaVideoAnalyzer:
         messagebox.showerror("Export Error", f"Failed to export video: {error_msg}")
 
 def main():
+    # Needed for the segmented export's worker processes in the frozen build
+    multiprocessing.freeze_support()
+    
     root = tk.Tk()
     app = GymkhanaVideoAnalyzer(root)
     
@@ -0,0 +1,125 @@
+"""
+Content-addressed cache of analysis results
+
+Frame indexes, ghost backgrounds, time warps and registration transforms
+take seconds to minutes to compute. ArtifactStore keeps them keyed by what
+a video contains rather than where it is: the content key hashes the file
+size and three 1 MB samples (start, middle and end), which takes a few
+milliseconds even for multi-gigabyte files and still matches after the
+video is moved or renamed. Results that depend on two videos (time warps,
+registration) are keyed by both content keys.
+
+Each artifact is one .npz file. Loading one marks it as recently used;
+after every save, artifacts unused for longer than the age limit are
+deleted, then the least recently used until the store fits its size limit.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+import storage
+
+
+ARTIFACT_CACHE_MB = 1024
+ARTIFACT_MAX_AGE_DAYS = 90
+
+# Bytes hashed at each of the start, middle and end of a file
+SAMPLE_BYTES = 1 << 20
+
+# Content keys by (path, size, mtime), so unchanged files are hashed once
+_content_keys = {}
+_content_keys_lock = threading.Lock()
+
+
+def content_key(path):
+    """Return a key for the contents of a file from its size and three samples"""
+    signature = (str(path),) + storage.file_signature(path)
+    with _content_keys_lock:
+        key = _content_keys.get(signature)
+    if key is not None:
+        return key
+
+    size = signature[1]
+    digest = hashlib.sha1(str(size).encode("ascii"))
+    with open(path, "rb") as f:
+        for offset in sorted({0, max(0, size // 2 - SAMPLE_BYTES // 2),
+                              max(0, size - SAMPLE_BYTES)}):
+            f.seek(offset)
+            digest.update(f.read(SAMPLE_BYTES))
+    key = digest.hexdigest()[:24]
+    with _content_keys_lock:
+        _content_keys[signature] = key
+    return key
+
+
+class ArtifactStore:
+    """Directory of analysis results keyed by kind and content keys, with size and age limits"""
+
+    def __init__(self, directory=None, max_mb=ARTIFACT_CACHE_MB,
+                 max_age_days=ARTIFACT_MAX_AGE_DAYS):
+        if directory is None:
+            directory = storage.cache_dir("artifacts")
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.max_age = max_age_days * 24 * 3600
+
+    def path(self, kind, keys):
+        """Return where the artifact of `kind` for the content keys `keys` lives"""
+        return self.directory / f"{kind}_{'_'.join(keys)}.npz"
+
+    def load(self, kind, keys):
+        """Return the arrays of an artifact as a dict, or None if it is missing"""
+        path = self.path(kind, keys)
+        try:
+            with np.load(path) as data:
+                arrays = {name: data[name] for name in data.files}
+        except (OSError, ValueError):
+            return None
+        # Mark as recently used for eviction
+        try:
+            now = time.time()
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        return arrays
+
+    def save(self, kind, keys, **arrays):
+        """Store the arrays of an artifact, then evict old ones; returns False if it failed"""
+        path = self.path(kind, keys)
+        temp_path = path.with_name(path.stem + ".part.npz")
+        try:
+            np.savez(temp_path, **arrays)
+            os.replace(temp_path, path)
+        except OSError:
+            return False
+        self.evict(keep=path)
+        return True
+
+    def evict(self, keep=None):
+        """Delete artifacts past the age limit, then least recently used ones over the size limit"""
+        entries = []
+        for path in self.directory.glob("*.npz"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        oldest_kept = time.time() - self.max_age
+        for mtime, size, path in entries:
+            if total <= self.max_bytes and mtime >= oldest_kept:
+                break
+            if keep is not None and path == keep:
+                continue
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
@@ -0,0 +1,182 @@
+"""
+Automatic sync offset estimation from the audio tracks
+
+Both cameras usually record the same sounds (engine, start beep, commentary),
+so the sync offset is the lag that best lines up the two audio tracks. The
+audio is decoded to low-rate mono PCM with ffmpeg, reduced to an onset
+envelope (how sharply the loudness rises, 1000 values per second) and the
+two envelopes are cross-correlated with an FFT. A parabola through the
+correlation peak gives the lag to a fraction of an envelope step, well
+below one video frame.
+
+Everything runs locally; a 2-minute pair takes well under a second once the
+audio is decoded.
+"""
+
+import threading
+
+import numpy as np
+
+from ffmpeg_tools import find_ffmpeg, read_output
+
+
+SAMPLE_RATE = 8000
+ENVELOPE_RATE = 1000
+MAX_OFFSET = 60.0
+
+# Peaks closer than this to the best one count as the same peak
+PEAK_EXCLUSION = 0.1
+
+
+class SyncCancelled(Exception):
+    """Raised when an audio sync estimation is cancelled"""
+
+
+class SyncEstimate:
+    """Estimated sync offset in seconds and a confidence between 0 and 1
+
+    The confidence compares the best correlation peak with the best one
+    elsewhere: near 1 the match is unambiguous, near 0 another lag fits
+    about as well and the offset should be checked by eye.
+    """
+
+    def __init__(self, offset, confidence):
+        self.offset = offset
+        self.confidence = confidence
+
+    def __repr__(self):
+        return f"SyncEstimate(offset={self.offset:.4f}, confidence={self.confidence:.2f})"
+
+
+def extract_audio(video_path, sample_rate=SAMPLE_RATE, cancel_event=None):
+    """Decode the first audio track of a video to mono float samples"""
+    ffmpeg = find_ffmpeg()
+    if not ffmpeg:
+        raise RuntimeError("ffmpeg is required to read audio tracks")
+
+    cmd = [ffmpeg, "-loglevel", "error", "-i", str(video_path), "-map", "0:a:0",
+           "-vn", "-ac", "1", "-ar", str(sample_rate), "-f", "s16le", "-"]
+    result = read_output(cmd, cancel_event)
+    if result is None:
+        raise SyncCancelled()
+    returncode, data, stderr = result
+    if returncode != 0:
+        raise IOError(f"Could not read audio from {video_path}: "
+                      f"{stderr.decode(errors='replace').strip()}")
+
+    samples = np.frombuffer(data[:len(data) // 2 * 2], dtype="<i2")
+    if not len(samples):
+        raise IOError(f"Video has no audio: {video_path}")
+    return samples.astype(np.float32) / 32768.0
+
+
+def onset_envelope(samples, sample_rate=SAMPLE_RATE, envelope_rate=ENVELOPE_RATE):
+    """Return the onset strength of `samples` at `envelope_rate` values per second
+
+    Log energy per step, differentiated and half-wave rectified, so sharp
+    rises in loudness dominate and the overall level of each microphone
+    does not matter. The result has zero mean and unit variance.
+    """
+    hop = max(1, int(round(sample_rate / envelope_rate)))
+    steps = len(samples) // hop
+    if steps < 2:
+        return np.zeros(0, dtype=np.float64)
+    energy = np.square(samples[:steps * hop].astype(np.float64)).reshape(steps, hop).mean(axis=1)
+    log_energy = np.log10(energy + 1e-10)
+    onsets = np.maximum(np.diff(log_energy, prepend=log_energy[0]), 0.0)
+    onsets -= onsets.mean()
+    std = onsets.std()
+    return onsets / std if std > 0 else onsets
+
+
+def _parabolic_peak(values, i):
+    """Return the sub-sample position of the peak at index `i`"""
+    if i <= 0 or i >= len(values) - 1:
+        return float(i)
+    left, centre, right = values[i - 1], values[i], values[i + 1]
+    denominator = left - 2 * centre + right
+    if denominator == 0:
+        return float(i)
+    return i + 0.5 * (left - right) / denominator
+
+
+def estimate_lag(envelope1, envelope2, rate=ENVELOPE_RATE, max_offset=MAX_OFFSET):
+    """Return the SyncEstimate that best aligns `envelope2` with `envelope1`
+
+    A positive offset means an event at time t in video 1 happens at
+    t + offset in video 2, which is how ShadowSession.sync_offset works.
+    """
+    if not len(envelope1) or not len(envelope2):
+        raise ValueError("Audio tracks are too short to sync")
+
+    size = 1 << int(np.ceil(np.log2(len(envelope1) + len(envelope2))))
+    spectrum = np.conj(np.fft.rfft(envelope1, size)) * np.fft.rfft(envelope2, size)
+    # correlation[k] = sum(envelope1[n] * envelope2[n + k]), negative k wrapped to the end
+    correlation = np.fft.irfft(spectrum, size)
+
+    max_lag = int(max_offset * rate)
+    positive = min(max_lag, len(envelope2) - 1)
+    negative = min(max_lag, len(envelope1) - 1)
+    lags = np.concatenate([correlation[size - negative:], correlation[:positive + 1]])
+
+    best = int(np.argmax(lags))
+    peak = lags[best]
+    lag = _parabolic_peak(lags, best) - negative
+
+    exclusion = int(PEAK_EXCLUSION * rate)
+    others = np.concatenate([lags[:max(0, best - exclusion)], lags[best + exclusion + 1:]])
+    if peak <= 0:
+        confidence = 0.0
+    elif not len(others):
+        confidence = 1.0
+    else:
+        confidence = float(np.clip(1.0 - max(others.max(), 0.0) / peak, 0.0, 1.0))
+    return SyncEstimate(lag / rate, confidence)
+
+
+def estimate_offset(video1_path, video2_path, max_offset=MAX_OFFSET,
+                    progress_callback=None, cancel_event=None):
+    """Return the SyncEstimate for two videos from their audio tracks"""
+    envelopes = []
+    for i, path in enumerate((video1_path, video2_path)):
+        samples = extract_audio(path, cancel_event=cancel_event)
+        envelopes.append(onset_envelope(samples))
+        if progress_callback:
+            progress_callback((i + 1) * 45.0)
+    if cancel_event is not None and cancel_event.is_set():
+        raise SyncCancelled()
+    estimate = estimate_lag(envelopes[0], envelopes[1], max_offset=max_offset)
+    if progress_callback:
+        progress_callback(100.0)
+    return estimate
+
+
+class AutoSync:
+    """Estimate the sync offset of two videos on a background thread
+
+    `on_progress(percent)` and `on_done(estimate_or_None, error_or_None)` are
+    called from the worker thread.
+    """
+
+    def __init__(self, video1_path, video2_path, on_done, on_progress=None):
+        self.video1_path = video1_path
+        self.video2_path = video2_path
+        self._cancel_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(on_done, on_progress),
+                                        daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def _run(self, on_done, on_progress):
+        try:
+            estimate = estimate_offset(self.video1_path, self.video2_path,
+                                       progress_callback=on_progress,
+                                       cancel_event=self._cancel_event)
+        except SyncCancelled:
+            return
+        except Exception as e:
+            on_done(None, e)
+            return
+        on_done(estimate, None)
@@ -0,0 +1,98 @@
+"""
+Micro-benchmark: per-frame blend cost, allocating vs. preallocated
+
+Compares the original per-frame path (resize + addWeighted + cvtColor,
+each allocating a new array) with BlendEngine at 1080p and 4K, and shows
+a numpy fixed-point blend for reference. Run from the repository root:
+
+    python benchmarks/bench_blend.py [--frames 100]
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from blend import BlendEngine, FramePool  # noqa: E402
+
+
+RESOLUTIONS = {"1080p": (1920, 1080), "4K": (3840, 2160)}
+OPACITY = 0.5
+
+
+def original_blend(frame1, frame2, opacity):
+    """The blend as export and preview did it before BlendEngine"""
+    if frame2.shape != frame1.shape:
+        frame2 = cv2.resize(frame2, (frame1.shape[1], frame1.shape[0]))
+    shadow = cv2.addWeighted(frame1, 1 - opacity, frame2, opacity, 0)
+    return cv2.cvtColor(shadow, cv2.COLOR_BGR2RGB)
+
+
+def fixed_point_blend(frame1, frame2, opacity, out):
+    """8.8 fixed-point blend in numpy, for comparison with cv2.addWeighted"""
+    weight = int(round(opacity * 256))
+    mixed = frame1.astype(np.uint16) * (256 - weight)
+    mixed += frame2.astype(np.uint16) * weight
+    mixed += 128
+    np.right_shift(mixed, 8, out=mixed)
+    np.copyto(out, mixed, casting="unsafe")
+    return out
+
+
+def measure(blend, frames):
+    """Return (ms per frame, KiB allocated per frame)"""
+    blend()  # warm up scratch buffers and pools
+    start = time.perf_counter()
+    for _ in range(frames):
+        blend()
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    blend()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed / frames * 1000, (peak - before) / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--frames", type=int, default=100)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'resolution':<10} {'path':<22} {'ms/frame':>9} {'KiB alloc/frame':>16}")
+    for name, (width, height) in RESOLUTIONS.items():
+        frame1 = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        # Video 2 at a different size, as in the export
+        frame2 = rng.integers(0, 256, (height * 3 // 4, width * 3 // 4, 3), dtype=np.uint8)
+        same_size = cv2.resize(frame2, (width, height))
+
+        engine = BlendEngine()
+        pooled = BlendEngine(FramePool())
+        out = np.empty_like(frame1)
+
+        def pooled_blend():
+            pooled.release(pooled.blend(frame1, frame2, OPACITY))
+
+        cases = [
+            ("original", lambda: original_blend(frame1, frame2, OPACITY)),
+            ("BlendEngine", lambda: engine.blend(frame1, frame2, OPACITY)),
+            ("BlendEngine + pool", pooled_blend),
+            ("BlendEngine opacity 0", lambda: engine.blend(frame1, frame2, 0.0)),
+            ("numpy fixed-point", lambda: fixed_point_blend(frame1, same_size, OPACITY, out)),
+        ]
+        for label, blend in cases:
+            ms, kib = measure(blend, args.frames)
+            print(f"{name:<10} {label:<22} {ms:9.2f} {kib:16.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Micro-benchmark: putting preview frames on a Tk canvas
+
+Compares the old display path (a new PhotoImage and a new canvas item per
+frame) with CanvasDisplay (one PhotoImage and item per canvas, updated with
+paste). Times are per frame including Tk drawing the canvas; the old path
+is reported for the first and last batch of frames to show it slowing
+down as canvas items pile up. Needs a display. Run from the repository root:
+
+    python benchmarks/bench_display.py [--frames 600] [--size 1280x720]
+"""
+
+import argparse
+import os
+import sys
+import time
+import tkinter as tk
+
+import numpy as np
+from PIL import Image, ImageTk
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from display import CanvasDisplay  # noqa: E402
+
+
+BATCH = 100
+
+
+def make_frames(width, height, count=8):
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 256, (height, width, 3), dtype=np.uint8) for _ in range(count)]
+
+
+def run_frames(root, show, frames, total):
+    """Show `total` frames and return the seconds each batch of BATCH frames took"""
+    batches = []
+    start = time.perf_counter()
+    for n in range(total):
+        show(frames[n % len(frames)])
+        root.update()
+        if (n + 1) % BATCH == 0:
+            now = time.perf_counter()
+            batches.append(now - start)
+            start = now
+    return batches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--frames", type=int, default=600)
+    parser.add_argument("--size", default="640x360", help="frame size, WIDTHxHEIGHT")
+    args = parser.parse_args(argv)
+    args.frames = max(BATCH, args.frames)
+    width, height = (int(v) for v in args.size.split("x"))
+    frames = make_frames(width, height)
+
+    root = tk.Tk()
+    canvas = tk.Canvas(root, width=width, height=height, bg="black")
+    canvas.pack()
+    root.update()
+
+    photos = []
+
+    def show_old(frame):
+        photo = ImageTk.PhotoImage(Image.fromarray(frame))
+        photos[:] = [photo]
+        canvas.create_image(width // 2, height // 2, image=photo, anchor=tk.CENTER)
+
+    old = run_frames(root, show_old, frames, args.frames)
+    old_items = len(canvas.find_all())
+    canvas.delete("all")
+
+    display = CanvasDisplay(canvas)
+    new = run_frames(root, display.show, frames, args.frames)
+    new_items = len(canvas.find_all())
+    root.destroy()
+
+    def per_frame(seconds):
+        return seconds * 1000.0 / BATCH
+
+    print(f"{width}x{height}, {args.frames} frames")
+    print(f"  create_image per frame: first {per_frame(old[0]):6.2f} ms, "
+          f"last {per_frame(old[-1]):6.2f} ms, {old_items} canvas items left")
+    print(f"  CanvasDisplay.paste:    first {per_frame(new[0]):6.2f} ms, "
+          f"last {per_frame(new[-1]):6.2f} ms, {new_items} canvas items left")
+
+
+if __name__ == "__main__":
+    main()
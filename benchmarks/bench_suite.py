@@ -0,0 +1,385 @@
+"""
+Benchmark suite: preview and export hot paths on synthetic videos
+
+For each scenario (a pair of synthetic videos of a given resolution, frame
+rate and GOP structure) measures:
+
+- load: ShadowSession.load_video, and building the FrameIndex
+- seek: random-seek latency of VideoSource.read_frame, nominal and indexed
+- render: latency of ShadowSession.render, which is everything
+  display_current_frame does except the Tk blit, cold (nothing cached),
+  cold from a preview proxy, and warm (frames cached)
+- playback: sequential render throughput with read-ahead, as during play
+- export: frames per second of every export mode, with the per-stage
+  times from the export's ExportStats (the work _export_video_thread runs)
+- tracking: how many times faster than real time the main video's rider
+  is tracked from a box around it, and the tracked centre's error against
+  where the synthetic rider really is
+- gates: how many times faster than real time split gates are detected in
+  three gate boxes across the course, and how many frames the markers are
+  off from where the synthetic rider enters each box
+
+Results go to a JSON file, so runs on different releases, machines and
+modes can be compared; `--baseline` prints the change against an earlier
+result file. Run from the repository root:
+
+    python benchmarks/bench_suite.py [--scenarios 720p30 1080p60] [--output results.json]
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from encoders import DEFAULT_PROFILE, EXPORT_PROFILES  # noqa: E402
+from engine import EXPORT_MODES, PREVIEW_SIZE, ShadowSession  # noqa: E402
+from export_engine import keyframe_numbers  # noqa: E402
+from export_stats import machine_info  # noqa: E402
+from ffmpeg_tools import find_ffmpeg  # noqa: E402
+from frame_index import build_index  # noqa: E402
+from proxy import transcode_proxy  # noqa: E402
+from splits import detect_gates, gate_name  # noqa: E402
+from synthetic import VideoSpec, ensure_video, keyframe_interval, rider_box  # noqa: E402
+from tracking import track_rider  # noqa: E402
+
+
+RESULTS_VERSION = 1
+
+# Main and shadow video of each scenario; the shadow starts a little later
+# in the run, and in 1080p60 has a different frame rate
+SCENARIOS = {
+    "720p30": lambda d: (VideoSpec(1280, 720, 30, d), VideoSpec(1280, 720, 30, d, phase=0.03)),
+    "1080p60": lambda d: (VideoSpec(1920, 1080, 60, d), VideoSpec(1920, 1080, 30, d, phase=0.03)),
+    "1080p30-intra": lambda d: (VideoSpec(1920, 1080, 30, d, codec="MJPG"),
+                                VideoSpec(1920, 1080, 30, d, codec="MJPG", phase=0.03)),
+    "1080p30-gop120": lambda d: (VideoSpec(1920, 1080, 30, d, key_interval=120),
+                                 VideoSpec(1920, 1080, 30, d, key_interval=120, phase=0.03)),
+    "4k30": lambda d: (VideoSpec(3840, 2160, 30, d), VideoSpec(3840, 2160, 30, d, phase=0.03)),
+}
+DEFAULT_SCENARIOS = ["720p30", "1080p60", "1080p30-intra", "1080p30-gop120"]
+
+
+def latency_summary(seconds):
+    """Return mean/p50/p95/max of a list of durations, in milliseconds"""
+    ms = np.asarray(seconds, dtype=np.float64) * 1000.0
+    return {
+        "samples": len(ms),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+def timed(function, *args, **kwargs):
+    """Return (seconds, result) of one call"""
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def bench_load(paths, repeats):
+    """Time opening both videos in a session, and indexing them"""
+    load_times = []
+    for _ in range(repeats):
+        session = ShadowSession()
+        try:
+            start = time.perf_counter()
+            session.load_video(paths[0], 1)
+            session.load_video(paths[1], 2)
+            load_times.append(time.perf_counter() - start)
+        finally:
+            session.release()
+    index_seconds, _ = timed(build_index, paths[0])
+    return {"load_video_pair": latency_summary(load_times),
+            "index_build_s": round(index_seconds, 4)}
+
+
+def bench_seek(session, samples, rng):
+    """Random-seek latency of the main video, nominal and with its index"""
+    video = session.video1
+    frames = [rng.randrange(video.total_frames) for _ in range(samples)]
+    results = {}
+    for name, index in (("nominal", None), ("indexed", build_index(video.path))):
+        if index is not None:
+            video.set_index(index)
+        times = [timed(video.read_frame, frame_num)[0] for frame_num in frames]
+        results[name] = latency_summary(times)
+    return results
+
+
+def _reset_previews(session):
+    """Stop read-ahead and drop cached frames, so the next render decodes"""
+    for video in (session.video1, session.video2):
+        video._reset_preview()
+
+
+def _render_latency(session, frames, cold):
+    times = []
+    for frame_num in frames:
+        if cold:
+            _reset_previews(session)
+        seconds, rendered = timed(session.render, frame_num, PREVIEW_SIZE)
+        if rendered is not None:
+            session.release_frame(rendered[1])
+        times.append(seconds)
+    return latency_summary(times)
+
+
+def bench_render(session, samples, rng, proxy_dir):
+    """Preview render latency: cold, cold from proxies, and warm"""
+    frames = [rng.randrange(session.video1.total_frames) for _ in range(samples)]
+    results = {"cold": _render_latency(session, frames, cold=True)}
+    # Same frames again: now cached
+    _render_latency(session, frames, cold=False)
+    results["warm"] = _render_latency(session, frames, cold=False)
+
+    proxy_seconds = 0.0
+    for n, video in enumerate((session.video1, session.video2)):
+        proxy_path = os.path.join(proxy_dir, f"proxy{n}.avi")
+        seconds, _ = timed(transcode_proxy, video.path, proxy_path)
+        proxy_seconds += seconds
+        video.set_proxy(proxy_path)
+    results["cold_proxy"] = _render_latency(session, frames, cold=True)
+    results["proxy_build_s"] = round(proxy_seconds, 4)
+    for video in (session.video1, session.video2):
+        video.clear_proxy()
+    return results
+
+
+def bench_playback(session, frames):
+    """Render consecutive frames as fast as possible, with read-ahead running"""
+    _reset_previews(session)
+    frames = min(frames, session.video1.total_frames)
+    start = time.perf_counter()
+    for frame_num in range(frames):
+        rendered = session.render(frame_num, PREVIEW_SIZE)
+        if rendered is not None:
+            session.release_frame(rendered[1])
+    elapsed = time.perf_counter() - start
+    _reset_previews(session)
+    return {"frames": frames, "seconds": round(elapsed, 4),
+            "fps": round(frames / elapsed, 2) if elapsed > 0 else None}
+
+
+def bench_export(session, modes, profile, duration, output_dir):
+    """Export the first `duration` seconds with every mode"""
+    results = {}
+    end_time = min(duration, session.video1.duration)
+    for mode in modes:
+        output_path = os.path.join(output_dir, f"export-{mode}.mp4")
+        exporter = session.create_exporter(output_path, 0.0, end_time, mode=mode,
+                                           profile=profile)
+        try:
+            seconds, written = timed(exporter.run)
+        except Exception as e:
+            results[mode] = {"error": str(e)}
+            continue
+        report = exporter.stats.report()
+        results[mode] = {
+            "frames": written,
+            "seconds": round(seconds, 4),
+            "fps": round(written / seconds, 2) if seconds > 0 else None,
+            "stages": report["stages"],
+            "writer": report["export"].get("writer"),
+        }
+    return results
+
+
+def bench_tracking(spec, path):
+    """Track the synthetic rider from a box around it in the first frame"""
+    x, y, width, height = rider_box(spec, 0)
+    margin = width // 4
+    box = ((x - margin) / spec.width, (y - margin) / spec.height,
+           (x + width + margin) / spec.width, (y + height + margin) / spec.height)
+    seconds, trajectory = timed(track_rider, path, box)
+    positions = trajectory.positions
+    truth = np.array([rider_box(spec, n) for n in range(len(positions))], dtype=np.float64)
+    centres = truth[:, :2] + truth[:, 2:] / 2
+    # The rider wraps around to the start of the course, which the tracker
+    # may only find again later; count frames where it was found
+    found = positions["found"]
+    errors = np.hypot(positions["x"][found] * spec.width - centres[found, 0],
+                      positions["y"][found] * spec.height - centres[found, 1])
+    return {"frames": len(positions), "seconds": round(seconds, 4),
+            "realtime": round(len(positions) / spec.fps / seconds, 2) if seconds > 0 else None,
+            "found": round(float(found.mean()), 4),
+            "mean_error_px": round(float(errors.mean()), 2) if len(errors) else None}
+
+
+def bench_gates(spec, path):
+    """Detect the synthetic rider passing gate boxes at a quarter, half and three quarters"""
+    rois = [(x - 0.015, 0.35, x + 0.015, 0.8) for x in (0.25, 0.5, 0.75)]
+    seconds, markers = timed(detect_gates, path, rois)
+    riders = [rider_box(spec, n) for n in range(spec.frames)]
+    errors = []
+    for number, (x0, _, x1, _) in enumerate(rois, 1):
+        # First frame the rider overlaps the box
+        truth = next((n for n, (x, _, width, _) in enumerate(riders)
+                      if x + width > x0 * spec.width and x < x1 * spec.width), None)
+        found = markers.get(gate_name(number))
+        if truth is not None and found is not None:
+            errors.append(abs(found - truth))
+    return {"frames": spec.frames, "seconds": round(seconds, 4),
+            "realtime": round(spec.frames / spec.fps / seconds, 2) if seconds > 0 else None,
+            "gates_found": f"{len(markers)}/{len(rois)}",
+            "mean_error_frames": round(float(np.mean(errors)), 2) if errors else None}
+
+
+def run_scenario(name, args, video_dir, work_dir):
+    main_spec, shadow_spec = SCENARIOS[name](args.duration)
+    print(f"{name}: writing synthetic videos", file=sys.stderr)
+    paths = [ensure_video(spec, video_dir) for spec in (main_spec, shadow_spec)]
+    rng = random.Random(args.seed)
+
+    result = {
+        "videos": [{
+            "file": os.path.basename(path),
+            "width": spec.width,
+            "height": spec.height,
+            "fps": spec.fps,
+            "frames": spec.frames,
+            "codec": spec.codec,
+            "requested_key_interval": spec.key_interval,
+            "key_interval": keyframe_interval(keyframe_numbers(path)),
+        } for spec, path in zip((main_spec, shadow_spec), paths)],
+    }
+
+    print(f"{name}: load", file=sys.stderr)
+    result["load"] = bench_load(paths, args.repeats)
+
+    session = ShadowSession(sync_offset=0.5, shadow_opacity=0.5)
+    try:
+        session.load_video(paths[0], 1)
+        session.load_video(paths[1], 2)
+        print(f"{name}: render", file=sys.stderr)
+        result["render"] = bench_render(session, args.samples, rng, work_dir)
+        print(f"{name}: playback", file=sys.stderr)
+        result["playback"] = bench_playback(session, args.playback_frames)
+        print(f"{name}: seek", file=sys.stderr)
+        result["seek"] = bench_seek(session, args.samples, rng)
+        # Exports with the index, like the GUI once indexing finished
+        session.video2.set_index(build_index(paths[1]))
+        print(f"{name}: export", file=sys.stderr)
+        result["export"] = bench_export(session, args.modes, args.profile,
+                                        args.export_seconds, work_dir)
+        print(f"{name}: tracking", file=sys.stderr)
+        result["tracking"] = bench_tracking(main_spec, paths[0])
+        print(f"{name}: gates", file=sys.stderr)
+        result["gates"] = bench_gates(main_spec, paths[0])
+    finally:
+        session.release()
+    return result
+
+
+def _git_commit():
+    try:
+        output = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return None
+    return output.stdout.strip() or None
+
+
+def _metrics(results):
+    """Yield (name, value, higher_is_better) for the headline numbers of a result file"""
+    for scenario, result in results["scenarios"].items():
+        yield f"{scenario} load", result["load"]["load_video_pair"]["p50_ms"], False
+        for name, summary in result["seek"].items():
+            yield f"{scenario} seek {name}", summary["p50_ms"], False
+        for name in ("cold", "cold_proxy", "warm"):
+            yield f"{scenario} render {name}", result["render"][name]["p50_ms"], False
+        yield f"{scenario} playback fps", result["playback"]["fps"], True
+        for mode, export in result["export"].items():
+            if "fps" in export:
+                yield f"{scenario} export {mode} fps", export["fps"], True
+        if "tracking" in result:
+            yield f"{scenario} tracking x realtime", result["tracking"]["realtime"], True
+        if "gates" in result:
+            yield f"{scenario} gates x realtime", result["gates"]["realtime"], True
+
+
+def compare(results, baseline):
+    """Print each headline number next to the baseline's"""
+    previous = {name: value for name, value, _ in _metrics(baseline)}
+    print(f"{'metric':40} {'baseline':>10} {'now':>10} {'change':>8}")
+    for name, value, higher_is_better in _metrics(results):
+        old = previous.get(name)
+        if old is None or value is None or not old:
+            print(f"{name:40} {'-':>10} {value!s:>10}")
+            continue
+        change = (value - old) / old * 100.0
+        worse = change < 0 if higher_is_better else change > 0
+        flag = "  worse" if worse and abs(change) > 10 else ""
+        print(f"{name:40} {old:10.2f} {value:10.2f} {change:+7.1f}%{flag}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS),
+                        default=DEFAULT_SCENARIOS)
+    parser.add_argument("--duration", type=float, default=8.0,
+                        help="length of the synthetic videos in seconds (default 8)")
+    parser.add_argument("--samples", type=int, default=30,
+                        help="random frames per latency measurement (default 30)")
+    parser.add_argument("--repeats", type=int, default=5,
+                        help="times each load is repeated (default 5)")
+    parser.add_argument("--playback-frames", type=int, default=240)
+    parser.add_argument("--export-seconds", type=float, default=4.0,
+                        help="length of each export (default 4)")
+    parser.add_argument("--modes", nargs="+", choices=EXPORT_MODES, default=None,
+                        help="export modes (default: all; segmented only with ffmpeg)")
+    parser.add_argument("--profile", choices=list(EXPORT_PROFILES), default=DEFAULT_PROFILE)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--video-dir", help="keep the synthetic videos here and reuse them")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="earlier result file to compare with")
+    args = parser.parse_args(argv)
+    if args.modes is None:
+        args.modes = [mode for mode in EXPORT_MODES if mode != "segmented" or find_ffmpeg()]
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    work_dir = tempfile.mkdtemp(prefix="gymkhana_bench_")
+    video_dir = args.video_dir or os.path.join(work_dir, "videos")
+    os.makedirs(video_dir, exist_ok=True)
+    try:
+        scenarios = {name: run_scenario(name, args, video_dir, work_dir)
+                     for name in args.scenarios}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    results = {
+        "version": RESULTS_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": _git_commit(),
+        "machine": machine_info(),
+        "ffmpeg": find_ffmpeg(),
+        "settings": {key: value for key, value in vars(args).items()
+                     if key not in ("output", "baseline", "video_dir")},
+        "scenarios": scenarios,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            compare(results, json.load(f))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
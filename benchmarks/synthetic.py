@@ -0,0 +1,110 @@
+"""
+Synthetic test videos for the benchmarks
+
+Writes a run-like clip with cv2.VideoWriter only, so no footage or ffmpeg
+is needed: a static textured course with a bright "rider" moving across
+it, plus a little per-frame noise so the encoder cannot skip frames.
+
+The GOP structure comes from the codec: MJPG is all keyframes, mp4v
+inserts one every 12 frames with the FFmpeg backend. A requested keyframe
+interval is passed to OpenCV (VIDEOWRITER_PROP_KEY_INTERVAL), which some
+backends honour; the interval actually written is measured and reported.
+"""
+
+import os
+
+import cv2
+import numpy as np
+
+
+class VideoSpec:
+    """Size, frame rate, duration and codec of one synthetic video"""
+
+    def __init__(self, width, height, fps, duration, codec="mp4v", key_interval=None,
+                 phase=0.0):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.duration = duration
+        self.codec = codec
+        self.key_interval = key_interval
+        # Where the rider starts, as a fraction of the run, so the two
+        # videos of a pair differ
+        self.phase = phase
+
+    @property
+    def frames(self):
+        return int(round(self.duration * self.fps))
+
+    @property
+    def extension(self):
+        return ".avi" if self.codec == "MJPG" else ".mp4"
+
+    def file_name(self):
+        gop = f"-k{self.key_interval}" if self.key_interval else ""
+        return (f"synthetic-{self.width}x{self.height}-{self.fps:g}fps-{self.duration:g}s-"
+                f"{self.codec}{gop}-p{self.phase:g}{self.extension}")
+
+
+def _course(width, height, seed=1):
+    """A static background with enough texture to cost something to decode"""
+    rng = np.random.default_rng(seed)
+    small = rng.integers(40, 200, (max(2, height // 16), max(2, width // 16), 3), dtype=np.uint8)
+    course = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    # Cones along the course
+    for x in range(width // 10, width, width // 8):
+        cv2.circle(course, (x, height * 2 // 3), max(2, height // 60), (0, 140, 255), -1)
+    return course
+
+
+def rider_box(spec, frame_num):
+    """Return the (x, y, width, height) in pixels of the rider in a frame"""
+    rider_size = max(4, spec.height // 12)
+    progress = (spec.phase + frame_num / max(1, spec.frames - 1)) % 1.0
+    x = int(progress * (spec.width - rider_size))
+    y = int(spec.height * 0.55 + spec.height * 0.1 * np.sin(progress * 12))
+    return x, y, rider_size, rider_size
+
+
+def write_video(spec, path):
+    """Write the video described by `spec` to `path` and return the path"""
+    params = []
+    if spec.key_interval:
+        params = [cv2.VIDEOWRITER_PROP_KEY_INTERVAL, int(spec.key_interval)]
+    out = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*spec.codec), spec.fps,
+                          (spec.width, spec.height), params)
+    if not out.isOpened():
+        raise IOError(f"OpenCV cannot write {spec.codec} video to {path}")
+
+    course = _course(spec.width, spec.height)
+    rng = np.random.default_rng(2)
+    noise = rng.integers(0, 6, (spec.height, spec.width, 3), dtype=np.uint8)
+    frame = np.empty_like(course)
+    try:
+        for n in range(spec.frames):
+            np.add(course, np.roll(noise, n * 7, axis=1), out=frame)
+            x, y, rider_size, _ = rider_box(spec, n)
+            cv2.rectangle(frame, (x, y), (x + rider_size, y + rider_size), (240, 240, 240), -1)
+            cv2.putText(frame, str(n), (10, spec.height - 10), cv2.FONT_HERSHEY_SIMPLEX,
+                        max(0.5, spec.height / 720), (255, 255, 255), 2)
+            out.write(frame)
+    finally:
+        out.release()
+    return str(path)
+
+
+def ensure_video(spec, directory):
+    """Return the path of the video for `spec` in `directory`, writing it if missing"""
+    path = os.path.join(directory, spec.file_name())
+    if not os.path.exists(path):
+        temp_path = path + ".part" + spec.extension
+        write_video(spec, temp_path)
+        os.replace(temp_path, path)
+    return path
+
+
+def keyframe_interval(keyframes):
+    """Return the median distance between keyframes, or None if unknown"""
+    if not keyframes or len(keyframes) < 2:
+        return None
+    return float(np.median(np.diff(keyframes)))
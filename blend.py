@@ -0,0 +1,313 @@
+"""
+Shadow blending into reusable buffers
+
+cv2.resize, cv2.cvtColor and cv2.addWeighted allocate a new array per call
+unless given a destination. BlendEngine passes `dst=` everywhere so steady
+playback and export allocate nothing per frame. FramePool hands out
+buffers when a blended frame has to outlive the call (e.g. while it waits
+in a queue for the encoder or for the Tk thread).
+
+Opacities so close to 0 or 1 that the 8-bit result equals one input
+exactly skip the arithmetic and return that input.
+
+More than one shadow layer is composited in a single float32 accumulator
+(each layer over everything below it) and rounded to 8 bits once, instead
+of rounding after every layer.
+
+The ghost composite blends only the moving rider of a shadow layer: the
+pixels that differ from the layer's static background (ghost.py) by more
+than GHOST_THRESHOLD, with specks removed and the edges grown a little.
+"""
+
+import math
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+# Below this weight the other frame moves no pixel by half a level or more
+EXACT_WEIGHT = 0.5 / 255
+
+# Gray level difference from the background above which a pixel is the rider
+GHOST_THRESHOLD = 28
+
+# Pixels the rider mask is grown by per 360 rows of mask
+GHOST_GROW = 2
+
+
+def trivial_blend(frame1, frame2, opacity):
+    """Return the input equal to the blend result, or None if both contribute"""
+    if opacity < EXACT_WEIGHT:
+        return frame1
+    if 1 - opacity < EXACT_WEIGHT and frame1.shape == frame2.shape:
+        return frame2
+    return None
+
+
+class FramePool:
+    """Thread-safe pool of reusable frame buffers"""
+
+    def __init__(self, max_free=8):
+        self.max_free = max_free
+        self.allocated = 0
+        self._free = {}
+        # Buffers handed out, by id; holding them keeps their ids unique
+        self._owned = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, shape, dtype=np.uint8):
+        """Return a buffer of `shape`, reusing a released one when possible"""
+        key = (tuple(shape), np.dtype(dtype))
+        with self._lock:
+            free = self._free.get(key)
+            if free:
+                return free.pop()
+            self.allocated += 1
+        buffer = np.empty(shape, dtype)
+        with self._lock:
+            self._owned[id(buffer)] = buffer
+        return buffer
+
+    def release(self, buffer):
+        """Return a buffer to the pool; arrays the pool did not hand out are ignored"""
+        if buffer is None:
+            return
+        with self._lock:
+            if id(buffer) not in self._owned:
+                return
+            free = self._free.setdefault((buffer.shape, buffer.dtype), [])
+            if len(free) < self.max_free:
+                free.append(buffer)
+            else:
+                del self._owned[id(buffer)]
+
+
+class BlendEngine:
+    """Blend shadow frames over main frames without per-frame allocations
+
+    Not thread-safe: give each thread its own engine. Without a pool the
+    result of blend() is overwritten by the next call; with a pool it is a
+    pooled buffer the caller releases once done with it. With `stats` (an
+    ExportStats) the time spent resizing and blending is recorded.
+    """
+
+    def __init__(self, pool=None, stats=None):
+        self.pool = pool
+        self.stats = stats
+        self._dst = None
+        # Resize and warp scratch buffers, by layer
+        self._resized = {}
+        self._accumulator = None
+        # Ghost composite scratch buffers by name, and mask kernels by size
+        self._scratch = {}
+        self._kernels = {}
+
+    def _output(self, shape):
+        if self.pool is not None:
+            return self.pool.acquire(shape)
+        if self._dst is None or self._dst.shape != shape:
+            self._dst = np.empty(shape, np.uint8)
+        return self._dst
+
+    def resize_to(self, frame, shape, layer=0):
+        """Resize `frame` to `shape` into layer's scratch buffer, reused by the next call"""
+        if frame.shape == shape:
+            return frame
+        scratch = self._resized.get(layer)
+        if scratch is None or scratch.shape != shape:
+            scratch = self._resized[layer] = np.empty(shape, np.uint8)
+        height, width = shape[:2]
+        start = time.perf_counter()
+        resized = cv2.resize(frame, (width, height), dst=scratch)
+        if self.stats is not None:
+            self.stats.add("resize", time.perf_counter() - start)
+        return resized
+
+    def warp_to(self, frame, shape, matrix, layer=0):
+        """Warp `frame` to `shape` with a relative-coordinate transform (registration.py)
+
+        Scaling to `shape` is part of the warp, so a registered frame needs
+        no separate resize. The result is layer's scratch buffer, reused by
+        the next call. With no matrix this is resize_to().
+        """
+        if matrix is None:
+            return self.resize_to(frame, shape, layer)
+        scratch = self._resized.get(layer)
+        if scratch is None or scratch.shape != shape:
+            scratch = self._resized[layer] = np.empty(shape, np.uint8)
+        height, width = shape[:2]
+        to_pixels = np.diag([float(width), float(height), 1.0])
+        from_pixels = np.diag([1.0 / frame.shape[1], 1.0 / frame.shape[0], 1.0])
+        pixel_matrix = (to_pixels @ matrix @ from_pixels)[:2]
+        start = time.perf_counter()
+        # Edges the shadow camera did not see repeat the nearest pixels
+        # instead of blending black over the main video
+        warped = cv2.warpAffine(frame, pixel_matrix, (width, height), dst=scratch,
+                                flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+        if self.stats is not None:
+            self.stats.add("warp", time.perf_counter() - start)
+        return warped
+
+    def _is_scratch(self, frame):
+        return any(frame is scratch for scratch in self._resized.values())
+
+    def writable(self, frame, inputs):
+        """Return a blend result that may be drawn on: a copy if it is one of `inputs`
+
+        Results can be an input frame unchanged, which may be a decoded or
+        cached frame shared with others.
+        """
+        if not any(frame is other for other in inputs):
+            return frame
+        copy = self._output(frame.shape)
+        np.copyto(copy, frame)
+        return copy
+
+    def blend(self, frame1, frame2, opacity):
+        """Return `frame2` blended over `frame1` with `opacity`
+
+        frame2 is resized to frame1's size if needed. The result may be one
+        of the inputs when the other one does not change any pixel.
+        """
+        if opacity < EXACT_WEIGHT:
+            # Not even worth resizing frame2
+            return frame1
+        frame2 = self.resize_to(frame2, frame1.shape)
+        result = trivial_blend(frame1, frame2, opacity)
+        if result is not None and self._is_scratch(result) and self.pool is not None:
+            # The scratch buffer is reused by the next call, so hand out a copy
+            copy = self._output(frame1.shape)
+            np.copyto(copy, result)
+            result = copy
+        if result is not None:
+            return result
+        dst = self._output(frame1.shape)
+        start = time.perf_counter()
+        blended = cv2.addWeighted(frame1, 1 - opacity, frame2, opacity, 0, dst=dst)
+        if self.stats is not None:
+            self.stats.add("blend", time.perf_counter() - start)
+        return blended
+
+    def composite(self, frame1, layers):
+        """Return `layers`, a list of (frame, opacity), stacked over `frame1` in order
+
+        Each layer covers everything below it with its opacity, so with one
+        layer this is blend(). Layers whose frame is None are left out.
+        """
+        layers = [(frame, opacity) for frame, opacity in layers
+                  if frame is not None and opacity >= EXACT_WEIGHT]
+        # An opaque layer hides everything under it and becomes the base
+        for i in range(len(layers) - 1, -1, -1):
+            if 1 - layers[i][1] < EXACT_WEIGHT:
+                frame1 = self.resize_to(layers[i][0], frame1.shape, layer=-1)
+                layers = layers[i + 1:]
+                break
+        if not layers:
+            if self._is_scratch(frame1) and self.pool is not None:
+                # The scratch buffer is reused by the next call, so hand out a copy
+                copy = self._output(frame1.shape)
+                np.copyto(copy, frame1)
+                return copy
+            return frame1
+        if len(layers) == 1:
+            return self.blend(frame1, *layers[0])
+
+        shape = frame1.shape
+        if self._accumulator is None or self._accumulator.shape != shape:
+            self._accumulator = np.empty(shape, np.float32)
+        resized = [self.resize_to(frame, shape, i + 1) for i, (frame, _) in enumerate(layers)]
+        start = time.perf_counter()
+        np.copyto(self._accumulator, frame1)
+        for frame, (_, opacity) in zip(resized, layers):
+            cv2.accumulateWeighted(frame, self._accumulator, opacity)
+        dst = cv2.convertScaleAbs(self._accumulator, dst=self._output(shape))
+        if self.stats is not None:
+            self.stats.add("blend", time.perf_counter() - start)
+        return dst
+
+    def ghost_composite(self, frame1, layers):
+        """Return frame1 with only the moving part of each layer blended over it
+
+        `layers` is a list of (frame, background, opacity) with each
+        layer's static background in frame1's channel order, or None to
+        blend the whole layer. The rider is found at the background's size,
+        so a background smaller than the frame makes the mask cheaper.
+        Layers whose frame is None are left out.
+        """
+        layers = [(frame, background, opacity) for frame, background, opacity in layers
+                  if frame is not None and opacity >= EXACT_WEIGHT]
+        if not layers:
+            return frame1
+        shape = frame1.shape
+        dst = self._output(shape)
+        np.copyto(dst, frame1)
+        for i, (frame, background, opacity) in enumerate(layers, 1):
+            frame = self.resize_to(frame, shape, i)
+            if background is None:
+                start = time.perf_counter()
+                cv2.addWeighted(dst, 1 - opacity, frame, opacity, 0, dst=dst)
+            else:
+                mask = self.rider_mask(frame, background)
+                start = time.perf_counter()
+                # The rider covers a small part of the frame, so only the
+                # box around it is scaled to the frame and blended
+                x, y, width, height = cv2.boundingRect(mask)
+                if not (width and height):
+                    continue
+                scale_x = shape[1] / mask.shape[1]
+                scale_y = shape[0] / mask.shape[0]
+                box = (slice(int(y * scale_y), int(math.ceil((y + height) * scale_y))),
+                       slice(int(x * scale_x), int(math.ceil((x + width) * scale_x))))
+                box_mask = mask[y:y + height, x:x + width]
+                box_size = (box[1].stop - box[1].start, box[0].stop - box[0].start)
+                if box_mask.shape[::-1] != box_size:
+                    box_mask = cv2.resize(box_mask, box_size, interpolation=cv2.INTER_NEAREST)
+                blended = cv2.addWeighted(dst[box], 1 - opacity, frame[box], opacity, 0,
+                                          dst=self._buffer("blended", shape)[box])
+                cv2.copyTo(blended, box_mask, dst[box])
+            if self.stats is not None:
+                self.stats.add("blend", time.perf_counter() - start)
+        return dst
+
+    def rider_mask(self, frame, background):
+        """Return a mask of where `frame` differs from `background`, at the background's size
+
+        The mask is a scratch buffer reused by the next call.
+        """
+        start = time.perf_counter()
+        height, width = background.shape[:2]
+        if frame.shape != background.shape:
+            # Nearest is the cheapest downscale and noise is removed below
+            frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_NEAREST,
+                               dst=self._buffer("small", background.shape))
+        diff = cv2.absdiff(frame, background, dst=self._buffer("diff", background.shape))
+        mask = cv2.cvtColor(diff, cv2.COLOR_RGB2GRAY, dst=self._buffer("mask", (height, width)))
+        cv2.threshold(mask, GHOST_THRESHOLD, 255, cv2.THRESH_BINARY, dst=mask)
+        # Remove isolated specks of noise, then grow over the rider's outline
+        cv2.morphologyEx(mask, cv2.MORPH_OPEN, self._kernel(3, cv2.MORPH_ELLIPSE), dst=mask)
+        size = 1 + 2 * max(1, GHOST_GROW * height // 360)
+        cv2.dilate(mask, self._kernel(size, cv2.MORPH_RECT), dst=mask)
+        if self.stats is not None:
+            self.stats.add("mask", time.perf_counter() - start)
+        return mask
+
+    def _buffer(self, name, shape):
+        buffer = self._scratch.get(name)
+        if buffer is None or buffer.shape != shape:
+            buffer = self._scratch[name] = np.empty(shape, np.uint8)
+        return buffer
+
+    def _kernel(self, size, shape):
+        # A rectangle is dilated with two 1-D passes, several times faster
+        # than an ellipse of the same size
+        kernel = self._kernels.get((size, shape))
+        if kernel is None:
+            kernel = self._kernels[(size, shape)] = cv2.getStructuringElement(shape, (size, size))
+        return kernel
+
+    def release(self, frame):
+        """Give a blend result back to the pool"""
+        if self.pool is not None:
+            self.pool.release(frame)
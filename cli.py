@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Command line shadow video export for the Gymkhana Video Analyzer
+
+Runs without Tk or a display, e.g. on a render server.
+
+Single run:
+    python cli.py main.mp4 shadow.mp4 -o shadow.mp4 --offset 0.4 --start 0 --end 30
+
+More riders stacked over the shadow, each with its own offset and opacity:
+    python cli.py main.mp4 shadow.mp4 -o riders.mp4 --layer third.mp4 -0.2 0.4
+
+Batch of runs from a JSON manifest:
+    python cli.py --manifest event.json
+
+Every export range of a project saved by the GUI (numbered outputs if
+there are several), reusing the analysis results cached with it:
+    python cli.py --project run.gymproj -o shadow.mp4
+
+The manifest is a list of runs (or {"runs": [...]}), each with the keys
+video1, video2, output and optionally offset, opacity, start, end and profile.
+Relative paths are resolved against the manifest's directory. An offset of
+"auto" estimates it from the audio tracks (needs ffmpeg), and "time_warp":
+true follows the riders along the whole run starting from that offset.
+"layers" lists further shadow videos as {"video", "offset", "opacity"}
+objects; offset defaults to 0 and opacity to the run's opacity. "ghost":
+true blends only the moving riders of the shadow videos, and "register":
+true warps them onto the main video to cancel camera motion. "tracks"
+draws the riders' paths: {"video1": {"box": [x0, y0, x1, y1], "frame": n},
+"video2": {...}} with the box around the rider in 0..1 frame coordinates
+at frame n of that video, from where the rider is tracked. "markers"
+holds the split markers of each video as {"video1": {"Start": frame,
+"Gate 1": frame, ..., "Finish": frame}, "video2": {...}}; "split_sync":
+true syncs the shadow to them at every marker instead of one offset, and
+"splits" names a CSV file the split times are written to.
+"""
+
+import argparse
+import json
+import multiprocessing
+import sys
+import time
+from pathlib import Path
+
+import frame_index
+import splits
+from auto_sync import estimate_offset
+from encoders import DEFAULT_PROFILE, EXPORT_PROFILES
+from engine import EXPORT_MODES, ShadowSession, VideoSource
+from export_stats import format_duration
+from ghost import load_or_compute_background
+from project import Project
+from time_warp import load_or_align
+from tracking import load_or_track_rider
+
+
+def load_manifest(manifest_path):
+    """Read a manifest file and return a list of run dicts with absolute paths"""
+    manifest_path = Path(manifest_path)
+    with open(manifest_path, encoding="utf-8") as f:
+        data = json.load(f)
+
+    runs = data["runs"] if isinstance(data, dict) else data
+    base_dir = manifest_path.parent
+    for run in runs:
+        for key in ("video1", "video2", "output"):
+            if key not in run:
+                raise ValueError(f"Manifest run is missing '{key}': {run}")
+            run[key] = str(base_dir / run[key])
+        for layer in run.get("layers", []):
+            if "video" not in layer:
+                raise ValueError(f"Manifest layer is missing 'video': {layer}")
+            layer["video"] = str(base_dir / layer["video"])
+        for name, track in (run.get("tracks") or {}).items():
+            if name not in ("video1", "video2") or "box" not in track:
+                raise ValueError(f"Manifest track needs video1 or video2 and a 'box': {name}")
+        for name, markers in (run.get("markers") or {}).items():
+            if name not in ("video1", "video2") or not isinstance(markers, dict):
+                raise ValueError(f"Manifest markers need video1 or video2 and "
+                                 f"{{name: frame}}: {name}")
+        if run.get("splits"):
+            run["splits"] = str(base_dir / run["splits"])
+    return runs
+
+
+def export_run(run, mode="pipelined", processes=None, quiet=False, profile=None, store=None):
+    """Export one run dict and return the exporter, whose stats describe the export
+
+    `store` is an optional ArtifactStore (e.g. a project's) to reuse and
+    keep analysis results in.
+    """
+    offset = run.get("offset", 0.0)
+    if offset == "auto":
+        estimate = estimate_offset(run["video1"], run["video2"])
+        print(f"  auto sync offset {estimate.offset:.3f}s "
+              f"(confidence {estimate.confidence:.0%})", file=sys.stderr)
+        offset = estimate.offset
+    session = ShadowSession(sync_offset=float(offset),
+                            shadow_opacity=float(run.get("opacity", 0.5)))
+    session.artifacts = store
+    try:
+        session.load_video(run["video1"], 1)
+        session.load_video(run["video2"], 2)
+        for layer in run.get("layers", []):
+            session.add_layer(VideoSource(layer["video"]), float(layer.get("offset", 0.0)),
+                              float(layer.get("opacity", session.shadow_opacity)))
+        videos = [session.video1, session.video2] + [track.source for track in session.layers]
+        if store is not None:
+            # Exact timing for free where an index was saved; none is built here
+            for video in videos:
+                index = frame_index.load_artifact(store, video.path)
+                if index is not None:
+                    video.set_index(index)
+        if run.get("ghost"):
+            session.ghost = True
+            for video in videos[1:]:
+                video.background = load_or_compute_background(video.path, store=store)
+        session.register = bool(run.get("register"))
+        tracks = run.get("tracks") or {}
+        for name, video in (("video1", session.video1), ("video2", session.video2)):
+            if name in tracks:
+                video.trajectory = load_or_track_rider(
+                    video.path, tracks[name]["box"], int(tracks[name].get("frame", 0)),
+                    video.index, store=store)
+        session.show_paths = bool(tracks)
+        markers = run.get("markers") or {}
+        for name, video in (("video1", session.video1), ("video2", session.video2)):
+            if name in markers:
+                video.markers = {marker: int(frame) for marker, frame in markers[name].items()}
+                # Split times need the real frame timestamps
+                if video.index is None:
+                    video.set_index(frame_index.load_or_build_index(video.path, store=store))
+        if run.get("splits"):
+            splits.write_csv(run["splits"], session.split_table())
+
+        start_time = float(run.get("start", 0.0))
+        end_time = run.get("end")
+        end_time = session.video1.duration if end_time is None else float(end_time)
+
+        if run.get("split_sync"):
+            session.sync_to_splits()
+        elif run.get("time_warp"):
+            session.time_warp = load_or_align(
+                (session.video1.path, session.video1.index),
+                (session.video2.path, session.video2.index), session.sync_offset,
+                store=store)
+
+        exporter = session.create_exporter(run["output"], start_time, end_time,
+                                           mode=mode, processes=processes,
+                                           profile=run.get("profile", profile))
+        exporter.run(progress_callback=None if quiet else
+                     lambda progress: _print_progress(progress, exporter.stats))
+        session.save_artifacts()
+        return exporter
+    finally:
+        session.release()
+
+
+def _print_progress(progress, stats):
+    """Print progress, frame rate and ETA on a single terminal line"""
+    sys.stderr.write(f"\r  {progress:5.1f}%  {stats.fps:6.1f} fps  "
+                     f"ETA {format_duration(stats.eta)}   ")
+    sys.stderr.flush()
+
+
+def format_stages(stats):
+    """Return the stage times of an export as one line, slowest first"""
+    frames = max(1, stats.frames_written)
+    stages = sorted(stats.totals().items(), key=lambda item: -item[1][0])
+    return "  ".join(f"{stage} {1000.0 * seconds / frames:.1f}"
+                     for stage, (seconds, _) in stages) + " ms/frame"
+
+
+def parse_offset(value):
+    """Parse --offset: seconds, or "auto" to estimate it from the audio"""
+    if value == "auto":
+        return value
+    try:
+        return float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected seconds or 'auto', got {value!r}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Export Gymkhana shadow videos without the GUI")
+    parser.add_argument("video1", nargs="?", help="main video")
+    parser.add_argument("video2", nargs="?", help="shadow video")
+    parser.add_argument("-o", "--output", help="output video path (.mp4 or .avi)")
+    parser.add_argument("--offset", type=parse_offset, default=0.0,
+                        help="sync offset of the shadow video in seconds, or 'auto' "
+                             "to estimate it from the audio tracks (default 0)")
+    parser.add_argument("--time-warp", action="store_true",
+                        help="align the riders along the whole run instead of using "
+                             "one constant offset")
+    parser.add_argument("--opacity", type=float, default=0.5,
+                        help="shadow opacity from 0.0 to 1.0 (default 0.5)")
+    parser.add_argument("--layer", nargs="+", action="append", default=[],
+                        metavar="VIDEO [OFFSET [OPACITY]]",
+                        help="another shadow video stacked over the shadow, with its own "
+                             "sync offset in seconds (default 0) and opacity (default "
+                             "--opacity); may be repeated")
+    parser.add_argument("--ghost", action="store_true",
+                        help="blend only the moving rider of each shadow video, found by "
+                             "comparing it with the video's static background")
+    parser.add_argument("--register", action="store_true",
+                        help="warp each shadow video onto the main video to cancel camera "
+                             "motion, e.g. for handheld footage")
+    parser.add_argument("--start", type=float, default=0.0,
+                        help="start time in seconds (default 0)")
+    parser.add_argument("--end", type=float, default=None,
+                        help="end time in seconds (default: end of video 1)")
+    parser.add_argument("--manifest", help="JSON file listing many runs to export")
+    parser.add_argument("--project",
+                        help="project file saved by the GUI; exports each of its export "
+                             "ranges to --output")
+    parser.add_argument("--mode", choices=EXPORT_MODES, default="pipelined",
+                        help="sequential: one thread; pipelined: decode/blend/encode "
+                             "threads (default); segmented: parallel processes over "
+                             "keyframe-aligned segments, needs ffmpeg")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="worker processes for --mode segmented (default: all cores)")
+    parser.add_argument("--profile", choices=list(EXPORT_PROFILES), default=DEFAULT_PROFILE,
+                        help="codec, size and frame rate of the output: " + "; ".join(
+                            f"{name}: {profile.description}"
+                            for name, profile in EXPORT_PROFILES.items())
+                        + f" (default {DEFAULT_PROFILE})")
+    parser.add_argument("-q", "--quiet", action="store_true", help="do not print progress")
+
+    args = parser.parse_args(argv)
+    if args.manifest and args.project:
+        parser.error("give either a manifest or a project, not both")
+    if args.manifest or args.project:
+        if args.video1 or args.video2:
+            parser.error("give either a manifest or project, or two videos, not both")
+        if args.project and not args.output:
+            parser.error("--output is required with --project")
+    elif not (args.video1 and args.video2 and args.output):
+        parser.error("video1, video2 and --output are required without --manifest or --project")
+
+    layers = []
+    for values in args.layer:
+        if len(values) > 3:
+            parser.error(f"--layer takes VIDEO [OFFSET [OPACITY]], got {' '.join(values)}")
+        layer = {"video": values[0]}
+        try:
+            for key, value in zip(("offset", "opacity"), values[1:]):
+                layer[key] = float(value)
+        except ValueError:
+            parser.error(f"--layer offset and opacity must be numbers, got {' '.join(values)}")
+        layers.append(layer)
+    args.layer = layers
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    store = None
+    if args.manifest:
+        runs = load_manifest(args.manifest)
+    elif args.project:
+        project = Project.load(args.project)
+        runs = project.runs(args.output)
+        store = project.artifact_store()
+    else:
+        runs = [{"video1": args.video1, "video2": args.video2, "output": args.output,
+                 "offset": args.offset, "time_warp": args.time_warp,
+                 "opacity": args.opacity, "layers": args.layer, "ghost": args.ghost,
+                 "register": args.register,
+                 "start": args.start, "end": args.end}]
+
+    # Finish the progress line before printing a result
+    newline = "" if args.quiet else "\n"
+    failures = 0
+    for number, run in enumerate(runs, 1):
+        print(f"[{number}/{len(runs)}] {run['output']}", file=sys.stderr)
+        started = time.perf_counter()
+        try:
+            exporter = export_run(run, mode=args.mode, processes=args.processes,
+                                  quiet=args.quiet, profile=args.profile, store=store)
+        except Exception as e:
+            failures += 1
+            print(f"{newline}  failed: {e}", file=sys.stderr)
+            continue
+        elapsed = time.perf_counter() - started
+        stats = exporter.stats
+        print(f"{newline}  {stats.frames_written} frames in {elapsed:.1f}s "
+              f"({stats.frames_written / stats.elapsed:.1f} fps export)", file=sys.stderr)
+        if not args.quiet:
+            print(f"  {format_stages(stats)}", file=sys.stderr)
+            if exporter.report_path:
+                print(f"  report: {exporter.report_path}", file=sys.stderr)
+
+    if failures:
+        print(f"{failures} of {len(runs)} exports failed", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""
+Preview frames on Tk canvases
+
+Making a new PhotoImage and calling canvas.create_image for every frame
+adds a canvas item per frame, so during playback the item list grows
+without limit and everything drawn on the canvas gets slower. CanvasDisplay
+keeps one image item and one PhotoImage per canvas and pastes each new
+frame into it; a new PhotoImage is only made when the frame size changes.
+"""
+
+import tkinter as tk
+
+from PIL import Image, ImageTk
+
+
+class CanvasDisplay:
+    """One reused PhotoImage and canvas image item, centred on a canvas
+
+    `key` (optional) identifies the content of a frame: showing a frame
+    with the same key object as the one on screen does nothing. Cached
+    preview frames are never modified, so the array itself makes a good
+    key; pooled buffers are reused for new content and must not be keys.
+    """
+
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.photo = None
+        self.item = None
+        self.key = None
+        self.shown = 0
+        self.skipped = 0
+
+    @property
+    def image_size(self):
+        """(width, height) of the frame on screen, or None"""
+        if self.photo is None:
+            return None
+        return self.photo.width(), self.photo.height()
+
+    def canvas_size(self):
+        """Current (width, height) of the canvas in pixels"""
+        return max(1, self.canvas.winfo_width()), max(1, self.canvas.winfo_height())
+
+    def image_origin(self, size=None):
+        """Canvas coordinates of the top-left corner of the frame on screen
+
+        `size` gives the origin for a centred frame of that size instead,
+        e.g. one that is about to be shown.
+        """
+        canvas_width, canvas_height = self.canvas_size()
+        width, height = size or self.image_size or (canvas_width, canvas_height)
+        return (canvas_width - width) // 2, (canvas_height - height) // 2
+
+    def show(self, frame_rgb, key=None):
+        """Put an RGB frame on the canvas; returns False if it was already there"""
+        if key is not None and key is self.key:
+            self.skipped += 1
+            return False
+
+        # fromarray shares the array's memory; paste copies it into Tk once
+        image = Image.fromarray(frame_rgb)
+        if self.image_size != image.size:
+            self.photo = ImageTk.PhotoImage(image)
+            if self.item is None:
+                self.item = self.canvas.create_image(0, 0, image=self.photo, anchor=tk.CENTER)
+                # Below overlays such as the start gate box
+                self.canvas.tag_lower(self.item)
+            else:
+                self.canvas.itemconfig(self.item, image=self.photo)
+        else:
+            self.photo.paste(image)
+        self.key = key
+        self.shown += 1
+        self.center()
+        return True
+
+    def center(self):
+        """Keep the image in the middle of the canvas, e.g. after it was resized"""
+        if self.item is not None:
+            canvas_width, canvas_height = self.canvas_size()
+            self.canvas.coords(self.item, canvas_width // 2, canvas_height // 2)
+
+    def clear(self):
+        """Remove the frame from the canvas"""
+        if self.item is not None:
+            self.canvas.delete(self.item)
+        self.photo = None
+        self.item = None
+        self.key = None
@@ -0,0 +1,191 @@
+"""
+Export profiles and video writers
+
+An ExportProfile chooses the codec, the encoder speed/size tradeoff, a
+maximum output resolution and a frame rate cap. H.264/H.265 profiles stream
+raw BGR frames to an ffmpeg process over a pipe, straight from the frame
+buffers (no per-frame copy on the Python side); ffmpeg scales and encodes
+on its own threads. Without ffmpeg, and for the "mpeg4" profile, frames
+go to OpenCV's MPEG-4 Part 2 writer as before.
+
+Both writers have the cv2.VideoWriter interface (isOpened, write,
+release), so the exporters do not care which one they get.
+"""
+
+import subprocess
+import tempfile
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from ffmpeg_tools import NO_WINDOW, find_ffmpeg
+
+
+class ExportProfile:
+    """Codec and size/speed settings for an export
+
+    `codec` is an ffmpeg encoder (libx264, libx265) or "mp4v" for OpenCV's
+    writer. `crf` is the x264/x265 quality (lower is better and larger);
+    `preset` trades encode speed for file size at the same quality.
+    `max_height` caps the short side, so a 1080p profile keeps portrait
+    1080x1920 footage at full size.
+    """
+
+    def __init__(self, name, codec="libx264", preset="medium", crf=23, max_height=None,
+                 max_fps=None, description=""):
+        self.name = name
+        self.codec = codec
+        self.preset = preset
+        self.crf = crf
+        self.max_height = max_height
+        self.max_fps = max_fps
+        self.description = description
+
+    def output_size(self, width, height):
+        """Return the encoded (width, height) for a source size, keeping the aspect ratio"""
+        short_side = min(width, height)
+        if self.max_height and short_side > self.max_height:
+            scale = self.max_height / short_side
+            width = int(round(width * scale / 2)) * 2
+            height = int(round(height * scale / 2)) * 2
+        # Even dimensions, as yuv420p requires, also for unscaled odd sources
+        return max(2, width - width % 2), max(2, height - height % 2)
+
+    def output_fps(self, fps):
+        """Return the encoded frame rate for a source frame rate"""
+        if self.max_fps and fps > self.max_fps:
+            return float(self.max_fps)
+        return fps
+
+    def __repr__(self):
+        return f"ExportProfile({self.name!r})"
+
+
+EXPORT_PROFILES = {
+    profile.name: profile for profile in (
+        ExportProfile("fast", preset="veryfast", crf=23, max_height=1080,
+                      description="H.264, quick to encode, up to 1080p"),
+        ExportProfile("balanced", preset="medium", crf=23, max_height=1080,
+                      description="H.264, up to 1080p"),
+        ExportProfile("small", preset="slow", crf=28, max_height=720, max_fps=30,
+                      description="H.264, 720p 30 fps for uploading"),
+        ExportProfile("quality", preset="slow", crf=18,
+                      description="H.264 at source resolution"),
+        ExportProfile("hevc", codec="libx265", preset="medium", crf=26, max_height=1080,
+                      description="H.265, smallest files, slow to encode"),
+        ExportProfile("mpeg4", codec="mp4v",
+                      description="MPEG-4 Part 2 via OpenCV, no ffmpeg needed"),
+    )
+}
+DEFAULT_PROFILE = "balanced"
+
+
+def get_profile(profile=None):
+    """Return an ExportProfile from a profile, a profile name or None (the default)"""
+    if isinstance(profile, ExportProfile):
+        return profile
+    name = profile or DEFAULT_PROFILE
+    if name not in EXPORT_PROFILES:
+        raise ValueError(f"Unknown export profile: {name}")
+    return EXPORT_PROFILES[name]
+
+
+class FFmpegWriter:
+    """Encode frames with an ffmpeg process fed raw BGR frames over stdin"""
+
+    def __init__(self, output_path, frame_size, fps, profile, ffmpeg):
+        self.output_path = str(output_path)
+        self.frame_size = frame_size
+        width, height = frame_size
+        cmd = [ffmpeg, "-y", "-loglevel", "error",
+               "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}",
+               "-r", f"{fps:.6f}", "-i", "-", "-an"]
+        output_size = profile.output_size(width, height)
+        if output_size != frame_size:
+            cmd += ["-vf", f"scale={output_size[0]}:{output_size[1]}:flags=area"]
+        cmd += ["-c:v", profile.codec, "-preset", profile.preset, "-crf", str(profile.crf),
+                "-pix_fmt", "yuv420p"]
+        if Path(self.output_path).suffix.lower() in (".mp4", ".mov"):
+            # Index at the front, so uploads can start playing before they finish loading
+            cmd += ["-movflags", "+faststart"]
+            if profile.codec == "libx265":
+                cmd += ["-tag:v", "hvc1"]
+        cmd.append(self.output_path)
+
+        self._log = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                        stderr=self._log, creationflags=NO_WINDOW)
+
+    def isOpened(self):
+        return self.process.poll() is None
+
+    def write(self, frame):
+        """Send one BGR frame; the buffer is passed to the pipe without copying"""
+        if (frame.shape[1], frame.shape[0]) != self.frame_size:
+            raise ValueError(f"Frame size {frame.shape[1]}x{frame.shape[0]} does not match "
+                             f"the writer ({self.frame_size[0]}x{self.frame_size[1]})")
+        try:
+            self.process.stdin.write(memoryview(np.ascontiguousarray(frame)))
+        except (BrokenPipeError, OSError):
+            raise IOError(f"ffmpeg stopped encoding {self.output_path}: {self._error_text()}")
+
+    def release(self):
+        """Finish the file; raises IOError if ffmpeg failed"""
+        if self.process.stdin.closed:
+            return
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        returncode = self.process.wait()
+        error = self._error_text()
+        self._log.close()
+        if returncode != 0:
+            raise IOError(f"ffmpeg failed to encode {self.output_path}: {error}")
+
+    def _error_text(self):
+        self._log.seek(0)
+        return self._log.read().decode(errors="replace").strip()
+
+
+class OpenCVWriter:
+    """cv2.VideoWriter (MPEG-4 Part 2) that applies the profile's output size"""
+
+    def __init__(self, output_path, frame_size, fps, profile):
+        self.output_size = profile.output_size(*frame_size)
+        self.resize = self.output_size != tuple(frame_size)
+        self._resized = None
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        self.writer = cv2.VideoWriter(str(output_path), fourcc, fps, self.output_size)
+
+    def isOpened(self):
+        return self.writer.isOpened()
+
+    def write(self, frame):
+        if self.resize:
+            frame = self._resized = cv2.resize(frame, self.output_size, dst=self._resized,
+                                               interpolation=cv2.INTER_AREA)
+        self.writer.write(frame)
+
+    def release(self):
+        self.writer.release()
+
+
+def open_writer(output_path, frame_size, fps, profile=None):
+    """Return a writer for `frame_size` (width, height) BGR frames at `fps`
+
+    `fps` is the source rate; the profile may cap it. H.264/H.265 profiles
+    fall back to OpenCV's MPEG-4 writer when ffmpeg is not installed.
+    """
+    profile = get_profile(profile)
+    fps = profile.output_fps(fps)
+    ffmpeg = find_ffmpeg() if profile.codec != "mp4v" else None
+    if ffmpeg:
+        writer = FFmpegWriter(output_path, frame_size, fps, profile, ffmpeg)
+    else:
+        writer = OpenCVWriter(output_path, frame_size, fps, profile)
+    if not writer.isOpened():
+        writer.release()
+        raise IOError(f"Could not create output video: {output_path}")
+    return writer
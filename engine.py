@@ -0,0 +1,639 @@
+"""
+Headless video engine for the Gymkhana Video Analyzer
+
+Holds everything that does not need a display: opening videos, mapping
+frames between the synchronized videos, blending the shadow preview and
+exporting. The Tk GUI (app.py) and the command line (cli.py) are both thin
+layers on top of ShadowSession.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+
+import export_engine
+import frame_index
+import ghost
+import registration
+import splits
+import thumbnails
+import time_warp
+import tracking
+from blend import BlendEngine, FramePool
+from export_stats import fourcc_name
+from frame_cache import FrameCache, ReadAhead
+
+
+PREVIEW_SIZE = (640, 360)
+
+# Memory for decoded preview frames, per video
+CACHE_BUDGET_MB = 256
+
+# Threads decoding the preview frames of the videos of one render in parallel
+PREVIEW_DECODE_THREADS = 4
+
+# Single thread, threaded pipeline, or parallel processes over segments
+EXPORT_MODES = ("sequential", "pipelined", "segmented")
+
+# Seconds of the shadow video decoded for analysis mode beyond the range it
+# is shown with, so small sync offset changes stay inside the store
+ANALYSIS_MARGIN = 1.0
+
+
+def prepare_preview(frame, size):
+    """Resize a decoded BGR frame for the preview and convert it to RGB once"""
+    return cv2.cvtColor(cv2.resize(frame, size), cv2.COLOR_BGR2RGB)
+
+
+def fit_size(frame_width, frame_height, max_width, max_height):
+    """Return the largest (width, height) with the frame's aspect ratio inside a box"""
+    if frame_width <= 0 or frame_height <= 0:
+        return max(1, max_width), max(1, max_height)
+    scale = min(max_width / frame_width, max_height / frame_height)
+    return (max(1, int(round(frame_width * scale))),
+            max(1, int(round(frame_height * scale))))
+
+
+class VideoSource:
+    """An opened video file and its basic properties"""
+
+    def __init__(self, path, cache_budget_mb=CACHE_BUDGET_MB):
+        cap = cv2.VideoCapture(str(path))
+        if not cap.isOpened():
+            cap.release()
+            raise IOError(f"Could not open video: {path}")
+
+        self.path = str(path)
+        self.cap = cap
+        self.fps = cap.get(cv2.CAP_PROP_FPS)
+        self.total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.duration = self.total_frames / self.fps if self.fps > 0 else 0
+        self.width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.codec = fourcc_name(cap.get(cv2.CAP_PROP_FOURCC))
+        # Degrees from the container's rotation metadata; OpenCV already
+        # applies it to decoded frames, so width and height are as displayed
+        self.rotation = int(cap.get(cv2.CAP_PROP_ORIENTATION_META))
+
+        # Nominal timing until a FrameIndex with the real timestamps is set
+        self.timing = export_engine.ConstantFrameRate(self.fps, self.total_frames)
+        self.index = None
+
+        # Static background (ghost.BackgroundModel) for the ghost composite
+        self.background = None
+
+        # Keyframe thumbnails (thumbnails.ThumbnailStrip) for the filmstrip
+        self.thumbnails = None
+
+        # Tracked rider (tracking.Trajectory) whose path is drawn over the blend
+        self.trajectory = None
+
+        # Frame numbers of the split markers (splits.py), by name
+        self.markers = {}
+
+        # Optional low-resolution copy that only the preview reads
+        self.proxy_path = None
+        self.proxy_cap = None
+
+        # RGB preview frames, keyed by (frame number, size)
+        self.cache = FrameCache(cache_budget_mb)
+        # Optional FrameStore (frame_store.py) holding a decoded range for analysis mode
+        self.frame_store = None
+        self.read_ahead = None
+        self._read_ahead_size = None
+        self._last_preview_frame = None
+
+    @property
+    def name(self):
+        return Path(self.path).name
+
+    def clamp(self, frame_num):
+        """Clamp a frame number to the frames of this video"""
+        return export_engine.clamp_frame(frame_num, self.total_frames)
+
+    def set_index(self, index):
+        """Switch to exact frame timing and seeking from a FrameIndex"""
+        self.index = index
+        self.timing = index
+        self.total_frames = index.total_frames
+        self.duration = index.duration
+        # Frame numbers may have shifted, so cached frames are stale
+        self._reset_preview()
+        self.clear_frame_store()
+
+    def set_proxy(self, proxy_path):
+        """Read preview frames from a proxy with the same frames as this video"""
+        cap = cv2.VideoCapture(str(proxy_path))
+        if not cap.isOpened():
+            cap.release()
+            raise IOError(f"Could not open proxy: {proxy_path}")
+        self.clear_proxy()
+        self.proxy_path = str(proxy_path)
+        self.proxy_cap = cap
+
+    def clear_proxy(self):
+        """Go back to previewing from the original video"""
+        if self.proxy_cap:
+            self.proxy_cap.release()
+        self.proxy_path = None
+        self.proxy_cap = None
+        self._reset_preview()
+
+    def set_frame_store(self, store):
+        """Serve preview frames of the store's size and range from a FrameStore"""
+        self.clear_frame_store()
+        self.frame_store = store
+
+    def clear_frame_store(self):
+        """Close the FrameStore, deleting its file, and decode every frame again"""
+        if self.frame_store is not None:
+            self.frame_store.close()
+            self.frame_store = None
+
+    def _reset_preview(self):
+        """Drop cached preview frames and the read-ahead that produced them"""
+        if self.read_ahead:
+            self.read_ahead.stop()
+            self.read_ahead = None
+        self.cache.clear()
+
+    def time_of(self, frame_num):
+        """Return the presentation time of a frame in seconds"""
+        return self.timing.time_of(frame_num)
+
+    def frame_at(self, time):
+        """Return the frame shown at `time`, clamped to the video"""
+        return self.clamp(self.timing.frame_at(time))
+
+    def read_frame(self, frame_num):
+        """Seek to and decode one frame, or return None"""
+        if not self.timing.seek(self.cap, frame_num):
+            return None
+        ret, frame = self.cap.retrieve()
+        return frame if ret else None
+
+    def _read_preview_frame(self, frame_num):
+        """Decode a frame from the proxy if there is one, else from the original"""
+        if self.proxy_cap is None:
+            return self.read_frame(frame_num)
+        # Every proxy frame is a keyframe, so a plain seek is exact and cheap
+        self.proxy_cap.set(cv2.CAP_PROP_POS_FRAMES, frame_num)
+        ret, frame = self.proxy_cap.read()
+        return frame if ret else None
+
+    def preview_frame(self, frame_num, size=PREVIEW_SIZE):
+        """Return frame `frame_num` as RGB resized to `size`, from the cache when possible
+
+        The returned array is shared with the cache or frame store and must
+        not be modified.
+        """
+        store = self.frame_store
+        if store is not None and store.size == tuple(size):
+            frame = store.get(frame_num)
+            if frame is not None:
+                # A view of the mapped file; nothing to decode or read ahead
+                self._last_preview_frame = frame_num
+                return frame
+
+        frame = self.cache.get((frame_num, size))
+        if frame is None:
+            frame = self._read_preview_frame(frame_num)
+            if frame is None:
+                return None
+            frame = prepare_preview(frame, size)
+            self.cache.put((frame_num, size), frame)
+
+        # Keep decoding ahead in the direction the playhead is moving
+        previous = self._last_preview_frame
+        self._last_preview_frame = frame_num
+        if previous is not None and previous != frame_num:
+            self._start_read_ahead(size).update(frame_num, 1 if frame_num > previous else -1)
+        return frame
+
+    def _start_read_ahead(self, size):
+        """Return the read-ahead thread for `size`, restarting it if the size changed"""
+        if self.read_ahead is None or self._read_ahead_size != size:
+            if self.read_ahead:
+                self.read_ahead.stop()
+            if self.proxy_path:
+                source_path, index = self.proxy_path, None
+            else:
+                source_path, index = self.path, self.index
+            self.read_ahead = ReadAhead(
+                source_path, self.cache, self.total_frames, index,
+                prepare=lambda frame: prepare_preview(frame, size),
+                key=lambda frame_num: (frame_num, size))
+            self._read_ahead_size = size
+        return self.read_ahead
+
+    def release(self):
+        self.clear_proxy()
+        self.clear_frame_store()
+        self.cap.release()
+
+
+class VideoLoader:
+    """Open and probe a video and decode its first preview frame on a background thread
+
+    Opening a file on a network share can take seconds, so the GUI does it
+    here. `on_done(source_or_None, error_or_None)` is called from the
+    worker thread with a VideoSource whose first frame is already in the
+    preview cache. `preview_size` is the size of that frame, or a function
+    returning it for the opened VideoSource. A cancelled load never calls
+    `on_done` and releases the video once opening returns (it cannot be
+    interrupted).
+    """
+
+    def __init__(self, path, on_done, preview_size=PREVIEW_SIZE):
+        self.path = str(path)
+        self.preview_size = preview_size
+        self._cancel_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(on_done,), daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def _run(self, on_done):
+        try:
+            source = VideoSource(self.path)
+        except Exception as e:
+            if not self._cancel_event.is_set():
+                on_done(None, e)
+            return
+        try:
+            if not self._cancel_event.is_set():
+                size = self.preview_size
+                source.preview_frame(0, size(source) if callable(size) else size)
+        except Exception as e:
+            source.release()
+            if not self._cancel_event.is_set():
+                on_done(None, e)
+            return
+        if self._cancel_event.is_set():
+            source.release()
+            return
+        on_done(source, None)
+
+
+class ShadowTrack:
+    """A further shadow video stacked over video 2, with its own sync offset and opacity"""
+
+    def __init__(self, source, sync_offset=0.0, opacity=0.5):
+        self.source = source
+        self.sync_offset = sync_offset
+        self.opacity = opacity
+
+    @property
+    def name(self):
+        return self.source.name
+
+
+class ShadowSession:
+    """A main video, a shadow video and the sync/blend settings between them
+
+    Further shadow videos (ShadowTrack objects in `layers`) are stacked over
+    video 2 in order, each synced to the main video by its own offset. With
+    `ghost` set, shadow videos whose background is known contribute only
+    their moving rider instead of the whole frame. With `register` set,
+    shadow frames are warped onto the main video's to cancel camera motion.
+    With `show_paths` set, the tracked rider paths of the videos are drawn
+    over the blend. With `split_sync` set, the time warp runs through the
+    split markers of videos 1 and 2 (splits.py).
+
+    `artifacts` is an optional ArtifactStore (artifacts.py) that registered
+    transforms are loaded from, and that save_artifacts() writes every
+    analysis result of the session to.
+    """
+
+    def __init__(self, sync_offset=0.0, shadow_opacity=0.5):
+        self.video1 = None
+        self.video2 = None
+        self.sync_offset = sync_offset  # Time offset between videos
+        # Optional TimeWarp (time_warp.py) used instead of the constant offset;
+        # with split_sync set it runs through the videos' split markers
+        self.time_warp = None
+        self.split_sync = False
+        self.shadow_opacity = shadow_opacity
+        self.layers = []
+        self.ghost = False
+        self.register = False
+        self.show_paths = False
+        # FrameRegistration per shadow VideoSource, against the current video 1
+        self.registrations = {}
+        self.artifacts = None
+        # Held while rendering; take it before replacing or reconfiguring a
+        # video when frames are rendered on another thread
+        self.lock = threading.RLock()
+        # Blended previews are handed to the GUI thread, so they come from a
+        # pool and go back through release_frame()
+        self.frame_pool = FramePool()
+        self.blender = BlendEngine(self.frame_pool)
+        self._decode_pool = None
+
+    @property
+    def ready(self):
+        """True once both videos are loaded"""
+        return self.video1 is not None and self.video2 is not None
+
+    @property
+    def loaded(self):
+        """True once at least one video is loaded"""
+        return self.video1 is not None or self.video2 is not None
+
+    @property
+    def main_video(self):
+        """The video whose frames the playhead counts: video 1, or video 2 on its own"""
+        return self.video1 if self.video1 is not None else self.video2
+
+    @property
+    def max_duration(self):
+        return max(video.duration for video in (self.video1, self.video2) if video)
+
+    def load_video(self, path, video_num):
+        """Open `path` as video 1 (main) or 2 (shadow), replacing any previous one"""
+        return self.set_video(VideoSource(path), video_num)
+
+    def set_video(self, source, video_num):
+        """Use an opened VideoSource as video 1 or 2, releasing the one it replaces"""
+        with self.lock:
+            previous = self.video1 if video_num == 1 else self.video2
+            if previous:
+                previous.release()
+            if video_num == 1:
+                self.video1 = source
+            else:
+                self.video2 = source
+            # A warp only fits the pair it was computed for
+            self.time_warp = None
+            self.split_sync = False
+            self.reset_registration()
+        return source
+
+    def add_layer(self, source, sync_offset=0.0, opacity=0.5):
+        """Stack an opened VideoSource over the shadows as a new ShadowTrack"""
+        track = ShadowTrack(source, sync_offset, opacity)
+        with self.lock:
+            self.layers.append(track)
+        return track
+
+    def remove_layer(self, track):
+        """Remove a ShadowTrack and release its video"""
+        with self.lock:
+            self.layers.remove(track)
+            self.registrations.pop(track.source, None)
+            track.source.release()
+
+    def registration_for(self, video):
+        """Return the FrameRegistration of a shadow video, or None if registration is off"""
+        if not self.register:
+            return None
+        frame_registration = self.registrations.get(video)
+        if frame_registration is None:
+            if self._can_save_registration(video):
+                frame_registration = registration.load_artifact(self.artifacts,
+                                                                self.video1.path, video.path)
+            if frame_registration is None:
+                frame_registration = registration.FrameRegistration()
+            self.registrations[video] = frame_registration
+        return frame_registration
+
+    def _can_save_registration(self, video):
+        """True if transforms against `video` are keyed by stable frame numbers"""
+        return (self.artifacts is not None and self.video1 is not None
+                and self.video1.index is not None and video.index is not None)
+
+    def save_artifacts(self):
+        """Write every analysis result of the loaded videos to `artifacts`"""
+        store = self.artifacts
+        if store is None:
+            return
+        with self.lock:
+            videos = [video for video in [self.video1, self.video2]
+                      + [track.source for track in self.layers] if video]
+            if self.time_warp is not None and not self.split_sync:
+                # Saved under the offset a reopened project aligns from
+                time_warp.save_artifact(store, self.video1.path, self.video2.path,
+                                        self.sync_offset, self.time_warp)
+            registrations = [(self.video1.path, video.path, frame_registration)
+                             for video, frame_registration in self.registrations.items()
+                             if frame_registration.cache
+                             and self._can_save_registration(video)]
+        for video in videos:
+            if video.index is not None:
+                frame_index.save_artifact(store, video.path, video.index)
+            if video.background is not None:
+                ghost.save_artifact(store, video.path, video.background)
+            if video.thumbnails is not None:
+                thumbnails.save_artifact(store, video.path, video.thumbnails)
+            if video.trajectory is not None:
+                tracking.save_artifact(store, video.path, video.trajectory)
+        for video1_path, video2_path, frame_registration in registrations:
+            registration.save_artifact(store, video1_path, video2_path, frame_registration)
+
+    def reset_registration(self):
+        """Forget all registered transforms, e.g. after frame numbers changed"""
+        with self.lock:
+            self.registrations = {}
+
+    def frame_numbers(self, current_frame):
+        """Return the (video 1, video 2) frame numbers shown at `current_frame`
+
+        `current_frame` counts frames of main_video; the number of a video
+        that is not loaded is None.
+        """
+        if self.video1 is None:
+            return None, self.video2.clamp(current_frame)
+        frame1 = self.video1.clamp(current_frame)
+        if self.video2 is None:
+            return frame1, None
+        frame2 = export_engine.shadow_frame_for(current_frame, self.video1.timing,
+                                                self.video2.timing, self.sync_offset,
+                                                self.time_warp)
+        return frame1, self.video2.clamp(frame2)
+
+    def layer_frame_numbers(self, current_frame):
+        """Return the frame number of every extra layer shown at `current_frame`"""
+        main = self.main_video
+        return [track.source.clamp(export_engine.shadow_frame_for(
+                    current_frame, main.timing, track.source.timing, track.sync_offset))
+                for track in self.layers]
+
+    def render(self, current_frame, size=PREVIEW_SIZE):
+        """Decode and blend the preview for `current_frame`
+
+        Returns (frame1_rgb, shadow_rgb) resized to `size`, or None if a
+        frame could not be decoded. Both are read-only; pass shadow_rgb to
+        release_frame() once it has been displayed. With only one video
+        loaded nothing is blended: the result is (frame1_rgb, None) or
+        (None, frame2_rgb).
+        """
+        with self.lock:
+            if not self.loaded:
+                return None
+            return self._render(current_frame, size)
+
+    def _render(self, current_frame, size):
+        # Frames come resized and in RGB from the cache, so changing only the
+        # opacity neither decodes nor converts anything
+        frame1_num, frame2_num = self.frame_numbers(current_frame)
+        requests = [(self.video1, frame1_num), (self.video2, frame2_num)]
+        if self.ready:
+            requests += zip((track.source for track in self.layers),
+                            self.layer_frame_numbers(current_frame))
+        frames = self._preview_frames(requests, size)
+        frame1_rgb, frame2_rgb = frames[:2]
+        if (frame1_num is not None and frame1_rgb is None
+                or frame2_num is not None and frame2_rgb is None):
+            return None
+        if frame1_rgb is None or frame2_rgb is None:
+            return frame1_rgb, frame2_rgb
+
+        # Create shadow effect by blending frames; a layer that could not be
+        # decoded is left out
+        videos = [self.video2] + [track.source for track in self.layers]
+        opacities = [self.shadow_opacity] + [track.opacity for track in self.layers]
+        layers = [export_engine.ShadowLayer(video.path, opacity=opacity,
+                                            background=self._ghost_background(video),
+                                            registration=self.registration_for(video),
+                                            trajectory=self._path(video))
+                  for video, opacity in zip(videos, opacities)]
+        frame_nums = [request[1] for request in requests]
+        shadow_frame = export_engine.stack_layers(self.blender, frame1_rgb, frames[1:], layers,
+                                                  frame_nums, rgb=True,
+                                                  trajectory1=self._path(self.video1))
+        return frame1_rgb, shadow_frame
+
+    def _preview_frames(self, requests, size):
+        """Return the preview frame of each (video, frame number) request, or None
+
+        Each video has its own capture and cache, so with several videos
+        their frames are decoded at the same time on the decode threads.
+        """
+        jobs = [(video, frame_num) for video, frame_num in requests
+                if video is not None and frame_num is not None]
+        if len(jobs) < 2:
+            frames = [video.preview_frame(frame_num, size) for video, frame_num in jobs]
+        else:
+            if self._decode_pool is None:
+                self._decode_pool = ThreadPoolExecutor(PREVIEW_DECODE_THREADS,
+                                                       thread_name_prefix="preview-decode")
+            frames = list(self._decode_pool.map(
+                lambda job: job[0].preview_frame(job[1], size), jobs))
+        frames = iter(frames)
+        return [next(frames) if video is not None and frame_num is not None else None
+                for video, frame_num in requests]
+
+    def release_frame(self, frame):
+        """Return a rendered shadow frame's buffer for reuse"""
+        self.frame_pool.release(frame)
+
+    def cache_stats(self):
+        """Return the frame cache counters of both videos and then of every layer"""
+        videos = [self.video1, self.video2] + [track.source for track in self.layers]
+        return [video.cache.stats() if video else None for video in videos]
+
+    def validate_export_range(self, start_time, end_time):
+        """Raise ValueError if the range cannot be exported"""
+        if not self.ready:
+            raise ValueError("Please load both videos first")
+        if start_time >= end_time:
+            raise ValueError("Start time must be less than end time")
+        if end_time > self.video1.duration:
+            raise ValueError(f"End time exceeds video duration ({self.video1.duration:.1f}s)")
+
+    def analysis_ranges(self, start_time, end_time):
+        """Return (video, first frame, frame count) of both videos to decode for analysis mode
+
+        The shadow range covers what is shown with the main video range,
+        plus ANALYSIS_MARGIN seconds on each side.
+        """
+        self.validate_export_range(start_time, end_time)
+        video1, video2 = self.video1, self.video2
+        first1, last1 = video1.frame_at(start_time), video1.frame_at(end_time)
+        shadow_times = [self.shadow_time(video1.time_of(first1)),
+                        self.shadow_time(video1.time_of(last1))]
+        first2 = video2.frame_at(max(0.0, min(shadow_times) - ANALYSIS_MARGIN))
+        last2 = video2.frame_at(max(shadow_times) + ANALYSIS_MARGIN)
+        return [(video1, first1, last1 - first1 + 1), (video2, first2, max(1, last2 - first2 + 1))]
+
+    def create_exporter(self, output_path, start_time, end_time, mode="pipelined",
+                        processes=None, profile=None):
+        """Return an exporter for the current settings
+
+        `mode` is one of EXPORT_MODES and `profile` an export profile name
+        (encoders.EXPORT_PROFILES), None for the default. The exporter opens its own captures,
+        so it can run on another thread while the session keeps serving the
+        preview.
+        """
+        self.validate_export_range(start_time, end_time)
+        args = (self.video1.path, self.video2.path, output_path, start_time, end_time,
+                self.sync_offset, self.shadow_opacity)
+        layers = [export_engine.ShadowLayer(track.source.path, track.sync_offset,
+                                            track.opacity, track.source.index,
+                                            background=self._ghost_background(track.source),
+                                            registration=self.registration_for(track.source),
+                                            trajectory=self._path(track.source))
+                  for track in self.layers]
+        options = {'index1': self.video1.index, 'index2': self.video2.index,
+                   'time_warp': self.time_warp, 'profile': profile, 'layers': layers,
+                   'background2': self._ghost_background(self.video2),
+                   'registration2': self.registration_for(self.video2),
+                   'trajectory1': self._path(self.video1),
+                   'trajectory2': self._path(self.video2)}
+        if mode == "pipelined":
+            return export_engine.PipelinedExporter(*args, **options)
+        if mode == "segmented":
+            return export_engine.SegmentedExporter(*args, processes=processes, **options)
+        if mode == "sequential":
+            return export_engine.SequentialExporter(*args, **options)
+        raise ValueError(f"Unknown export mode: {mode}")
+
+    def _ghost_background(self, video):
+        return video.background if self.ghost else None
+
+    def _path(self, video):
+        return video.trajectory if self.show_paths else None
+
+    def split_table(self):
+        """Return a splits.Split per marker set in both videos, in course order"""
+        return splits.split_table(self.video1.markers, self.video1,
+                                  self.video2.markers, self.video2)
+
+    def sync_to_splits(self):
+        """Use a time warp through the split markers of both videos
+
+        Raises ValueError if the markers cannot be lined up.
+        """
+        warp = splits.split_warp(self.video1.markers, self.video1,
+                                 self.video2.markers, self.video2)
+        with self.lock:
+            self.time_warp = warp
+            self.split_sync = True
+
+    def shadow_time(self, time1):
+        """Return the shadow video time shown together with main video time `time1`"""
+        if self.time_warp is not None:
+            return self.time_warp.shadow_time(time1)
+        return time1 + self.sync_offset
+
+    def offset_at(self, current_frame):
+        """Return the sync offset in effect at a main video frame"""
+        if self.time_warp is None:
+            return self.sync_offset
+        return self.time_warp.offset_at(self.video1.time_of(current_frame))
+
+    def release(self):
+        with self.lock:
+            for video in [self.video1, self.video2] + [track.source for track in self.layers]:
+                if video:
+                    video.release()
+            self.video1 = self.video2 = None
+            self.layers = []
+            self.registrations = {}
+            if self._decode_pool is not None:
+                self._decode_pool.shutdown(wait=False)
+                self._decode_pool = None
+
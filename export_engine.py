@@ -0,0 +1,951 @@
+"""
+Shadow video export engine
+
+Decodes both source videos front to back instead of seeking for every
+output frame. Each capture is positioned once at the start of the range and
+then advanced with grab()/read(), skipping or repeating frames of the shadow
+video when its frame rate differs from the main video.
+
+PipelinedExporter additionally runs decoding, blending and encoding on
+separate threads linked by bounded queues. SegmentedExporter splits long
+ranges into keyframe-aligned segments exported by separate processes and
+joins them without re-encoding.
+"""
+
+import math
+import multiprocessing
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import cv2
+
+import encoders
+import ffmpeg_tools
+from blend import BlendEngine, FramePool
+from export_stats import ExportStats, source_info
+
+
+def clamp_frame(frame_num, total_frames):
+    """Clamp a frame number to the valid range of a video"""
+    return max(0, min(frame_num, total_frames - 1))
+
+
+class ConstantFrameRate:
+    """Frame timing derived from the nominal fps reported by the container
+
+    FrameIndex (frame_index.py) provides the same interface from the real
+    frame timestamps.
+    """
+
+    def __init__(self, fps, total_frames):
+        self.fps = fps
+        self.total_frames = total_frames
+
+    def time_of(self, frame_num):
+        return frame_num / self.fps
+
+    def frame_at(self, time):
+        """Return the frame on screen at `time` (may be out of range)"""
+        return int(time * self.fps)
+
+    def seek(self, cap, frame_num):
+        """Grab frame `frame_num` so cap.retrieve() returns it"""
+        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_num)
+        return cap.grab()
+
+
+def shadow_frame_for(frame1, timing1, timing2, sync_offset, time_warp=None):
+    """Return the shadow video frame shown together with main video frame `frame1`
+
+    A TimeWarp (time_warp.py), when given, replaces the constant offset.
+    """
+    time1 = timing1.time_of(frame1)
+    if time_warp is not None:
+        return timing2.frame_at(time_warp.shadow_time(time1))
+    return timing2.frame_at(time1 + sync_offset)
+
+
+def plan_export(start_time, end_time, timing1, timing2, sync_offset, time_warp=None,
+                output_fps=None, extra_layers=()):
+    """Return a list of (frame1, frame2) pairs, one per output frame
+
+    frame2 is None when the shadow video has already ended at that moment.
+    Every main video frame is output unless `output_fps` asks for fewer.
+    `extra_layers` lists (timing, sync_offset, time_warp) of further shadow
+    videos; their frame numbers follow frame2 in each tuple, in order.
+    """
+    start_frame1 = clamp_frame(timing1.frame_at(start_time), timing1.total_frames)
+    end_frame1 = clamp_frame(timing1.frame_at(end_time), timing1.total_frames)
+
+    frames1 = range(start_frame1, end_frame1)
+    if output_fps and end_frame1 > start_frame1:
+        # The main video frame on screen at each output frame's time
+        first_time = timing1.time_of(start_frame1)
+        count = int(math.ceil((end_time - first_time) * output_fps))
+        frames1 = [frame for frame in (timing1.frame_at(first_time + k / output_fps)
+                                       for k in range(count))
+                   if start_frame1 <= frame < end_frame1]
+
+    shadows = [(timing2, sync_offset, time_warp)] + list(extra_layers)
+    pairs = []
+    for frame1 in frames1:
+        row = [frame1]
+        for timing, offset, warp in shadows:
+            frame = max(0, shadow_frame_for(frame1, timing1, timing, offset, warp))
+            row.append(frame if frame < timing.total_frames else None)
+        pairs.append(tuple(row))
+    return pairs
+
+
+class SequentialReader:
+    """Read frames from a capture in increasing order without per-frame seeking
+
+    Requested frames may skip ahead (frames in between are grabbed but not
+    retrieved) or repeat the previous frame. Only a request behind the
+    current position falls back to a real seek, done by `timing` (a
+    FrameIndex seeks accurately on variable frame rate videos).
+
+    With `stats` (an ExportStats), seeks are timed as "seek" and grabbing
+    and converting frames as `stage`.
+    """
+
+    def __init__(self, cap, timing=None, stats=None, stage="decode"):
+        self.cap = cap
+        self.timing = timing
+        self.stats = stats
+        self.stage = stage
+        self.grabbed = None  # Index of the last grabbed frame
+        self.frame_num = None  # Index of the last frame returned
+        self.frame = None
+        self.end_frame = None  # First frame that failed to decode
+        self.seeks = 0
+
+    def seek(self, frame_num):
+        """Grab `frame_num` so it is the next frame retrieved"""
+        self.seeks += 1
+        start = time.perf_counter()
+        if self.timing is not None:
+            found = self.timing.seek(self.cap, frame_num)
+        else:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_num)
+            found = self.cap.grab()
+        if self.stats is not None:
+            self.stats.add("seek", time.perf_counter() - start)
+        self.grabbed = frame_num if found else None
+        return found
+
+    def read(self, frame_num):
+        """Return frame `frame_num`, or None if it cannot be decoded"""
+        if frame_num == self.frame_num:
+            return self.frame
+        if self.end_frame is not None and frame_num >= self.end_frame:
+            return None
+
+        if self.grabbed is None or frame_num <= self.grabbed:
+            if not self.seek(frame_num):
+                return self._end(frame_num)
+
+        # Skip frames we do not need without converting them
+        start = time.perf_counter()
+        while self.grabbed < frame_num:
+            if not self.cap.grab():
+                return self._end(self.grabbed + 1)
+            self.grabbed += 1
+
+        ret, frame = self.cap.retrieve()
+        if self.stats is not None:
+            self.stats.add(self.stage, time.perf_counter() - start)
+        if not ret:
+            return self._end(frame_num)
+
+        self.frame_num = frame_num
+        self.frame = frame
+        return frame
+
+    def _end(self, frame_num):
+        """Remember where the stream ended and forget the current frame"""
+        self.end_frame = frame_num
+        self.grabbed = None
+        self.frame_num = None
+        self.frame = None
+        return None
+
+
+def _open_capture(video_path):
+    """Open a capture or raise IOError"""
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        cap.release()
+        raise IOError(f"Could not open video: {video_path}")
+    return cap
+
+
+def _open_captures(video_paths):
+    """Open a capture for every path, releasing the ones already open if one fails"""
+    caps = []
+    try:
+        for video_path in video_paths:
+            caps.append(_open_capture(video_path))
+    except Exception:
+        _release_all(caps)
+        raise
+    return caps
+
+
+def _release_all(resources):
+    """Release every resource, even if releasing one fails
+
+    The first failure (e.g. ffmpeg failing to finish a file) is raised once
+    all are released, unless it happens while another exception is already
+    propagating, e.g. from a `finally` after a failed export; that error is
+    the one reported then.
+    """
+    first_error = None
+    for resource in resources:
+        if resource is None:
+            continue
+        try:
+            resource.release()
+        except Exception as e:
+            if first_error is None:
+                first_error = e
+    if first_error is not None and sys.exc_info()[1] is None:
+        raise first_error
+
+
+class ShadowLayer:
+    """One shadow video of an export with its own sync and opacity
+
+    `index` is an optional FrameIndex and `time_warp` an optional TimeWarp
+    replacing `sync_offset`. With a `background` (a ghost.BackgroundModel)
+    only the moving rider of the layer is blended, and with a
+    `registration` (a registration.FrameRegistration) its frames are warped
+    onto the main video's first. With a `trajectory` (a tracking.Trajectory)
+    the layer's rider path is drawn over the result. Layers are sent to the
+    segmented export's worker processes, so they hold only picklable values.
+    """
+
+    def __init__(self, video_path, sync_offset=0.0, opacity=0.5, index=None, time_warp=None,
+                 background=None, registration=None, trajectory=None):
+        self.video_path = video_path
+        self.sync_offset = sync_offset
+        self.opacity = opacity
+        self.index = index
+        self.time_warp = time_warp
+        self.background = background
+        self.registration = registration
+        self.trajectory = trajectory
+
+
+def capture_timing(cap):
+    """Return the nominal frame timing of an open capture"""
+    return ConstantFrameRate(cap.get(cv2.CAP_PROP_FPS), int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+
+
+def _plan_for_captures(caps, start_time, end_time, index1, layers, profile=None):
+    """Plan an export, from the frame indexes if given or else from the captures
+
+    `caps` holds the main video's capture followed by one per shadow layer.
+    Drops main video frames when the export profile caps the frame rate.
+    """
+    cap1 = caps[0]
+    fps = cap1.get(cv2.CAP_PROP_FPS)
+    output_fps = encoders.get_profile(profile).output_fps(fps)
+    timings = [layer.index or capture_timing(cap) for cap, layer in zip(caps[1:], layers)]
+    extra_layers = [(timing, layer.sync_offset, layer.time_warp)
+                    for timing, layer in zip(timings[1:], layers[1:])]
+    return plan_export(start_time, end_time, index1 or capture_timing(cap1),
+                       timings[0], layers[0].sync_offset, layers[0].time_warp,
+                       output_fps if output_fps < fps else None, extra_layers)
+
+
+def _open_writer(cap1, output_path, profile=None):
+    """Create a writer for the main video's frames using an export profile"""
+    width = int(cap1.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap1.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    return encoders.open_writer(output_path, (width, height), cap1.get(cv2.CAP_PROP_FPS),
+                                profile)
+
+
+def _describe_export(stats, caps, video1_path, index1, layers, output_path, profile,
+                     writer=None):
+    """Record the sources and settings of an export in its stats for the report"""
+    profile = encoders.get_profile(profile)
+    cap1 = caps[0]
+    width = int(cap1.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap1.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    stats.sources = [source_info(cap1, video1_path, index1)]
+    stats.sources += [source_info(cap, layer.video_path, layer.index)
+                      for cap, layer in zip(caps[1:], layers)]
+    stats.info.update({
+        "output": str(output_path),
+        "profile": profile.name,
+        "codec": profile.codec,
+        "output_size": list(profile.output_size(width, height)),
+        "output_fps": round(profile.output_fps(cap1.get(cv2.CAP_PROP_FPS)), 3),
+        "time_warp": any(layer.time_warp is not None for layer in layers),
+        "layers": len(layers),
+        "opacities": [layer.opacity for layer in layers],
+        "ghost": [layer.background is not None for layer in layers],
+        "registered": [layer.registration is not None for layer in layers],
+        "paths": [layer.trajectory is not None for layer in layers],
+    })
+    if writer is not None:
+        stats.info["writer"] = type(writer).__name__
+
+
+def _composite_row(blender, reader1, readers, row, layers, trajectory1=None):
+    """Read one planned row of frames and stack the shadow layers over the main frame
+
+    Returns None if the main video frame cannot be read. Shadow layers that
+    have ended or cannot be read are left out.
+    """
+    frame1 = reader1.read(row[0])
+    if frame1 is None:
+        return None
+    frames = [reader.read(frame_num) if frame_num is not None else None
+              for reader, frame_num in zip(readers, row[1:])]
+    return stack_layers(blender, frame1, frames, layers, row, trajectory1=trajectory1)
+
+
+def register_layers(frame1, frames, layers, frame_nums, stats=None):
+    """Return the registration matrix (or None) of each layer's frame onto the main frame
+
+    Registration tracks features from the previous frame, so call this in
+    plan order; out of order it falls back to slow, less stable matches.
+    """
+    matrices = [None] * len(layers)
+    for i, layer in enumerate(layers):
+        if layer.registration is None or frames[i] is None:
+            continue
+        start = time.perf_counter()
+        matrices[i] = layer.registration.transform(frame_nums[0], frame_nums[i + 1],
+                                                   frame1, frames[i])
+        if stats is not None:
+            stats.add("register", time.perf_counter() - start)
+    return matrices
+
+
+def stack_layers(blender, frame1, frames, layers, frame_nums, rgb=False, trajectory1=None,
+                 matrices=None):
+    """Stack the frames of the shadow layers over a main video frame
+
+    `frames` holds one frame (or None) per ShadowLayer and `frame_nums` the
+    main video's frame number followed by one per layer. Registered layers
+    are warped onto the main frame first, by `matrices` from
+    register_layers() if given, and layers with a background contribute
+    only their moving rider; `rgb` gives the frames' channel order. The
+    rider paths of the main video (`trajectory1`) and of the layers are
+    drawn last.
+    """
+    height, width = frame1.shape[:2]
+    backgrounds = [None if layer.background is None
+                   else layer.background.mask_background(width, height, rgb)
+                   for layer in layers]
+    if matrices is None:
+        matrices = register_layers(frame1, frames, layers, frame_nums, blender.stats)
+    if any(layer.registration is not None for layer in layers):
+        frames = list(frames)
+        for i, (layer, matrix) in enumerate(zip(layers, matrices)):
+            if layer.registration is None or frames[i] is None:
+                continue
+            frames[i] = blender.warp_to(frames[i], frame1.shape, matrix, ("warp", i))
+            if backgrounds[i] is not None and matrix is not None:
+                backgrounds[i] = blender.warp_to(backgrounds[i], backgrounds[i].shape, matrix,
+                                                 ("warp background", i))
+
+    if all(background is None for background in backgrounds):
+        result = blender.composite(frame1, [(frame, layer.opacity)
+                                            for frame, layer in zip(frames, layers)])
+    else:
+        result = blender.ghost_composite(frame1, [
+            (frame, background, layer.opacity)
+            for frame, background, layer in zip(frames, backgrounds, layers)])
+
+    paths = [(trajectory1, frame_nums[0], None)]
+    paths += [(layer.trajectory, frame_num, matrix) for layer, frame_num, matrix
+              in zip(layers, frame_nums[1:], matrices)]
+    paths = [(color, path) for color, path in enumerate(paths)
+             if path[0] is not None and path[1] is not None]
+    if paths:
+        start = time.perf_counter()
+        # Never draw on a decoded or cached input frame
+        result = blender.writable(result, [frame1] + list(frames))
+        for color, (trajectory, frame_num, matrix) in paths:
+            trajectory.draw(result, frame_num, color, rgb, matrix)
+        if blender.stats is not None:
+            blender.stats.add("paths", time.perf_counter() - start)
+    return result
+
+
+def _finish_writer(out, stats):
+    """Flush a writer, counting the encoder's remaining work as encode time
+
+    Releasing again afterwards (in a finally block) does nothing.
+    """
+    with stats.timed("encode"):
+        out.release()
+
+
+def export_shadow_video(video1_path, video2_path, output_path, start_time, end_time,
+                        sync_offset, shadow_opacity, progress_callback=None,
+                        cancel_event=None, index1=None, index2=None, time_warp=None,
+                        profile=None, stats=None, layers=None, background2=None,
+                        registration2=None, trajectory1=None, trajectory2=None):
+    """Export the blended shadow video for a time range on the calling thread
+
+    Opens its own captures so the preview captures are never touched from
+    the export thread. `progress_callback` receives the progress in percent;
+    setting `cancel_event` stops the export with ExportCancelled. `index1` and
+    `index2` are optional FrameIndex objects for accurate timing, and
+    `time_warp` an optional TimeWarp used instead of `sync_offset`. `profile`
+    is an ExportProfile or profile name (encoders.py), None for the default.
+    `layers` lists further ShadowLayer objects, stacked over video 2 in order.
+    `background2` (a ghost.BackgroundModel) blends only video 2's rider and
+    `registration2` (a registration.FrameRegistration) warps it onto video 1.
+    `trajectory1` and `trajectory2` (tracking.Trajectory objects) draw the
+    riders' paths of video 1 and 2. Stage times and progress go to `stats`
+    (an ExportStats) if given; the progress callback is throttled by it.
+    Returns the number of frames written.
+    """
+    if stats is None:
+        stats = ExportStats()
+    shadows = [ShadowLayer(video2_path, sync_offset, shadow_opacity, index2, time_warp,
+                           background2, registration2, trajectory2)]
+    shadows += layers or []
+    caps = []
+    out = None
+    try:
+        caps = _open_captures([video1_path] + [layer.video_path for layer in shadows])
+        pairs = _plan_for_captures(caps, start_time, end_time, index1, shadows, profile)
+        out = _open_writer(caps[0], output_path, profile)
+        _describe_export(stats, caps, video1_path, index1, shadows, output_path, profile, out)
+        stats.start(len(pairs))
+
+        reader1 = SequentialReader(caps[0], index1, stats, "decode1")
+        readers = [SequentialReader(cap, layer.index, stats, f"decode{n}")
+                   for n, (cap, layer) in enumerate(zip(caps[1:], shadows), 2)]
+        # Frames are written right away, so one reused output buffer suffices
+        blender = BlendEngine(stats=stats)
+
+        written = 0
+        for i, row in enumerate(pairs):
+            if cancel_event is not None and cancel_event.is_set():
+                raise ExportCancelled("Export cancelled")
+
+            # If a shadow frame is missing or out of bounds, it is left out
+            frame = _composite_row(blender, reader1, readers, row, shadows, trajectory1)
+            if frame is not None:
+                with stats.timed("encode"):
+                    out.write(frame)
+                written += 1
+
+            percent = stats.update(i + 1)
+            if progress_callback and percent is not None:
+                progress_callback(percent)
+
+        _finish_writer(out, stats)
+        stats.finish(written)
+        return written
+
+    finally:
+        _release_all([out] + caps)
+
+
+class ExportCancelled(Exception):
+    """Raised when an export is cancelled before it finishes"""
+
+
+class SequentialExporter:
+    """Single-threaded export with the same interface as PipelinedExporter"""
+
+    mode = "sequential"
+
+    def __init__(self, video1_path, video2_path, output_path, start_time, end_time,
+                 sync_offset, shadow_opacity, index1=None, index2=None, time_warp=None,
+                 profile=None, layers=None, background2=None, registration2=None,
+                 trajectory1=None, trajectory2=None):
+        self.args = (video1_path, video2_path, output_path, start_time, end_time,
+                     sync_offset, shadow_opacity)
+        self.output_path = output_path
+        self.index1 = index1
+        self.index2 = index2
+        self.time_warp = time_warp
+        self.profile = profile
+        self.layers = list(layers or [])
+        self.background2 = background2
+        self.registration2 = registration2
+        self.trajectory1 = trajectory1
+        self.trajectory2 = trajectory2
+        self.stats = ExportStats()
+        self.report_path = None
+        self._cancel_event = threading.Event()
+
+    def queue_depths(self):
+        """A single thread has no queues"""
+        return {}
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def run(self, progress_callback=None):
+        """Run the export and write its profile report next to the output"""
+        self.stats.info["mode"] = self.mode
+        written = export_shadow_video(*self.args, progress_callback=progress_callback,
+                                      cancel_event=self._cancel_event,
+                                      index1=self.index1, index2=self.index2,
+                                      time_warp=self.time_warp, profile=self.profile,
+                                      stats=self.stats, layers=self.layers,
+                                      background2=self.background2,
+                                      registration2=self.registration2,
+                                      trajectory1=self.trajectory1,
+                                      trajectory2=self.trajectory2)
+        self.report_path = self.stats.write_report(self.output_path)
+        return written
+
+
+_END = object()  # Marks the end of a stage's output
+
+
+class PipelinedExporter:
+    """Export with decoding, blending and encoding on separate threads
+
+    One decoder thread per source video (the main video and every shadow
+    layer) feeds a pool of blend workers, which feed a single encoder
+    thread. The bounded queues between the stages provide backpressure; the
+    encoder restores the original frame order.
+    """
+
+    mode = "pipelined"
+
+    def __init__(self, video1_path, video2_path, output_path, start_time, end_time,
+                 sync_offset, shadow_opacity, blend_workers=None, queue_size=8,
+                 index1=None, index2=None, time_warp=None, profile=None, layers=None,
+                 background2=None, registration2=None, trajectory1=None, trajectory2=None):
+        self.video1_path = video1_path
+        self.video2_path = video2_path
+        self.output_path = output_path
+        self.start_time = start_time
+        self.end_time = end_time
+        self.sync_offset = sync_offset
+        self.shadow_opacity = shadow_opacity
+        self.index1 = index1
+        self.index2 = index2
+        self.time_warp = time_warp
+        self.profile = profile
+        self.trajectory1 = trajectory1
+        self.shadows = [ShadowLayer(video2_path, sync_offset, shadow_opacity, index2, time_warp,
+                                    background2, registration2, trajectory2)]
+        self.shadows += layers or []
+        if blend_workers is None:
+            # Leave a core each for the decoders and the encoder
+            blend_workers = max(1, min(8, (os.cpu_count() or 1) - len(self.shadows) - 2))
+        self.blend_workers = blend_workers
+
+        # One queue of decoded frames per source, the main video first
+        self.decoded_queues = [queue.Queue(maxsize=queue_size)
+                               for _ in range(len(self.shadows) + 1)]
+        self.blended_queue = queue.Queue(maxsize=queue_size)
+        self.frame_pool = FramePool(max_free=queue_size + self.blend_workers + 2)
+        self._pair_lock = threading.Lock()
+        self._next_index = 0
+        self._rows = []
+        self._cancel_event = threading.Event()
+        self._error = None
+        self.written = 0
+        self.stats = ExportStats()
+        self.report_path = None
+
+    def queue_depths(self):
+        """Return {queue name: (items, capacity)} for every stage queue"""
+        depths = {f'decode{n}': (q.qsize(), q.maxsize)
+                  for n, q in enumerate(self.decoded_queues, 1)}
+        depths['blend'] = (self.blended_queue.qsize(), self.blended_queue.maxsize)
+        return depths
+
+    def cancel(self):
+        """Stop all stages as soon as possible"""
+        self._cancel_event.set()
+
+    def run(self, progress_callback=None):
+        """Run the export on worker threads and wait for it to finish
+
+        Returns the number of frames written and writes the profile report
+        next to the output. Errors raised by any stage are re-raised here.
+        """
+        caps = []
+        out = None
+        try:
+            caps = _open_captures([self.video1_path]
+                                  + [layer.video_path for layer in self.shadows])
+            pairs = _plan_for_captures(caps, self.start_time, self.end_time, self.index1,
+                                       self.shadows, self.profile)
+            # Blend workers look up the frame numbers, e.g. for registration
+            self._rows = pairs
+            out = _open_writer(caps[0], self.output_path, self.profile)
+            _describe_export(self.stats, caps, self.video1_path, self.index1, self.shadows,
+                             self.output_path, self.profile, out)
+            self.stats.info.update(mode=self.mode, blend_workers=self.blend_workers)
+            self.stats.start(len(pairs))
+
+            indexes = [self.index1] + [layer.index for layer in self.shadows]
+            threads = [
+                threading.Thread(target=self._stage, args=(
+                    self._decode, SequentialReader(cap, index, self.stats, f"decode{n}"),
+                    [row[n - 1] for row in pairs], decoded_queue))
+                for n, (cap, index, decoded_queue)
+                in enumerate(zip(caps, indexes, self.decoded_queues), 1)
+            ]
+            threads.append(threading.Thread(target=self._stage, args=(
+                self._encode, out, progress_callback)))
+            threads += [threading.Thread(target=self._stage, args=(self._blend,))
+                        for _ in range(self.blend_workers)]
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            if self._error is not None:
+                raise self._error
+            if self._cancel_event.is_set():
+                raise ExportCancelled("Export cancelled")
+            _finish_writer(out, self.stats)
+            self.stats.finish(self.written)
+            self.report_path = self.stats.write_report(self.output_path)
+            return self.written
+
+        finally:
+            _release_all([out] + caps)
+
+    def _stage(self, target, *args):
+        """Run one stage, cancelling the whole pipeline if it fails"""
+        try:
+            target(*args)
+        except ExportCancelled:
+            pass
+        except Exception as e:
+            if self._error is None:
+                self._error = e
+            self._cancel_event.set()
+
+    def _put(self, q, item):
+        """Put with backpressure while staying responsive to cancellation"""
+        while True:
+            if self._cancel_event.is_set():
+                raise ExportCancelled()
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _get(self, q):
+        """Get while staying responsive to cancellation"""
+        while True:
+            if self._cancel_event.is_set():
+                raise ExportCancelled()
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+    def _decode(self, reader, frame_nums, out_queue):
+        """Decoder stage: read the requested frames of one video in order"""
+        for frame_num in frame_nums:
+            frame = reader.read(frame_num) if frame_num is not None else None
+            self._put(out_queue, frame)
+        # One end marker per blend worker
+        for _ in range(self.blend_workers):
+            self._put(out_queue, _END)
+
+    def _blend(self):
+        """Blend stage: combine matching frames from all decoders"""
+        # Results wait in the queue, so they come from the shared pool and
+        # the encoder returns them after writing
+        blender = BlendEngine(self.frame_pool, self.stats)
+        while True:
+            # All decoders emit frames in plan order, so taking one item from
+            # each queue under a lock matches them up and numbers them.
+            # Registration runs under the lock too, so it sees the frames in
+            # plan order and can track from one to the next
+            with self._pair_lock:
+                frames = [self._get(q) for q in self.decoded_queues]
+                index = self._next_index
+                self._next_index += 1
+                frame1 = frames[0]
+                matrices = None
+                if frame1 is not None and frame1 is not _END:
+                    matrices = register_layers(frame1, frames[1:], self.shadows,
+                                               self._rows[index], self.stats)
+
+            if frame1 is _END:
+                self._put(self.blended_queue, _END)
+                return
+
+            if frame1 is not None:
+                frame1 = stack_layers(blender, frame1, frames[1:], self.shadows,
+                                      self._rows[index], trajectory1=self.trajectory1,
+                                      matrices=matrices)
+            self._put(self.blended_queue, (index, frame1))
+
+    def _encode(self, out, progress_callback):
+        """Encoder stage: write blended frames in their original order"""
+        pending = {}
+        next_index = 0
+        finished_workers = 0
+        while finished_workers < self.blend_workers:
+            item = self._get(self.blended_queue)
+            if item is _END:
+                finished_workers += 1
+                continue
+
+            index, frame = item
+            pending[index] = frame
+            while next_index in pending:
+                frame = pending.pop(next_index)
+                next_index += 1
+                # Frames video 1 could not decode are dropped, as before
+                if frame is not None:
+                    with self.stats.timed("encode"):
+                        out.write(frame)
+                    self.frame_pool.release(frame)
+                    self.written += 1
+                percent = self.stats.update(next_index)
+                if progress_callback and percent is not None:
+                    progress_callback(percent)
+
+
+def keyframe_numbers(video_path):
+    """Return the frame numbers of a video's keyframes, or None if unknown
+
+    Reads packets without decoding them, so even long files take well
+    under a second.
+    """
+    cap = cv2.VideoCapture(str(video_path), cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])
+    try:
+        if not cap.isOpened():
+            return None
+        keyframes = []
+        frame_num = 0
+        while cap.grab():
+            if cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+                keyframes.append(frame_num)
+            frame_num += 1
+        return keyframes or None
+    except cv2.error:
+        return None
+    finally:
+        cap.release()
+
+
+def split_segments(start_frame, end_frame, segments, keyframes=None):
+    """Split [start_frame, end_frame) into up to `segments` contiguous ranges
+
+    Interior boundaries are moved to the nearest keyframe so every segment
+    starts with a cheap seek. Consecutive ranges share their boundary, so no
+    frame is duplicated or dropped. Returns a list of (start, end) tuples.
+    """
+    length = end_frame - start_frame
+    segments = max(1, min(segments, length))
+    candidates = sorted(k for k in (keyframes or ()) if start_frame < k < end_frame)
+
+    boundaries = [start_frame]
+    for i in range(1, segments):
+        boundary = start_frame + round(i * length / segments)
+        if candidates:
+            boundary = min(candidates, key=lambda k: abs(k - boundary))
+        if boundary > boundaries[-1]:
+            boundaries.append(boundary)
+    boundaries.append(end_frame)
+
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def _export_segment(video1_path, layers, segment_path, pairs, cancel_event, progress_queue,
+                    index1=None, profile=None, trajectory1=None):
+    """Worker process: export one segment's planned frames to its own file
+
+    `layers` are the ShadowLayer objects the rows of `pairs` refer to.
+    Returns (frames written, {stage: (seconds, calls)}, writer class name).
+    """
+    stats = ExportStats()
+    caps = []
+    out = None
+    try:
+        caps = _open_captures([video1_path] + [layer.video_path for layer in layers])
+        out = _open_writer(caps[0], segment_path, profile)
+
+        reader1 = SequentialReader(caps[0], index1, stats, "decode1")
+        readers = [SequentialReader(cap, layer.index, stats, f"decode{n}")
+                   for n, (cap, layer) in enumerate(zip(caps[1:], layers), 2)]
+        blender = BlendEngine(stats=stats)
+
+        written = 0
+        reported = 0
+        for i, row in enumerate(pairs):
+            if cancel_event.is_set():
+                return written, stats.totals(), type(out).__name__
+
+            frame = _composite_row(blender, reader1, readers, row, layers, trajectory1)
+            if frame is not None:
+                with stats.timed("encode"):
+                    out.write(frame)
+                written += 1
+
+            # Report progress in batches to keep inter-process traffic low
+            if i + 1 - reported >= 10 or i + 1 == len(pairs):
+                progress_queue.put(i + 1 - reported)
+                reported = i + 1
+
+        _finish_writer(out, stats)
+        return written, stats.totals(), type(out).__name__
+
+    finally:
+        _release_all([out] + caps)
+
+
+class SegmentedExporter:
+    """Export a long range as parallel segments in separate processes
+
+    Each process opens its own captures of every source and its own writer. The
+    segment files are joined with ffmpeg's concat demuxer, which copies
+    the encoded frames instead of re-encoding them. Stage times are the sum
+    over all worker processes.
+    """
+
+    mode = "segmented"
+
+    def __init__(self, video1_path, video2_path, output_path, start_time, end_time,
+                 sync_offset, shadow_opacity, processes=None, segments=None,
+                 index1=None, index2=None, time_warp=None, profile=None, layers=None,
+                 background2=None, registration2=None, trajectory1=None, trajectory2=None):
+        self.video1_path = video1_path
+        self.video2_path = video2_path
+        self.output_path = output_path
+        self.start_time = start_time
+        self.end_time = end_time
+        self.sync_offset = sync_offset
+        self.shadow_opacity = shadow_opacity
+        self.processes = processes or os.cpu_count() or 1
+        self.segments = segments or self.processes
+        self.index1 = index1
+        self.index2 = index2
+        self.time_warp = time_warp
+        self.profile = profile
+        self.trajectory1 = trajectory1
+        self.shadows = [ShadowLayer(video2_path, sync_offset, shadow_opacity, index2, time_warp,
+                                    background2, registration2, trajectory2)]
+        self.shadows += layers or []
+        self._cancel_requested = threading.Event()
+        self._manager = None
+        self._cancel_event = None
+        self.stats = ExportStats()
+        self.report_path = None
+
+    def queue_depths(self):
+        """Segments do not share queues"""
+        return {}
+
+    def cancel(self):
+        self._cancel_requested.set()
+        if self._cancel_event is not None:
+            self._cancel_event.set()
+
+    def run(self, progress_callback=None):
+        """Export all segments, join them and return the number of frames written"""
+        ffmpeg = ffmpeg_tools.find_ffmpeg()
+        if not ffmpeg:
+            raise RuntimeError("Parallel export needs ffmpeg to join the segments losslessly")
+
+        caps = _open_captures([self.video1_path] + [layer.video_path for layer in self.shadows])
+        try:
+            pairs = _plan_for_captures(caps, self.start_time, self.end_time, self.index1,
+                                       self.shadows, self.profile)
+            _describe_export(self.stats, caps, self.video1_path, self.index1, self.shadows,
+                             self.output_path, self.profile)
+        finally:
+            _release_all(caps)
+        if not pairs:
+            raise ValueError("The selected range contains no frames")
+
+        # Segment boundaries are main video frame numbers
+        first_frame = pairs[0][0]
+        if self.index1 is not None:
+            keyframes = self.index1.keyframes.tolist()
+        else:
+            keyframes = keyframe_numbers(self.video1_path)
+        ranges = split_segments(first_frame, pairs[-1][0] + 1, self.segments, keyframes)
+        self.stats.info.update(mode=self.mode, segments=len(ranges),
+                               processes=min(self.processes, len(ranges)))
+        self.stats.start(len(pairs))
+
+        temp_dir = tempfile.mkdtemp(prefix="gymkhana_segments_")
+        self._manager = multiprocessing.Manager()
+        try:
+            self._cancel_event = self._manager.Event()
+            if self._cancel_requested.is_set():
+                self._cancel_event.set()
+            progress_queue = self._manager.Queue()
+            suffix = Path(self.output_path).suffix or ".mp4"
+            segment_paths = [os.path.join(temp_dir, f"segment_{i:03d}{suffix}")
+                             for i in range(len(ranges))]
+
+            with ProcessPoolExecutor(max_workers=min(self.processes, len(ranges))) as pool:
+                futures = [
+                    pool.submit(_export_segment, self.video1_path, self.shadows, path,
+                                [row for row in pairs if start <= row[0] < end],
+                                self._cancel_event, progress_queue, self.index1, self.profile,
+                                self.trajectory1)
+                    for path, (start, end) in zip(segment_paths, ranges)
+                ]
+
+                done = 0
+                failed = None
+                while not all(future.done() for future in futures) or not progress_queue.empty():
+                    failed = next((future for future in futures if future.done()
+                                   and not future.cancelled() and future.exception()), None)
+                    if failed is not None:
+                        # Stop the other segments now instead of after they finish
+                        self._cancel_event.set()
+                        for future in futures:
+                            future.cancel()
+                        break
+                    try:
+                        done += progress_queue.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                    percent = self.stats.update(done)
+                    if progress_callback and percent is not None:
+                        progress_callback(percent)
+
+                if failed is not None:
+                    raise failed.exception()
+                written = 0
+                for future in futures:
+                    segment_written, stage_totals, writer = future.result()
+                    written += segment_written
+                    self.stats.merge(stage_totals)
+                    self.stats.info["writer"] = writer
+
+            if self._cancel_event.is_set():
+                raise ExportCancelled("Export cancelled")
+
+            with self.stats.timed("join"):
+                ffmpeg_tools.concat_videos(segment_paths, self.output_path, ffmpeg)
+            self.stats.finish(written)
+            self.report_path = self.stats.write_report(self.output_path)
+            return written
+
+        finally:
+            self._manager.shutdown()
+            self._manager = None
+            self._cancel_event = None
+            shutil.rmtree(temp_dir, ignore_errors=True)
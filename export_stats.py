@@ -0,0 +1,233 @@
+"""
+Export throughput and per-stage timing
+
+ExportStats adds up the time each stage of an export spends (seeking,
+decoding each video, resizing, blending, encoding), keeps a rolling frame
+rate for the ETA and decides when a progress update is due, so listeners
+such as the Tk event queue get a few updates a second instead of one per
+frame.
+
+When an export finishes, a JSON report with the stage times, the source
+formats and the machine is written next to the output file
+(`run.mp4` -> `run.profile.json`), for comparing machines and formats.
+"""
+
+import json
+import os
+import platform
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+
+# Seconds between progress updates
+PROGRESS_INTERVAL = 0.2
+
+# Seconds of recent progress the frame rate and ETA are computed from
+FPS_WINDOW = 3.0
+
+REPORT_VERSION = 1
+
+
+class ExportStats:
+    """Thread-safe stage timers and progress of one export
+
+    Stages are free-form names; the exporters use "seek", "decode1" (the
+    main video), "decode2" and up (one per shadow layer), "register" and
+    "warp" (registration), "resize", "mask" (ghost rider), "blend", "paths"
+    (rider paths), "encode" and "join". Times are busy time per stage, so in
+    a pipelined export they add up to more than the wall clock time.
+    """
+
+    def __init__(self, progress_interval=PROGRESS_INTERVAL):
+        self.progress_interval = progress_interval
+        self.stages = {}  # Stage name -> [seconds, calls]
+        self.sources = []
+        self.info = {}
+        self.total = 0
+        self.done = 0
+        self.frames_written = 0
+        self.started = time.perf_counter()
+        self.finished = None
+        self._history = deque([(self.started, 0)])
+        self._last_update = None
+        self._lock = threading.Lock()
+
+    def start(self, total):
+        """Start the clock for an export of `total` planned frames"""
+        self.total = total
+        self.done = 0
+        self.started = time.perf_counter()
+        self.finished = None
+        self._history = deque([(self.started, 0)])
+        self._last_update = None
+
+    def finish(self, frames_written):
+        self.frames_written = frames_written
+        self.finished = time.perf_counter()
+
+    def add(self, stage, seconds, calls=1):
+        """Add `seconds` spent in `stage`"""
+        with self._lock:
+            totals = self.stages.get(stage)
+            if totals is None:
+                self.stages[stage] = [seconds, calls]
+            else:
+                totals[0] += seconds
+                totals[1] += calls
+
+    def timed(self, stage):
+        """Context manager adding the time spent in its body to `stage`"""
+        return _StageTimer(self, stage)
+
+    def merge(self, stages):
+        """Add the {stage: (seconds, calls)} totals of another export, e.g. a worker process"""
+        for stage, (seconds, calls) in stages.items():
+            self.add(stage, seconds, calls)
+
+    def totals(self):
+        """Return a {stage: (seconds, calls)} copy, picklable for worker processes"""
+        with self._lock:
+            return {stage: tuple(totals) for stage, totals in self.stages.items()}
+
+    def update(self, done):
+        """Record that `done` planned frames are finished
+
+        Returns the progress in percent when an update is due (at most
+        every `progress_interval` seconds, and always for the last frame),
+        otherwise None.
+        """
+        self.done = done
+        now = time.perf_counter()
+        if (done < self.total and self._last_update is not None
+                and now - self._last_update < self.progress_interval):
+            return None
+        self._last_update = now
+        self._history.append((now, done))
+        while len(self._history) > 2 and now - self._history[1][0] >= FPS_WINDOW:
+            self._history.popleft()
+        return 100.0 * done / self.total if self.total else 100.0
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def fps(self):
+        """Frames per second over the last few seconds"""
+        (first_time, first_done), (last_time, last_done) = self._history[0], self._history[-1]
+        if last_time <= first_time:
+            return 0.0
+        return (last_done - first_done) / (last_time - first_time)
+
+    @property
+    def eta(self):
+        """Seconds until the export finishes at the current rate, or None if unknown"""
+        fps = self.fps
+        if fps <= 0:
+            return None
+        return max(0, self.total - self.done) / fps
+
+    def report(self):
+        """Return the profile report as a JSON-compatible dict"""
+        elapsed = self.elapsed
+        frames = self.frames_written
+        stages = {}
+        for stage, (seconds, calls) in self.totals().items():
+            stages[stage] = {
+                "seconds": round(seconds, 4),
+                "calls": calls,
+                "ms_per_frame": round(1000.0 * seconds / frames, 3) if frames else None,
+                "share_of_wall": round(seconds / elapsed, 3) if elapsed > 0 else None,
+            }
+        return {
+            "version": REPORT_VERSION,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "export": dict(self.info),
+            "frames_planned": self.total,
+            "frames_written": frames,
+            "wall_seconds": round(elapsed, 4),
+            "fps": round(frames / elapsed, 3) if elapsed > 0 else None,
+            "stages": stages,
+            "sources": self.sources,
+            "machine": machine_info(),
+        }
+
+    def write_report(self, output_path):
+        """Write the report next to `output_path` and return its path, or None if it failed"""
+        path = report_path(output_path)
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(self.report(), f, indent=2)
+        except OSError:
+            return None
+        return path
+
+
+class _StageTimer:
+    def __init__(self, stats, stage):
+        self.stats = stats
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.stats.add(self.stage, time.perf_counter() - self.start)
+
+
+def report_path(output_path):
+    """Return where the profile report of an export to `output_path` goes"""
+    return str(Path(output_path).with_suffix(".profile.json"))
+
+
+def fourcc_name(fourcc):
+    """Return a FOURCC code as text, e.g. "avc1", or "" if unknown"""
+    fourcc = int(fourcc)
+    return "".join(chr((fourcc >> shift) & 0xFF) for shift in (0, 8, 16, 24)).strip("\0 ")
+
+
+def source_info(cap, video_path, index=None):
+    """Describe the format of an open source video for the report"""
+    codec = fourcc_name(cap.get(cv2.CAP_PROP_FOURCC))
+    try:
+        size = os.path.getsize(video_path)
+    except OSError:
+        size = None
+    return {
+        "path": str(video_path),
+        "codec": codec or None,
+        "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        "fps": round(cap.get(cv2.CAP_PROP_FPS), 3),
+        "frames": int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
+        "bytes": size,
+        "timing": "index" if index is not None else "nominal",
+    }
+
+
+def machine_info():
+    """Describe this machine and the libraries used for the report"""
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+    }
+
+
+def format_duration(seconds):
+    """Format seconds as m:ss, or h:mm:ss for long durations"""
+    if seconds is None:
+        return "--:--"
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
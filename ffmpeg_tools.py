@@ -0,0 +1,93 @@
+"""
+Helpers for the optional external ffmpeg executable
+
+OpenCV covers decoding and basic encoding on its own. A few features work
+better (or only) with the ffmpeg command line tool; they look it up here
+and fall back to OpenCV when it is not installed.
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+from pathlib import Path
+
+
+# Keep the windowed (PyInstaller) build from flashing a console per call
+NO_WINDOW = getattr(subprocess, "CREATE_NO_WINDOW", 0)
+
+
+def find_ffmpeg():
+    """Return the path of the ffmpeg executable, or None if it is not available
+
+    The GYMKHANA_FFMPEG environment variable takes precedence over PATH.
+    """
+    configured = os.environ.get("GYMKHANA_FFMPEG")
+    if configured and Path(configured).is_file():
+        return configured
+    return shutil.which("ffmpeg")
+
+
+def keyframe_command(ffmpeg, video_path, video_filter):
+    """Return an ffmpeg command decoding only the keyframes of a video through `video_filter`
+
+    The filtered frames go to stdout as raw video, one per keyframe. The
+    filter should end with showinfo, whose pts_time lines in stderr give
+    each frame's time. `-vsync` is spelled the old way: ffmpeg before 5.1
+    has no `-fps_mode`, and newer versions still accept `-vsync`.
+    """
+    return [ffmpeg, "-hide_banner", "-nostats", "-skip_frame", "nokey", "-i", str(video_path),
+            "-an", "-vf", video_filter, "-vsync", "passthrough", "-f", "rawvideo", "-"]
+
+
+def read_output(cmd, cancel_event=None):
+    """Run an ffmpeg command that writes to stdout and return (returncode, stdout, stderr)
+
+    stderr goes to a temporary file, so chatty output (e.g. the showinfo
+    filter) cannot fill a pipe and stall ffmpeg. Returns None if
+    `cancel_event` is set before ffmpeg finishes; the process is killed.
+    """
+    with tempfile.TemporaryFile() as log:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=log,
+                                   creationflags=NO_WINDOW)
+        chunks = []
+        try:
+            while True:
+                if cancel_event is not None and cancel_event.is_set():
+                    return None
+                chunk = process.stdout.read(1 << 16)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            returncode = process.wait()
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
+        log.seek(0)
+        return returncode, b"".join(chunks), log.read()
+
+
+def concat_videos(segment_paths, output_path, ffmpeg=None):
+    """Join video files with identical encoding without re-encoding them"""
+    ffmpeg = ffmpeg or find_ffmpeg()
+    if not ffmpeg:
+        raise RuntimeError("ffmpeg is required to join video segments")
+
+    # The concat demuxer reads the segment list from a file
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False, encoding="utf-8") as f:
+        for path in segment_paths:
+            escaped = str(Path(path).resolve()).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+        list_path = f.name
+
+    try:
+        cmd = [ffmpeg, "-y", "-loglevel", "error", "-f", "concat", "-safe", "0",
+               "-i", list_path, "-c", "copy", str(output_path)]
+        result = subprocess.run(cmd, capture_output=True, text=True,
+                                creationflags=NO_WINDOW)
+        if result.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed to join segments: {result.stderr.strip()}")
+    finally:
+        os.unlink(list_path)
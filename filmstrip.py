@@ -0,0 +1,150 @@
+"""
+Filmstrip of keyframe thumbnails under the timeline
+
+One row of thumbnails per loaded video, evenly spaced along the timeline,
+the shadow row showing what is shown together with each main video time
+(i.e. shifted by the sync offset or time warp). The strip is drawn as a
+single image, so redrawing after an offset change is one paste.
+
+Hovering shows the main and shadow thumbnails at that time, enlarged in a
+small popup; this only reads the ThumbnailStrips, never a decoder.
+Clicking seeks there.
+"""
+
+import tkinter as tk
+
+import cv2
+import numpy as np
+from PIL import Image, ImageTk
+
+from display import CanvasDisplay
+from thumbnails import THUMBNAIL_HEIGHT
+
+
+# Pixels between the rows of the strip
+ROW_GAP = 2
+
+# Enlargement of the thumbnails in the hover popup
+HOVER_SCALE = 2
+
+
+class Filmstrip:
+    """Canvas showing thumbnail rows for the timeline; `on_seek(time)` is called on click"""
+
+    def __init__(self, parent, on_seek):
+        self.canvas = tk.Canvas(parent, bg="black", highlightthickness=0,
+                                height=2 * THUMBNAIL_HEIGHT + ROW_GAP)
+        self.display = CanvasDisplay(self.canvas)
+        self.on_seek = on_seek
+        # (ThumbnailStrip or None, function from timeline time to the video's time)
+        # per row; the function returns None where the video has no frames
+        self.rows = []
+        self.duration = 0.0
+        self.playhead_time = None
+        self._popup = None
+        self._popup_label = None
+        self._popup_photo = None
+        self.canvas.bind('<Configure>', lambda event: self.redraw())
+        self.canvas.bind('<Motion>', self._hover)
+        self.canvas.bind('<Leave>', lambda event: self._hide_popup())
+        self.canvas.bind('<ButtonRelease-1>', self._click)
+
+    def set_rows(self, rows, duration):
+        """Show `rows` of (strip or None, time mapping) across `duration` seconds"""
+        self.rows = list(rows)
+        self.duration = duration
+        self.redraw()
+
+    def redraw(self):
+        """Draw the rows at the current canvas width"""
+        strips = [strip for strip, _ in self.rows if strip is not None and len(strip)]
+        if not strips or self.duration <= 0:
+            self.display.clear()
+            self.canvas.delete("playhead")
+            return
+        width = self.display.canvas_size()[0]
+        image = np.zeros((len(self.rows) * (THUMBNAIL_HEIGHT + ROW_GAP) - ROW_GAP, width, 3),
+                         np.uint8)
+        for row, (strip, to_video_time) in enumerate(self.rows):
+            if strip is None or not len(strip):
+                continue
+            top = row * (THUMBNAIL_HEIGHT + ROW_GAP)
+            # Each row is split by its own thumbnail width, so a portrait
+            # video next to a landscape one still lines up with the timeline
+            thumbnail_width = strip.size[0]
+            slots = max(1, width // thumbnail_width)
+            slot_duration = self.duration / slots
+            for slot in range(slots):
+                video_time = to_video_time((slot + 0.5) * slot_duration)
+                if video_time is None:
+                    continue
+                thumbnail = strip.image_at(video_time)
+                left = slot * thumbnail_width
+                part = thumbnail[:, :min(thumbnail.shape[1], width - left)]
+                image[top:top + part.shape[0], left:left + part.shape[1]] = part
+        self.display.show(image)
+        self._draw_playhead()
+
+    def set_playhead(self, time):
+        """Mark the current timeline position"""
+        self.playhead_time = time
+        self._draw_playhead()
+
+    def _draw_playhead(self):
+        self.canvas.delete("playhead")
+        if self.playhead_time is None or self.duration <= 0 or self.display.image_size is None:
+            return
+        x = self.playhead_time / self.duration * self.display.canvas_size()[0]
+        self.canvas.create_line(x, 0, x, self.canvas.winfo_height(), fill="yellow",
+                                width=2, tags="playhead")
+
+    def _time_at(self, x):
+        width = self.display.canvas_size()[0]
+        return min(max(x / width, 0.0), 1.0) * self.duration
+
+    def _click(self, event):
+        if self.duration > 0:
+            self.on_seek(self._time_at(event.x))
+
+    def _hover(self, event):
+        """Show the enlarged thumbnails of each row at the time under the pointer"""
+        if self.duration <= 0 or not self.rows:
+            return
+        time = self._time_at(event.x)
+        thumbnails = []
+        for strip, to_video_time in self.rows:
+            video_time = to_video_time(time)
+            if strip is not None and len(strip) and video_time is not None:
+                thumbnails.append(strip.image_at(video_time))
+        if not thumbnails:
+            return
+        height = max(thumbnail.shape[0] for thumbnail in thumbnails)
+        picture = np.hstack([cv2.copyMakeBorder(thumbnail, 0, height - thumbnail.shape[0],
+                                                0, ROW_GAP, cv2.BORDER_CONSTANT)
+                             for thumbnail in thumbnails])
+        picture = cv2.resize(picture, None, fx=HOVER_SCALE, fy=HOVER_SCALE,
+                             interpolation=cv2.INTER_LINEAR)
+
+        if self._popup is None:
+            self._popup = tk.Toplevel(self.canvas)
+            self._popup.overrideredirect(True)
+            self._popup_label = tk.Label(self._popup, bg="black", fg="white",
+                                         compound=tk.TOP)
+            self._popup_label.pack()
+        image = Image.fromarray(picture)
+        if self._popup_photo is None or (self._popup_photo.width(),
+                                         self._popup_photo.height()) != image.size:
+            self._popup_photo = ImageTk.PhotoImage(image)
+            self._popup_label.config(image=self._popup_photo)
+        else:
+            self._popup_photo.paste(image)
+        self._popup_label.config(text=f"{time:.1f}s")
+        x = event.x_root - picture.shape[1] // 2
+        y = self.canvas.winfo_rooty() - picture.shape[0] - 30
+        self._popup.geometry(f"+{max(0, x)}+{max(0, y)}")
+
+    def _hide_popup(self):
+        if self._popup is not None:
+            self._popup.destroy()
+            self._popup = None
+            self._popup_photo = None
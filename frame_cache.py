@@ -0,0 +1,163 @@
+"""
+Decoded frame cache for the interactive preview
+
+FrameCache keeps recently shown preview frames in memory, bounded by a
+budget in MB and evicted least recently used first. ReadAhead fills the
+cache from a background thread with the frames just ahead of the playhead
+in the direction the user is moving, so playback and stepping hit the
+cache instead of the decoder.
+"""
+
+import threading
+from collections import OrderedDict
+
+import cv2
+
+from export_engine import SequentialReader
+
+
+class FrameCache:
+    """Thread-safe LRU cache of frames with a memory budget"""
+
+    def __init__(self, budget_mb=256):
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._frames
+
+    def __len__(self):
+        return len(self._frames)
+
+    def get(self, key):
+        """Return the cached frame for `key`, or None, counting hits and misses"""
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is None:
+                self.misses += 1
+                return None
+            self._frames.move_to_end(key)
+            self.hits += 1
+            return frame
+
+    def put(self, key, frame):
+        """Add a frame, evicting the least recently used ones over budget"""
+        if frame.nbytes > self.budget_bytes:
+            return
+        with self._lock:
+            previous = self._frames.pop(key, None)
+            if previous is not None:
+                self.used_bytes -= previous.nbytes
+            self._frames[key] = frame
+            self.used_bytes += frame.nbytes
+            while self.used_bytes > self.budget_bytes:
+                _, evicted = self._frames.popitem(last=False)
+                self.used_bytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self.used_bytes = 0
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        """Return counters for tuning the budget"""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+            'frames': len(self._frames),
+            'used_mb': self.used_bytes / (1024 * 1024),
+            'budget_mb': self.budget_bytes / (1024 * 1024),
+        }
+
+
+class ReadAhead:
+    """Background thread decoding frames ahead of the playhead into a cache
+
+    The thread owns a separate capture, so it never competes with the
+    preview for the position of the preview capture. `index` is the video's
+    FrameIndex or None. `prepare` turns a decoded frame into what the cache
+    stores (e.g. a resized copy) and `key` maps a frame number to its
+    cache key.
+    """
+
+    def __init__(self, video_path, cache, total_frames, index, prepare, key, frames_ahead=30):
+        self.video_path = video_path
+        self.cache = cache
+        self.total_frames = total_frames
+        self.index = index
+        self.prepare = prepare
+        self.key = key
+        self.frames_ahead = frames_ahead
+
+        self._target = None  # (playhead, direction)
+        self._wakeup = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def update(self, playhead, direction):
+        """Move the read-ahead window; direction is 1 (forward) or -1 (backward)"""
+        with self._wakeup:
+            self._target = (playhead, direction)
+            self._wakeup.notify()
+
+    def stop(self):
+        with self._wakeup:
+            self._stopped = True
+            self._wakeup.notify()
+        self._thread.join(timeout=1.0)
+
+    def _next_target(self):
+        """Wait for a new playhead position, or return None once stopped"""
+        with self._wakeup:
+            while self._target is None and not self._stopped:
+                self._wakeup.wait()
+            if self._stopped:
+                return None
+            target, self._target = self._target, None
+            return target
+
+    def _run(self):
+        cap = cv2.VideoCapture(self.video_path)
+        try:
+            reader = SequentialReader(cap, self.index)
+            while True:
+                target = self._next_target()
+                if target is None:
+                    return
+                self._fill(reader, *target)
+        finally:
+            cap.release()
+
+    def _fill(self, reader, playhead, direction):
+        """Decode the uncached frames of the window ahead of `playhead`"""
+        if direction > 0:
+            first, last = playhead + 1, playhead + self.frames_ahead
+        else:
+            # Decoding only runs forwards, so fill the window behind the
+            # playhead from its far end
+            first, last = playhead - self.frames_ahead, playhead - 1
+        first = max(0, first)
+        last = min(self.total_frames - 1, last)
+
+        for frame_num in range(first, last + 1):
+            # Give up on this window as soon as the playhead moves again
+            if self._target is not None or self._stopped:
+                return
+            if self.key(frame_num) in self.cache:
+                continue
+            frame = reader.read(frame_num)
+            if frame is None:
+                return
+            self.cache.put(self.key(frame_num), self.prepare(frame))
@@ -0,0 +1,246 @@
+"""
+Per-video frame timestamp and keyframe index
+
+CAP_PROP_FPS and CAP_PROP_FRAME_COUNT are estimates for variable frame rate
+footage (e.g. phone videos), so `int(time * fps)` can land on the wrong
+frame. FrameIndex records the real presentation timestamp of every frame
+and the positions of the keyframes, read from the packets without decoding
+them. Seeks then start at the nearest keyframe and decode forward to the
+exact frame.
+
+Indexes are saved in a sidecar file next to the video (or in the cache
+directory if that is not writable), keyed by file size and mtime. With an
+ArtifactStore (artifacts.py), e.g. a project's, the index is also kept
+there by content, so it survives the video being moved or copied.
+"""
+
+import threading
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+import artifacts
+import storage
+
+
+INDEX_VERSION = 1
+SIDECAR_SUFFIX = ".gymidx.npz"
+
+# Two timestamps closer than this are the same frame
+TIME_EPSILON = 1e-3
+
+
+class IndexCancelled(Exception):
+    """Raised when building an index is cancelled"""
+
+
+class FrameIndex:
+    """Presentation timestamps (in seconds) of all frames and the keyframe positions"""
+
+    def __init__(self, timestamps, keyframes):
+        self.timestamps = np.asarray(timestamps, dtype=np.float64)
+        self.keyframes = np.asarray(keyframes, dtype=np.int64)
+        if len(self.timestamps) > 1:
+            self.frame_duration = float(np.median(np.diff(self.timestamps)))
+        else:
+            self.frame_duration = 0.0
+
+    @property
+    def total_frames(self):
+        return len(self.timestamps)
+
+    @property
+    def duration(self):
+        if not len(self.timestamps):
+            return 0.0
+        return float(self.timestamps[-1] + self.frame_duration)
+
+    @property
+    def average_fps(self):
+        return self.total_frames / self.duration if self.duration > 0 else 0.0
+
+    def time_of(self, frame_num):
+        """Return the presentation time of a frame"""
+        frame_num = max(0, min(frame_num, self.total_frames - 1))
+        return float(self.timestamps[frame_num])
+
+    def frame_at(self, time):
+        """Return the frame on screen at `time`
+
+        Like int(time * fps) this can return -1 before the first frame and
+        total_frames after the last one, so callers decide how to clamp.
+        """
+        if time >= self.duration:
+            return self.total_frames
+        return int(np.searchsorted(self.timestamps, time + TIME_EPSILON, side="right")) - 1
+
+    def keyframe_before(self, frame_num):
+        """Return the last keyframe at or before `frame_num`"""
+        i = int(np.searchsorted(self.keyframes, frame_num, side="right")) - 1
+        return int(self.keyframes[i]) if i >= 0 else 0
+
+    def seek(self, cap, frame_num):
+        """Grab frame `frame_num` on a decoding capture so cap.retrieve() returns it
+
+        OpenCV seeks by frame number using the nominal fps, so the seek is
+        aimed at the keyframe before the target, moved back if it lands too
+        late, and the rest of the way is decoded with grab(), comparing real
+        timestamps. Returns False if the frame cannot be reached.
+        """
+        target = self.timestamps[frame_num]
+        nominal_fps = cap.get(cv2.CAP_PROP_FPS) or self.average_fps
+        guess = int(self.timestamps[self.keyframe_before(frame_num)] * nominal_fps)
+        back_off = max(1, int(nominal_fps))
+
+        while True:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, guess)
+            if not cap.grab():
+                return False
+            position = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+            if position <= target + TIME_EPSILON or guess == 0:
+                break
+            guess = max(0, guess - back_off)
+            back_off *= 2
+
+        while position < target - TIME_EPSILON:
+            if not cap.grab():
+                return False
+            position = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+        return True
+
+    def save(self, path, signature):
+        storage.save_arrays(path, version=INDEX_VERSION,
+                            signature=np.asarray(signature, dtype=np.int64),
+                            timestamps=self.timestamps, keyframes=self.keyframes)
+
+    @classmethod
+    def load(cls, path, signature):
+        """Load a saved index, or return None if it is missing, stale or damaged"""
+        try:
+            with np.load(path) as data:
+                if int(data["version"]) != INDEX_VERSION:
+                    return None
+                if tuple(data["signature"]) != tuple(signature):
+                    return None
+                return cls(data["timestamps"], data["keyframes"])
+        except Exception:
+            # Not only OSError: a truncated file raises zipfile.BadZipFile or
+            # EOFError, and is rebuilt like a missing one
+            return None
+
+
+def build_index(video_path, progress_callback=None, cancel_event=None):
+    """Scan the packets of a video and return its FrameIndex
+
+    Packets arrive in decode order, so their timestamps are sorted to get
+    the presentation order. `progress_callback` receives percent done.
+    """
+    cap = cv2.VideoCapture(str(video_path), cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])
+    if not cap.isOpened():
+        cap.release()
+        raise IOError(f"Could not open video: {video_path}")
+
+    try:
+        expected = max(1, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+        packet_times = []
+        key_times = []
+        while cap.grab():
+            if cancel_event is not None and cancel_event.is_set():
+                raise IndexCancelled()
+            packet_time = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+            packet_times.append(packet_time)
+            if cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+                key_times.append(packet_time)
+            if progress_callback and len(packet_times) % 200 == 0:
+                progress_callback(min(99.0, len(packet_times) / expected * 100))
+    finally:
+        cap.release()
+
+    timestamps = np.sort(np.asarray(packet_times, dtype=np.float64))
+    keyframes = np.searchsorted(timestamps, np.sort(np.asarray(key_times, dtype=np.float64)))
+    if not len(keyframes) or keyframes[0] != 0:
+        keyframes = np.concatenate([[0], keyframes])
+    if progress_callback:
+        progress_callback(100.0)
+    return FrameIndex(timestamps, keyframes)
+
+
+def sidecar_path(video_path):
+    return Path(str(video_path) + SIDECAR_SUFFIX)
+
+
+def cached_index_path(video_path):
+    """Fallback location for indexes of videos in read-only folders"""
+    return storage.cache_dir("index") / (storage.path_key(video_path) + ".npz")
+
+
+def load_artifact(store, video_path):
+    """Return the index of a video from an ArtifactStore, or None if it has none"""
+    arrays = store.load("index", [artifacts.content_key(video_path)])
+    if arrays is None or int(arrays.get("version", -1)) != INDEX_VERSION:
+        return None
+    return FrameIndex(arrays["timestamps"], arrays["keyframes"])
+
+
+def save_artifact(store, video_path, index):
+    store.save("index", [artifacts.content_key(video_path)], version=INDEX_VERSION,
+               timestamps=index.timestamps, keyframes=index.keyframes)
+
+
+def load_or_build_index(video_path, progress_callback=None, cancel_event=None, store=None):
+    """Return the saved index of a video, building and saving it if needed
+
+    `store` is an optional ArtifactStore checked first and kept up to date.
+    """
+    if store is not None:
+        index = load_artifact(store, video_path)
+        if index is not None:
+            return index
+
+    signature = storage.file_signature(video_path)
+    for path in (sidecar_path(video_path), cached_index_path(video_path)):
+        index = FrameIndex.load(path, signature)
+        if index is not None:
+            break
+    else:
+        index = build_index(video_path, progress_callback, cancel_event)
+        for path in (sidecar_path(video_path), cached_index_path(video_path)):
+            try:
+                index.save(path, signature)
+                break
+            except OSError:
+                continue
+    if store is not None:
+        save_artifact(store, video_path, index)
+    return index
+
+
+class IndexBuilder:
+    """Build or load a video's index on a background thread
+
+    `on_progress(percent)` and `on_done(index_or_None, error_or_None)` are
+    called from the worker thread.
+    """
+
+    def __init__(self, video_path, on_done, on_progress=None, store=None):
+        self.video_path = video_path
+        self.store = store
+        self._cancel_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(on_done, on_progress),
+                                        daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def _run(self, on_done, on_progress):
+        try:
+            index = load_or_build_index(self.video_path, on_progress, self._cancel_event,
+                                        self.store)
+        except IndexCancelled:
+            return
+        except Exception as e:
+            on_done(None, e)
+            return
+        on_done(index, None)
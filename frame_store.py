@@ -0,0 +1,188 @@
+"""
+Memory-mapped store of decoded preview frames for analysis mode
+
+Stepping back and forth around a cone costs a keyframe seek and a run of
+decodes per step, and backward steps are the worst case. Runs are short,
+so analysis mode decodes the chosen range of a video once, at preview
+size, into a temporary file with one fixed-size RGB slot per frame. A
+frame in the range is then a numpy view of the mapped file: no decoder,
+no copy, the same cost in either direction.
+
+The file lives in the cache directory and is deleted when the store is
+closed. Stores left behind by a crashed session are removed the next time
+one is created.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+import storage
+from export_engine import SequentialReader, _open_capture
+
+
+# Disk space all stores of a session may take together
+ANALYSIS_BUDGET_MB = 4096
+
+# Space to leave free on the disk holding the stores
+FREE_SPACE_MARGIN_MB = 512
+
+# Store files untouched for this long belong to no running session
+STALE_STORE_SECONDS = 24 * 3600
+
+STORE_SUFFIX = ".frames"
+
+
+class FrameStoreCancelled(Exception):
+    """Raised when filling a frame store is cancelled"""
+
+
+def store_bytes(frame_count, size):
+    """Return the bytes a store of `frame_count` RGB frames of (width, height) takes"""
+    width, height = size
+    return frame_count * width * height * 3
+
+
+def check_budget(total_bytes, budget_mb=ANALYSIS_BUDGET_MB, directory=None):
+    """Raise ValueError if stores of `total_bytes` exceed the budget or the free disk space"""
+    directory = directory or storage.cache_dir("analysis")
+    if total_bytes > budget_mb * 1024 * 1024:
+        raise ValueError(f"The range needs {total_bytes / 2 ** 20:.0f} MB of decoded frames, "
+                         f"more than the {budget_mb} MB analysis budget; choose a shorter range")
+    free = shutil.disk_usage(directory).free - FREE_SPACE_MARGIN_MB * 1024 * 1024
+    if total_bytes > free:
+        raise ValueError(f"Not enough free disk space for {total_bytes / 2 ** 20:.0f} MB "
+                         f"of decoded frames in {directory}")
+
+
+def remove_stale_stores(directory=None):
+    """Delete store files left behind by sessions that did not close them"""
+    directory = directory or storage.cache_dir("analysis")
+    oldest_kept = time.time() - STALE_STORE_SECONDS
+    for path in directory.glob("*" + STORE_SUFFIX):
+        try:
+            if path.stat().st_mtime < oldest_kept:
+                path.unlink()
+        except OSError:
+            continue
+
+
+class FrameStore:
+    """Preview frames `first_frame` .. `first_frame + frame_count - 1` of a video in a mapped file
+
+    Thread-safe. Frames are available as soon as they are put, so the
+    store is usable while it is being filled.
+    """
+
+    def __init__(self, first_frame, frame_count, size, directory=None):
+        directory = directory or storage.cache_dir("analysis")
+        self.first_frame = first_frame
+        self.frame_count = frame_count
+        self.size = tuple(size)
+        width, height = self.size
+        handle, path = tempfile.mkstemp(suffix=STORE_SUFFIX, dir=directory)
+        os.close(handle)
+        self.path = path
+        self.frames = np.memmap(path, dtype=np.uint8, mode="w+",
+                                shape=(frame_count, height, width, 3))
+        self.filled = np.zeros(frame_count, dtype=bool)
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        return store_bytes(self.frame_count, self.size)
+
+    @property
+    def last_frame(self):
+        return self.first_frame + self.frame_count - 1
+
+    def __contains__(self, frame_num):
+        slot = frame_num - self.first_frame
+        with self._lock:
+            return self.frames is not None and 0 <= slot < self.frame_count and self.filled[slot]
+
+    def get(self, frame_num):
+        """Return a read-only view of a frame, or None if it is not in the store (yet)"""
+        slot = frame_num - self.first_frame
+        with self._lock:
+            if self.frames is None or not (0 <= slot < self.frame_count) or not self.filled[slot]:
+                return None
+            frame = self.frames[slot]
+        frame.flags.writeable = False
+        return frame
+
+    def put(self, frame_num, frame):
+        """Copy a preview frame into its slot; frames outside the range are ignored"""
+        slot = frame_num - self.first_frame
+        with self._lock:
+            if self.frames is None or not (0 <= slot < self.frame_count):
+                return
+            self.frames[slot] = frame
+            self.filled[slot] = True
+
+    def close(self):
+        """Unmap the frames and delete the file"""
+        with self._lock:
+            if self.frames is None:
+                return
+            # Views handed out keep the mapping alive until they are dropped;
+            # where an open mapping blocks deleting, remove_stale_stores does
+            self.frames = None
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+class FrameStoreBuilder:
+    """Decode the range of a FrameStore from a video on a background thread
+
+    Frames are decoded in order, each once, and turned into preview frames
+    by `prepare(frame)`. `on_progress(percent)` and `on_done(store_or_None,
+    error_or_None)` are called from the worker thread.
+    """
+
+    def __init__(self, video_path, on_done, on_progress=None, store=None, index=None,
+                 prepare=None):
+        self.video_path = video_path
+        self.store = store
+        self.index = index
+        self.prepare = prepare
+        self._cancel_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(on_done, on_progress),
+                                        daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def _run(self, on_done, on_progress):
+        try:
+            self._fill(on_progress)
+        except FrameStoreCancelled:
+            return
+        except Exception as e:
+            on_done(None, e)
+            return
+        on_done(self.store, None)
+
+    def _fill(self, on_progress):
+        store = self.store
+        cap = _open_capture(self.video_path)
+        try:
+            reader = SequentialReader(cap, self.index)
+            for n, frame_num in enumerate(range(store.first_frame, store.last_frame + 1)):
+                if self._cancel_event.is_set():
+                    raise FrameStoreCancelled()
+                frame = reader.read(frame_num)
+                if frame is None:
+                    break
+                store.put(frame_num, self.prepare(frame))
+                if on_progress and n % 30 == 0:
+                    on_progress(100.0 * n / store.frame_count)
+        finally:
+            cap.release()
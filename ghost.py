@@ -0,0 +1,210 @@
+"""
+Static background of a shadow video for the "ghost rider" composite
+
+A plain blend dims the whole main video, including the static course. With
+the camera on a tripod the course looks the same in every frame, so the
+per-pixel median of frames sampled across the run is the empty course. The
+ghost composite (BlendEngine.ghost_composite) overlays only the pixels of
+the shadow video that differ from that background, i.e. the rider.
+
+The background is computed once per video on a background thread and saved
+to the cache directory, keyed by file size and mtime (and to an
+ArtifactStore by content, if one is given), so compositing a frame never
+has to look at more than the frame and the saved background.
+"""
+
+import threading
+
+import cv2
+import numpy as np
+
+import artifacts
+import storage
+
+
+BACKGROUND_VERSION = 1
+
+# Frames sampled evenly across the video; odd, so the median is a sample
+BACKGROUND_SAMPLES = 25
+
+# Backgrounds are estimated and saved at most this wide
+BACKGROUND_WIDTH = 1280
+
+# The rider is found at most this wide; the mask is scaled up to the frame
+MASK_WIDTH = 640
+
+# Rows of the sample stack per median call, to bound its temporary memory
+MEDIAN_ROWS = 64
+
+
+class BackgroundCancelled(Exception):
+    """Raised when a background computation is cancelled"""
+
+
+class BackgroundModel:
+    """Median background of a video as a BGR image
+
+    image_for() scales it to the size and channel order of the frames it is
+    compared with; scaled copies are kept, so playback reuses them.
+    """
+
+    def __init__(self, image):
+        self.image = image
+        self._scaled = {}
+
+    def image_for(self, size, rgb=False):
+        """Return the background resized to (width, height), in RGB if asked"""
+        key = (tuple(size), rgb)
+        image = self._scaled.get(key)
+        if image is None:
+            image = self.image
+            if (image.shape[1], image.shape[0]) != key[0]:
+                image = cv2.resize(image, key[0], interpolation=cv2.INTER_LINEAR)
+            if rgb:
+                image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            self._scaled[key] = image
+        return image
+
+    def mask_background(self, width, height, rgb=False):
+        """Return the background to find the rider in frames of (width, height) with"""
+        if width > MASK_WIDTH:
+            width, height = MASK_WIDTH, max(1, round(height * MASK_WIDTH / width))
+        return self.image_for((width, height), rgb)
+
+    def save(self, path, signature):
+        storage.save_arrays(path, compressed=True, version=BACKGROUND_VERSION,
+                            signature=np.asarray(signature, dtype=np.int64), image=self.image)
+
+    @classmethod
+    def load(cls, path, signature):
+        """Load a saved background, or return None if it is missing, stale or damaged"""
+        try:
+            with np.load(path) as data:
+                if int(data["version"]) != BACKGROUND_VERSION:
+                    return None
+                if tuple(data["signature"]) != tuple(signature):
+                    return None
+                return cls(data["image"])
+        except Exception:
+            # Not only OSError: a truncated file raises zipfile.BadZipFile or
+            # EOFError, and is recomputed like a missing one
+            return None
+
+
+def compute_background(video_path, samples=BACKGROUND_SAMPLES, progress_callback=None,
+                       cancel_event=None):
+    """Return the BackgroundModel of a video from the median of sampled frames
+
+    `progress_callback` receives percent done.
+    """
+    cap = cv2.VideoCapture(str(video_path))
+    if not cap.isOpened():
+        cap.release()
+        raise IOError(f"Could not open video: {video_path}")
+
+    try:
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        if width > BACKGROUND_WIDTH:
+            width, height = BACKGROUND_WIDTH, max(1, round(height * BACKGROUND_WIDTH / width))
+
+        frame_nums = np.unique(np.linspace(0, max(0, total - 1), samples).astype(int))
+        frames = []
+        for i, frame_num in enumerate(frame_nums):
+            if cancel_event is not None and cancel_event.is_set():
+                raise BackgroundCancelled()
+            # Exact timing does not matter here, so a plain seek will do
+            cap.set(cv2.CAP_PROP_POS_FRAMES, int(frame_num))
+            ret, frame = cap.read()
+            if ret:
+                if frame.shape[:2] != (height, width):
+                    frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+                frames.append(frame)
+            if progress_callback:
+                progress_callback(min(99.0, (i + 1) / len(frame_nums) * 100))
+    finally:
+        cap.release()
+
+    if len(frames) < 3:
+        raise ValueError(f"Too few frames to estimate the background of {video_path}")
+    stack = np.stack(frames)
+    image = np.empty(stack.shape[1:], np.uint8)
+    for top in range(0, height, MEDIAN_ROWS):
+        image[top:top + MEDIAN_ROWS] = np.median(stack[:, top:top + MEDIAN_ROWS], axis=0)
+    if progress_callback:
+        progress_callback(100.0)
+    return BackgroundModel(image)
+
+
+def cached_background_path(video_path):
+    return storage.cache_dir("background") / (storage.path_key(video_path) + ".npz")
+
+
+def load_artifact(store, video_path):
+    """Return the background of a video from an ArtifactStore, or None if it has none"""
+    arrays = store.load("background", [artifacts.content_key(video_path)])
+    if arrays is None or int(arrays.get("version", -1)) != BACKGROUND_VERSION:
+        return None
+    return BackgroundModel(arrays["image"])
+
+
+def save_artifact(store, video_path, background):
+    store.save("background", [artifacts.content_key(video_path)],
+               version=BACKGROUND_VERSION, image=background.image)
+
+
+def load_or_compute_background(video_path, progress_callback=None, cancel_event=None,
+                               store=None):
+    """Return the saved background of a video, computing and saving it if needed
+
+    `store` is an optional ArtifactStore checked first and kept up to date.
+    """
+    if store is not None:
+        background = load_artifact(store, video_path)
+        if background is not None:
+            return background
+
+    signature = storage.file_signature(video_path)
+    path = cached_background_path(video_path)
+    background = BackgroundModel.load(path, signature)
+    if background is None:
+        background = compute_background(video_path, progress_callback=progress_callback,
+                                        cancel_event=cancel_event)
+        try:
+            background.save(path, signature)
+        except OSError:
+            pass
+    if store is not None:
+        save_artifact(store, video_path, background)
+    return background
+
+
+class BackgroundBuilder:
+    """Compute or load a video's background on a background thread
+
+    `on_progress(percent)` and `on_done(background_or_None, error_or_None)`
+    are called from the worker thread.
+    """
+
+    def __init__(self, video_path, on_done, on_progress=None, store=None):
+        self.video_path = video_path
+        self.store = store
+        self._cancel_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(on_done, on_progress),
+                                        daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def _run(self, on_done, on_progress):
+        try:
+            background = load_or_compute_background(self.video_path, on_progress,
+                                                    self._cancel_event, self.store)
+        except BackgroundCancelled:
+            return
+        except Exception as e:
+            on_done(None, e)
+            return
+        on_done(background, None)
@@ -0,0 +1,131 @@
+"""
+Playback timing and background frame rendering
+
+PlaybackClock decides which frame should be on screen from the monotonic
+wall clock, so slow frames are skipped instead of slowing playback down.
+RenderWorker decodes and blends preview frames on its own thread and hands
+finished frames back through a callback, so the Tk event loop never waits
+for the decoder.
+"""
+
+import threading
+import time
+from collections import deque
+
+
+class PlaybackClock:
+    """Map elapsed wall-clock time to the frame that should be shown
+
+    `timing` provides time_of(frame) and frame_at(time), e.g. a
+    ConstantFrameRate or FrameIndex. A negative speed plays backwards.
+    Tracks achieved fps and dropped frames.
+    """
+
+    def __init__(self, timing, speed=1.0):
+        self.timing = timing
+        self.speed = speed
+        self._start_wall = None
+        self._start_media = 0.0
+        self._last_shown = None
+        self._shown_times = deque(maxlen=120)
+        self.shown = 0
+        self.dropped = 0
+
+    def start(self, frame_num, speed=None, timing=None):
+        """Start (or restart) the clock with `frame_num` on screen now"""
+        if speed is not None:
+            self.speed = speed
+        if timing is not None:
+            self.timing = timing
+        self._start_wall = time.monotonic()
+        self._start_media = self.timing.time_of(frame_num)
+        self._last_shown = frame_num
+
+    def reset_stats(self):
+        self._shown_times.clear()
+        self.shown = 0
+        self.dropped = 0
+
+    def set_speed(self, speed):
+        """Change speed without jumping: rebase on the current media time"""
+        if self._start_wall is not None:
+            self._start_media = self.media_time()
+            self._start_wall = time.monotonic()
+        self.speed = speed
+
+    def media_time(self, now=None):
+        """Return the video time that should be on screen now"""
+        now = time.monotonic() if now is None else now
+        return self._start_media + (now - self._start_wall) * self.speed
+
+    def target_frame(self, now=None):
+        """Return the frame that should be on screen now (may be past the end)"""
+        return self.timing.frame_at(self.media_time(now))
+
+    def frame_shown(self, frame_num):
+        """Record that `frame_num` reached the screen, counting skipped frames"""
+        if self._last_shown is not None:
+            step = frame_num - self._last_shown if self.speed >= 0 else self._last_shown - frame_num
+            if step > 1:
+                self.dropped += step - 1
+        self._last_shown = frame_num
+        self.shown += 1
+        self._shown_times.append(time.monotonic())
+
+    @property
+    def achieved_fps(self):
+        """Frames shown per second over the last couple of seconds"""
+        if len(self._shown_times) < 2:
+            return 0.0
+        elapsed = self._shown_times[-1] - self._shown_times[0]
+        return (len(self._shown_times) - 1) / elapsed if elapsed > 0 else 0.0
+
+
+class RenderWorker:
+    """Render preview frames on a background thread, newest request first
+
+    Only the most recent request is kept: if the playhead moves on while a
+    frame is being decoded, the frames in between are never rendered.
+    `render(frame_num)` runs on the worker thread and
+    `on_rendered(frame_num, result)` is called from it with the result.
+    """
+
+    def __init__(self, render, on_rendered):
+        self.render = render
+        self.on_rendered = on_rendered
+        self._request = None
+        self._has_request = False
+        self._stopped = False
+        self._wakeup = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def request(self, frame_num):
+        """Ask for `frame_num`, replacing any request not yet started"""
+        with self._wakeup:
+            self._request = frame_num
+            self._has_request = True
+            self._wakeup.notify()
+
+    def stop(self):
+        with self._wakeup:
+            self._stopped = True
+            self._wakeup.notify()
+        self._thread.join(timeout=1.0)
+
+    def _run(self):
+        while True:
+            with self._wakeup:
+                while not self._has_request and not self._stopped:
+                    self._wakeup.wait()
+                if self._stopped:
+                    return
+                frame_num = self._request
+                self._has_request = False
+
+            try:
+                result = self.render(frame_num)
+            except Exception as e:
+                print(f"Render error: {e}")
+                result = None
+            self.on_rendered(frame_num, result)
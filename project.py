@@ -0,0 +1,194 @@
+"""
+Project files: the videos and settings of one comparison
+
+A project is a small JSON file holding the video paths, the sync offset,
+the shadow opacity and layers, the ghost, camera alignment, time warp,
+rider path and split sync switches, the rider selections tracked, the split
+markers, and the export ranges. Video paths are stored relative to the
+project file when they are below its folder, so a project folder can be
+moved as a whole.
+
+Next to the project file, in "<name>_cache", an ArtifactStore keeps the
+analysis results of its videos (frame indexes, backgrounds, time warps,
+registered transforms, rider trajectories). They are keyed by content, so reopening the
+project finds them without recomputing anything.
+"""
+
+import json
+import os
+from pathlib import Path
+
+from artifacts import ArtifactStore
+
+
+PROJECT_VERSION = 1
+PROJECT_SUFFIX = ".gymproj"
+
+
+class Project:
+    """The saved state of a comparison; paths are absolute once loaded"""
+
+    def __init__(self, video1=None, video2=None, sync_offset=0.0, shadow_opacity=0.5,
+                 layers=(), ghost=False, register=False, time_warp=False,
+                 export_ranges=(), show_paths=False, tracks=None, markers=None,
+                 split_sync=False):
+        self.path = None
+        self.video1 = video1
+        self.video2 = video2
+        self.sync_offset = sync_offset
+        self.shadow_opacity = shadow_opacity
+        # {"video", "offset", "opacity"} per extra shadow layer, as in a CLI manifest
+        self.layers = [dict(layer) for layer in layers]
+        self.ghost = ghost
+        self.register = register
+        self.time_warp = time_warp
+        self.show_paths = show_paths
+        # {"box": [x0, y0, x1, y1], "frame": start frame} of the rider tracked
+        # in each video, keyed "video1" and "video2"
+        self.tracks = {name: dict(track) for name, track in (tracks or {}).items()}
+        # {marker name: frame number} of the split markers (splits.py) of each
+        # video, keyed "video1" and "video2"; split_sync syncs the shadow to them
+        self.markers = {name: {marker: int(frame) for marker, frame in video_markers.items()}
+                        for name, video_markers in (markers or {}).items()}
+        self.split_sync = split_sync
+        # (start, end) in seconds of main video time
+        self.export_ranges = [(float(start), float(end)) for start, end in export_ranges]
+
+    @classmethod
+    def from_session(cls, session, export_ranges=()):
+        """Return a project holding the videos and settings of a ShadowSession"""
+        tracks = {}
+        markers = {}
+        for name, video in (("video1", session.video1), ("video2", session.video2)):
+            if video is not None and video.trajectory is not None:
+                tracks[name] = {"box": list(video.trajectory.box),
+                                "frame": video.trajectory.start_frame}
+            if video is not None and video.markers:
+                markers[name] = dict(video.markers)
+        return cls(video1=session.video1.path if session.video1 else None,
+                   video2=session.video2.path if session.video2 else None,
+                   sync_offset=session.sync_offset, shadow_opacity=session.shadow_opacity,
+                   layers=[{"video": track.source.path, "offset": track.sync_offset,
+                            "opacity": track.opacity} for track in session.layers],
+                   ghost=session.ghost, register=session.register,
+                   time_warp=session.time_warp is not None and not session.split_sync,
+                   export_ranges=export_ranges, show_paths=session.show_paths, tracks=tracks,
+                   markers=markers, split_sync=session.split_sync)
+
+    @property
+    def artifact_dir(self):
+        """Folder of the project's analysis results, or None until it is saved"""
+        if self.path is None:
+            return None
+        return self.path.with_name(self.path.stem + "_cache")
+
+    def artifact_store(self):
+        """Return the ArtifactStore next to the project file"""
+        if self.path is None:
+            raise ValueError("The project has not been saved yet")
+        return ArtifactStore(self.artifact_dir)
+
+    def save(self, path):
+        """Write the project to `path` and remember it as the project's location"""
+        path = Path(path).resolve()
+        data = {
+            "version": PROJECT_VERSION,
+            "video1": _relative(self.video1, path.parent),
+            "video2": _relative(self.video2, path.parent),
+            "sync_offset": self.sync_offset,
+            "shadow_opacity": self.shadow_opacity,
+            "layers": [dict(layer, video=_relative(layer["video"], path.parent))
+                       for layer in self.layers],
+            "ghost": self.ghost,
+            "register": self.register,
+            "time_warp": self.time_warp,
+            "show_paths": self.show_paths,
+            "tracks": self.tracks,
+            "markers": self.markers,
+            "split_sync": self.split_sync,
+            "export_ranges": [list(export_range) for export_range in self.export_ranges],
+        }
+        # Write a temporary file first so a failed save keeps the old project
+        temp_path = path.with_name(path.name + ".part")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(temp_path, path)
+        self.path = path
+
+    @classmethod
+    def load(cls, path):
+        """Read a project file; raises ValueError if it is not a usable project"""
+        path = Path(path).resolve()
+        with open(path, encoding="utf-8") as f:
+            try:
+                data = json.load(f)
+            except ValueError as e:
+                raise ValueError(f"Not a project file: {path} ({e})")
+        if not isinstance(data, dict) or data.get("version") != PROJECT_VERSION:
+            raise ValueError(f"Unsupported project file: {path}")
+
+        layers = []
+        for layer in data.get("layers", []):
+            if "video" not in layer:
+                raise ValueError(f"Project layer is missing 'video': {layer}")
+            layers.append(dict(layer, video=_absolute(layer["video"], path.parent)))
+        project = cls(video1=_absolute(data.get("video1"), path.parent),
+                      video2=_absolute(data.get("video2"), path.parent),
+                      sync_offset=float(data.get("sync_offset", 0.0)),
+                      shadow_opacity=float(data.get("shadow_opacity", 0.5)),
+                      layers=layers, ghost=bool(data.get("ghost")),
+                      register=bool(data.get("register")),
+                      time_warp=bool(data.get("time_warp")),
+                      export_ranges=data.get("export_ranges", []),
+                      show_paths=bool(data.get("show_paths")),
+                      tracks=data.get("tracks", {}),
+                      markers=data.get("markers", {}),
+                      split_sync=bool(data.get("split_sync")))
+        project.path = path
+        return project
+
+    def runs(self, output):
+        """Return a CLI manifest run per export range, writing to `output`
+
+        With several ranges the outputs are numbered, e.g. run_1.mp4.
+        """
+        if not (self.video1 and self.video2):
+            raise ValueError("The project needs both videos to export")
+        output = Path(output)
+        ranges = self.export_ranges or [(0.0, None)]
+        runs = []
+        for number, (start, end) in enumerate(ranges, 1):
+            if len(ranges) > 1:
+                run_output = output.with_name(f"{output.stem}_{number}{output.suffix}")
+            else:
+                run_output = output
+            runs.append({"video1": self.video1, "video2": self.video2,
+                         "output": str(run_output), "offset": self.sync_offset,
+                         "opacity": self.shadow_opacity,
+                         "layers": [dict(layer) for layer in self.layers],
+                         "ghost": self.ghost, "register": self.register,
+                         "time_warp": self.time_warp, "start": start, "end": end})
+            if self.show_paths:
+                runs[-1]["tracks"] = {name: dict(track) for name, track in self.tracks.items()}
+            if self.split_sync:
+                runs[-1]["markers"] = {name: dict(video_markers)
+                                       for name, video_markers in self.markers.items()}
+                runs[-1]["split_sync"] = True
+        return runs
+
+
+def _relative(video_path, folder):
+    """Return a video path relative to `folder` if it is inside it, else absolute"""
+    if video_path is None:
+        return None
+    video_path = Path(video_path).resolve()
+    try:
+        return video_path.relative_to(folder).as_posix()
+    except ValueError:
+        return str(video_path)
+
+
+def _absolute(video_path, folder):
+    if video_path is None:
+        return None
+    return str((folder / video_path).resolve())
@@ -0,0 +1,166 @@
+"""
+Low-resolution preview proxies
+
+Decoding 4K/60 HEVC cannot keep up with real-time preview. A proxy is a
+preview-resolution copy of a source video encoded as Motion JPEG, where
+every frame is a keyframe, so seeking and stepping never decode more than
+one small frame. Playback and scrubbing read the proxy; export keeps
+reading the original.
+
+Proxies contain exactly one frame per decoded source frame, so frame
+numbers are shared with the original. They are stored in the cache
+directory, keyed by the source path, size and mtime, reused across
+sessions and evicted least recently used first once the store grows past
+its size limit.
+"""
+
+import os
+import threading
+import time
+
+import cv2
+
+import storage
+
+
+PROXY_WIDTH = 640
+PROXY_CACHE_MB = 4096
+
+
+class ProxyCancelled(Exception):
+    """Raised when a proxy transcode is cancelled"""
+
+
+def proxy_size(width, height, proxy_width=PROXY_WIDTH):
+    """Return the (width, height) of a proxy, keeping the aspect ratio"""
+    if width <= proxy_width:
+        return width, height
+    proxy_height = int(round(height * proxy_width / width / 2)) * 2
+    return proxy_width, max(2, proxy_height)
+
+
+def transcode_proxy(video_path, proxy_path, progress_callback=None, cancel_event=None):
+    """Write a Motion JPEG proxy of `video_path` to `proxy_path`
+
+    Writes to a temporary file first, so an interrupted transcode never
+    leaves a truncated proxy behind. Returns the number of frames written.
+    """
+    cap = cv2.VideoCapture(str(video_path))
+    if not cap.isOpened():
+        cap.release()
+        raise IOError(f"Could not open video: {video_path}")
+
+    temp_path = str(proxy_path) + ".part.avi"
+    out = None
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        expected = max(1, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+        size = proxy_size(int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                          int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        out = cv2.VideoWriter(temp_path, cv2.VideoWriter_fourcc(*'MJPG'), fps, size)
+        if not out.isOpened():
+            raise IOError(f"Could not create proxy: {proxy_path}")
+
+        written = 0
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                raise ProxyCancelled()
+            ret, frame = cap.read()
+            if not ret:
+                break
+            out.write(cv2.resize(frame, size, interpolation=cv2.INTER_AREA))
+            written += 1
+            if progress_callback and written % 30 == 0:
+                progress_callback(min(99.0, written / expected * 100))
+
+        out.release()
+        out = None
+        os.replace(temp_path, proxy_path)
+        if progress_callback:
+            progress_callback(100.0)
+        return written
+
+    finally:
+        cap.release()
+        if out is not None:
+            out.release()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+class ProxyStore:
+    """Directory of proxies with a total size limit"""
+
+    def __init__(self, directory=None, max_mb=PROXY_CACHE_MB):
+        self.directory = directory or storage.cache_dir("proxies")
+        self.max_bytes = int(max_mb * 1024 * 1024)
+
+    def proxy_path(self, video_path):
+        """Return where the proxy for the current contents of a video lives"""
+        size, mtime_ns = storage.file_signature(video_path)
+        name = f"{storage.path_key(video_path)}_{size}_{mtime_ns}.avi"
+        return self.directory / name
+
+    def get(self, video_path):
+        """Return the path of an existing proxy, or None"""
+        path = self.proxy_path(video_path)
+        if not path.exists():
+            return None
+        # Mark as recently used for eviction
+        now = time.time()
+        os.utime(path, (now, now))
+        return path
+
+    def create(self, video_path, progress_callback=None, cancel_event=None):
+        """Transcode a proxy for `video_path`, then evict old ones over the limit"""
+        path = self.proxy_path(video_path)
+        transcode_proxy(video_path, path, progress_callback, cancel_event)
+        self.evict(keep=path)
+        return path
+
+    def get_or_create(self, video_path, progress_callback=None, cancel_event=None):
+        return self.get(video_path) or self.create(video_path, progress_callback, cancel_event)
+
+    def evict(self, keep=None):
+        """Delete least recently used proxies until the store fits its limit"""
+        proxies = sorted(self.directory.glob("*.avi"), key=lambda p: p.stat().st_mtime)
+        total = sum(p.stat().st_size for p in proxies)
+        for path in proxies:
+            if total <= self.max_bytes:
+                break
+            if keep is not None and path == keep:
+                continue
+            total -= path.stat().st_size
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+
+class ProxyBuilder:
+    """Find or transcode a video's proxy on a background thread
+
+    `on_progress(percent)` and `on_done(path_or_None, error_or_None)` are
+    called from the worker thread.
+    """
+
+    def __init__(self, video_path, on_done, on_progress=None, store=None):
+        self.video_path = video_path
+        self.store = store or ProxyStore()
+        self._cancel_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(on_done, on_progress),
+                                        daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def _run(self, on_done, on_progress):
+        try:
+            path = self.store.get_or_create(self.video_path, on_progress, self._cancel_event)
+        except ProxyCancelled:
+            return
+        except Exception as e:
+            on_done(None, e)
+            return
+        on_done(path, None)
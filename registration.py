@@ -0,0 +1,195 @@
+"""
+Camera motion compensation between a shadow video and the main video
+
+When the runs are filmed from slightly different spots, or handheld, the
+course in the shadow video does not sit on top of the course in the main
+video. FrameRegistration finds the similarity transform (shift, rotation,
+scale) that maps a shadow frame onto the main frame it is shown with:
+
+- the first time, or after a jump, ORB features are matched between the
+  two frames and a transform fitted with RANSAC, so the moving riders do
+  not count;
+- for the next frames the matched points are followed in both videos with
+  Lucas-Kanade optical flow, which is several times cheaper, until too
+  few of them survive, or for at most REMATCH_INTERVAL frames so that
+  tracking errors cannot add up.
+
+Transforms are cached per (main frame, shadow frame) pair in coordinates
+relative to the frame size, so scrubbing back over a registered section
+costs nothing and the preview's transforms are reused by the export. The
+cache can be kept in an ArtifactStore (artifacts.py), keyed by the contents
+of both videos; frame numbers are only stable once both videos are indexed.
+"""
+
+import threading
+
+import cv2
+import numpy as np
+
+import artifacts
+
+
+REGISTRATION_VERSION = 1
+
+
+# Frames are registered at most this wide
+REGISTER_WIDTH = 640
+
+ORB_FEATURES = 1000
+
+# Matches (or tracked points) a transform must be fitted from
+MIN_MATCHES = 15
+
+# RANSAC inlier distance in pixels at REGISTER_WIDTH
+RANSAC_THRESHOLD = 3.0
+
+# Frames either video may move on from the last registered pair and still be tracked
+MAX_TRACK_GAP = 3
+
+# Tracked transforms in a row before the features are matched afresh
+REMATCH_INTERVAL = 90
+
+
+class FrameRegistration:
+    """Cached transforms lining up one shadow video with the main video
+
+    Thread-safe; pickling keeps only the cached transforms, so worker
+    processes start with everything registered so far.
+    """
+
+    def __init__(self):
+        self.cache = {}  # (frame1, frame2) -> 3x3 matrix, or None if no match
+        self.matched = 0
+        self.tracked = 0
+        self._last = None
+        self._tracked_in_row = 0
+        self._orb = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        with self._lock:
+            return {"cache": dict(self.cache)}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.cache.update(state["cache"])
+
+    def transform(self, frame1_num, frame2_num, frame1, frame2):
+        """Return the 3x3 matrix mapping shadow to main frame coordinates, or None
+
+        Coordinates are relative to the frame size (0..1 on both axes), so
+        the matrix fits any resolution (see BlendEngine.warp_to). `frame1`
+        and `frame2` must have the same channel order.
+        """
+        key = (frame1_num, frame2_num)
+        with self._lock:
+            if key in self.cache:
+                return self.cache[key]
+            gray1 = _register_gray(frame1)
+            gray2 = _register_gray(frame2)
+            result = None
+            last = self._last
+            if (last is not None and self._tracked_in_row < REMATCH_INTERVAL
+                    and abs(frame1_num - last[0]) <= MAX_TRACK_GAP
+                    and abs(frame2_num - last[1]) <= MAX_TRACK_GAP
+                    and last[2].shape == gray1.shape and last[3].shape == gray2.shape):
+                result = self._track(last, gray1, gray2)
+                if result is not None:
+                    self.tracked += 1
+                    self._tracked_in_row += 1
+            if result is None:
+                result = self._match(gray1, gray2)
+                if result is not None:
+                    self.matched += 1
+                    self._tracked_in_row = 0
+
+            if result is None:
+                self._last = None
+                matrix = None
+            else:
+                matrix, points1, points2 = result
+                self._last = (frame1_num, frame2_num, gray1, gray2, points1, points2)
+                matrix = _normalize(matrix, gray1.shape, gray2.shape)
+            self.cache[key] = matrix
+            return matrix
+
+    def _match(self, gray1, gray2):
+        """Fit a transform from ORB feature matches between the two frames"""
+        if self._orb is None:
+            self._orb = cv2.ORB_create(ORB_FEATURES)
+        keypoints1, descriptors1 = self._orb.detectAndCompute(gray1, None)
+        keypoints2, descriptors2 = self._orb.detectAndCompute(gray2, None)
+        if descriptors1 is None or descriptors2 is None:
+            return None
+        matches = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True).match(descriptors1,
+                                                                        descriptors2)
+        if len(matches) < MIN_MATCHES:
+            return None
+        points1 = np.float32([keypoints1[m.queryIdx].pt for m in matches])
+        points2 = np.float32([keypoints2[m.trainIdx].pt for m in matches])
+        return _fit(points1, points2)
+
+    def _track(self, last, gray1, gray2):
+        """Follow the last pair's inlier points in both videos and refit the transform"""
+        _, _, previous1, previous2, points1, points2 = last
+        moved1, status1, _ = cv2.calcOpticalFlowPyrLK(previous1, gray1, points1, None)
+        moved2, status2, _ = cv2.calcOpticalFlowPyrLK(previous2, gray2, points2, None)
+        found = (status1.ravel() == 1) & (status2.ravel() == 1)
+        if found.sum() < MIN_MATCHES:
+            return None
+        return _fit(moved1[found], moved2[found])
+
+
+def load_artifact(store, video1_path, video2_path):
+    """Return a FrameRegistration holding the saved transforms of a pair, or None"""
+    arrays = store.load("registration", [artifacts.content_key(video1_path),
+                                         artifacts.content_key(video2_path)])
+    if arrays is None or int(arrays.get("version", -1)) != REGISTRATION_VERSION:
+        return None
+    registration = FrameRegistration()
+    # NaN matrices are pairs that could not be registered
+    for (frame1_num, frame2_num), matrix in zip(arrays["frames"].tolist(), arrays["matrices"]):
+        registration.cache[(frame1_num, frame2_num)] = (None if np.isnan(matrix[0, 0])
+                                                        else matrix)
+    return registration
+
+
+def save_artifact(store, video1_path, video2_path, registration):
+    with registration._lock:
+        cache = dict(registration.cache)
+    frames = np.array(list(cache), dtype=np.int64).reshape(-1, 2)
+    matrices = np.array([np.full((3, 3), np.nan) if matrix is None else matrix
+                         for matrix in cache.values()], dtype=np.float64).reshape(-1, 3, 3)
+    store.save("registration", [artifacts.content_key(video1_path),
+                                artifacts.content_key(video2_path)],
+               version=REGISTRATION_VERSION, frames=frames, matrices=matrices)
+
+
+def _register_gray(frame):
+    """Return a frame in gray, at most REGISTER_WIDTH wide"""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    height, width = gray.shape
+    if width > REGISTER_WIDTH:
+        size = (REGISTER_WIDTH, max(1, round(height * REGISTER_WIDTH / width)))
+        gray = cv2.resize(gray, size, interpolation=cv2.INTER_LINEAR)
+    return gray
+
+
+def _fit(points1, points2):
+    """Fit shadow -> main with RANSAC; return (2x3 matrix, inlier points1, inlier points2)"""
+    matrix, inliers = cv2.estimateAffinePartial2D(points2, points1, method=cv2.RANSAC,
+                                                  ransacReprojThreshold=RANSAC_THRESHOLD)
+    if matrix is None:
+        return None
+    inliers = inliers.ravel() == 1
+    if inliers.sum() < MIN_MATCHES:
+        return None
+    return (matrix, points1[inliers].reshape(-1, 1, 2),
+            points2[inliers].reshape(-1, 1, 2))
+
+
+def _normalize(matrix, shape1, shape2):
+    """Turn a pixel transform between images of two shapes into relative coordinates"""
+    to_main = np.diag([1.0 / shape1[1], 1.0 / shape1[0], 1.0])
+    from_shadow = np.diag([float(shape2[1]), float(shape2[0]), 1.0])
+    return to_main @ np.vstack([matrix, [0.0, 0.0, 1.0]]) @ from_shadow
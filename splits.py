@@ -0,0 +1,360 @@
+"""
+Split times of two runs from markers on their frames
+
+Markers name the frame of each video where the rider passes a point of
+the course: "Start", "Gate 1", "Gate 2", ... and "Finish". They are kept
+as frame numbers, so a marker stays on the same picture, and turned into
+times through the video's timing: the real presentation timestamps once
+its FrameIndex is built, not frame / fps. The split table compares the
+markers both runs passed: each run's time from their first common marker
+(normally Start), the split since the previous marker, and how far the
+shadow run is behind (positive) or ahead.
+
+The same marker pairs make a piecewise-linear TimeWarp (time_warp.py), so
+the shadow is back in sync at every gate instead of drifting from a single
+offset.
+
+Gates can also be found automatically from boxes drawn over each gate on
+the main video (and assumed at the same place in the shadow video). Every
+frame is decoded, but only the part covering the boxes is kept, shrunk to
+DETECT_WIDTH and converted to gray. Motion in a box is the mean absolute
+change between consecutive samples, computed with numpy for a block of
+frames at a time. A passage is a burst of motion well above the box's
+noise; the gate's marker is where the burst first reaches half its peak,
+on the first passage after the previous gate.
+"""
+
+import csv
+import re
+import threading
+
+import cv2
+import numpy as np
+
+import export_engine
+import start_gate
+from time_warp import TimeWarp
+
+
+START = "Start"
+FINISH = "Finish"
+
+# Width in pixels of the full frame the gate boxes are sampled at
+DETECT_WIDTH = 240
+
+# Frames whose samples are differenced together
+BLOCK_FRAMES = 256
+
+# Motion counts as a passage above this many noise deviations...
+NOISE_SIGMAS = 6.0
+# ...and at least this many gray levels above the box's median motion
+MIN_MOTION = 1.5
+
+# Bursts closer together than this (seconds) are one passage
+MERGE_GAP = 0.3
+
+# Passages weaker than this fraction of a box's strongest are ignored
+PEAK_FRACTION = 0.3
+
+CSV_COLUMNS = ["marker", "frame 1", "time 1", "split 1", "frame 2", "time 2", "split 2",
+               "split delta", "delta"]
+
+_GATE_NAME = re.compile(r"Gate (\d+)")
+
+
+class GateDetectionCancelled(Exception):
+    """Raised when a gate detection is cancelled"""
+
+
+def gate_name(number):
+    return f"Gate {number}"
+
+
+def marker_order(name):
+    """Sort key putting Start first, then gates by number, other names, and Finish last"""
+    if name == START:
+        return (0, 0, "")
+    if name == FINISH:
+        return (2, 0, "")
+    match = _GATE_NAME.fullmatch(name)
+    if match:
+        return (1, int(match.group(1)), "")
+    return (1, float("inf"), name)
+
+
+def ordered(markers):
+    """Return the names of a {name: frame number} dict in course order"""
+    return sorted(markers, key=marker_order)
+
+
+def next_gate(markers):
+    """Return the name of the gate after the highest one in `markers`"""
+    numbers = [int(match.group(1)) for match in map(_GATE_NAME.fullmatch, markers) if match]
+    return gate_name(max(numbers, default=0) + 1)
+
+
+class Split:
+    """One marker passed in both runs
+
+    Times are in seconds from the first marker both runs passed; splits
+    are the times since the previous common marker.
+    """
+
+    def __init__(self, name, frame1, frame2, time1, time2, split1, split2):
+        self.name = name
+        self.frame1 = frame1
+        self.frame2 = frame2
+        self.time1 = time1
+        self.time2 = time2
+        self.split1 = split1
+        self.split2 = split2
+
+    @property
+    def delta(self):
+        """Seconds the shadow run is behind the main run at this marker"""
+        return self.time2 - self.time1
+
+    @property
+    def split_delta(self):
+        """Seconds the shadow run lost on the main run since the previous marker"""
+        return self.split2 - self.split1
+
+    def __repr__(self):
+        return f"Split({self.name!r}, {self.time1:.3f}, {self.time2:.3f}, delta={self.delta:+.3f})"
+
+
+def common_markers(markers1, markers2):
+    """Return the names in both marker dicts, in course order"""
+    return [name for name in ordered(markers1) if name in markers2]
+
+
+def split_table(markers1, timing1, markers2, timing2):
+    """Return a Split per marker of both runs, in course order
+
+    `timing1` and `timing2` map frame numbers to seconds with time_of(),
+    e.g. the VideoSources or their FrameIndexes.
+    """
+    splits = []
+    origin = previous = None
+    for name in common_markers(markers1, markers2):
+        frame1, frame2 = int(markers1[name]), int(markers2[name])
+        times = (timing1.time_of(frame1), timing2.time_of(frame2))
+        origin = origin or times
+        previous = previous or times
+        splits.append(Split(name, frame1, frame2, times[0] - origin[0], times[1] - origin[1],
+                            times[0] - previous[0], times[1] - previous[1]))
+        previous = times
+    return splits
+
+
+def write_csv(path, splits):
+    """Write a split table to a CSV file, times in seconds to the millisecond"""
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_COLUMNS)
+        for split in splits:
+            writer.writerow([split.name, split.frame1, f"{split.time1:.3f}",
+                             f"{split.split1:.3f}", split.frame2, f"{split.time2:.3f}",
+                             f"{split.split2:.3f}", f"{split.split_delta:+.3f}",
+                             f"{split.delta:+.3f}"])
+
+
+def split_warp(markers1, timing1, markers2, timing2):
+    """Return a TimeWarp through the markers both runs passed
+
+    Between markers the shadow time is interpolated, before the first and
+    after the last the offset there is kept; a single common marker is a
+    constant offset. Raises ValueError without a common marker, or if the
+    markers are not in the same time order in both videos.
+    """
+    names = common_markers(markers1, markers2)
+    if not names:
+        raise ValueError("The videos have no marker in common")
+    times1 = np.array([timing1.time_of(int(markers1[name])) for name in names])
+    times2 = np.array([timing2.time_of(int(markers2[name])) for name in names])
+    if np.any(np.diff(times1) <= 0) or np.any(np.diff(times2) <= 0):
+        raise ValueError("The markers must be in course order in both videos: "
+                         + ", ".join(names))
+    return TimeWarp(times1, times2)
+
+
+def _check_cancel(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise GateDetectionCancelled()
+
+
+def gate_motion(video_path, rois, index=None, proxy_path=None,
+                progress_callback=None, cancel_event=None):
+    """Return (motion, fps) with the motion in each ROI at every frame of a video
+
+    `rois` are (x0, y0, x1, y1) boxes in 0..1 frame coordinates. Row k of
+    the (frames, len(rois)) array is the change each box sees from frame
+    k - 1 to frame k (zero for the first frame). `index` is the video's
+    FrameIndex or None, and `proxy_path` a preview proxy with the same
+    frames, read instead of the original when given.
+    """
+    cap = export_engine._open_capture(str(proxy_path or video_path))
+    try:
+        nominal = export_engine.capture_timing(cap)
+        timing = index or nominal
+        total_frames = timing.total_frames
+        if proxy_path:
+            total_frames = min(total_frames, nominal.total_frames)
+        fps = nominal.fps or 30.0
+        # A proxy seeks by frame number exactly; the original through its index
+        reader = export_engine.SequentialReader(cap, nominal if proxy_path else timing)
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+        # Only the area around all boxes is sampled, and each box is found in it
+        boxes = [start_gate.roi_pixels(roi, width, height) for roi in rois]
+        left, top = min(box[0] for box in boxes), min(box[1] for box in boxes)
+        right, bottom = max(box[2] for box in boxes), max(box[3] for box in boxes)
+        scale = min(1.0, DETECT_WIDTH / width)
+        size = (max(1, int(round((right - left) * scale))),
+                max(1, int(round((bottom - top) * scale))))
+        sample_boxes = [start_gate.roi_pixels(
+            ((x0 - left) / (right - left), (y0 - top) / (bottom - top),
+             (x1 - left) / (right - left), (y1 - top) / (bottom - top)), *size)
+            for x0, y0, x1, y1 in boxes]
+
+        motion = np.zeros((total_frames, len(rois)), np.float32)
+        # samples[0] is the frame before the block, samples[1:] the block
+        samples = np.empty((BLOCK_FRAMES + 1, size[1], size[0]), np.uint8)
+
+        def add_block(first_frame, count):
+            changes = np.abs(np.diff(samples[:count + 1].astype(np.int16), axis=0))
+            for i, (x0, y0, x1, y1) in enumerate(sample_boxes):
+                motion[first_frame:first_frame + count, i] = (
+                    changes[:, y0:y1, x0:x1].mean(axis=(1, 2)))
+            samples[0] = samples[count]
+
+        count = 0
+        for frame_num in range(total_frames):
+            _check_cancel(cancel_event)
+            frame = reader.read(frame_num)
+            if frame is None:
+                break
+            small = cv2.resize(frame[top:bottom, left:right], size, interpolation=cv2.INTER_AREA)
+            cv2.cvtColor(small, cv2.COLOR_BGR2GRAY, dst=samples[count + 1])
+            if frame_num == 0:
+                samples[0] = samples[1]
+            count += 1
+            if count == BLOCK_FRAMES:
+                add_block(frame_num + 1 - count, count)
+                count = 0
+            if progress_callback and frame_num % 100 == 0:
+                progress_callback(100.0 * frame_num / total_frames)
+        else:
+            frame_num = total_frames
+        if count:
+            add_block(frame_num - count, count)
+    finally:
+        cap.release()
+
+    if progress_callback:
+        progress_callback(100.0)
+    return motion[:frame_num], fps
+
+
+def passages(motion, fps):
+    """Return (onset frame, peak) of every burst of motion in one box's signal
+
+    The onset is the first frame where the burst reaches half its peak
+    above the box's median motion.
+    """
+    if not len(motion):
+        return []
+    baseline = float(np.median(motion))
+    noise = 1.4826 * float(np.median(np.abs(motion - baseline)))
+    active = motion > baseline + max(NOISE_SIGMAS * noise, MIN_MOTION)
+    edges = np.diff(np.concatenate([[0], active.astype(np.int8), [0]]))
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    if not len(starts):
+        return []
+    # Join bursts separated by short pauses, e.g. between front and rear wheel
+    gap = max(1, int(round(MERGE_GAP * fps)))
+    new = np.concatenate([[True], starts[1:] - ends[:-1] > gap])
+    starts, ends = starts[new], ends[np.concatenate([new[1:], [True]])]
+    result = []
+    for start, end in zip(starts, ends):
+        peak = float(motion[start:end].max())
+        half = baseline + 0.5 * (peak - baseline)
+        onset = start + int(np.argmax(motion[start:end] >= half))
+        while onset > 0 and motion[onset - 1] >= half:
+            onset -= 1
+        result.append((int(onset), peak))
+    return result
+
+
+def gates_from_motion(motion, names, fps, after=-1):
+    """Return {name: frame} of the gates found in a gate_motion() array
+
+    Column i is the box of gate `names[i]`, in course order. Each gate is
+    the first strong passage after the previous gate found (or after frame
+    `after`); gates with none are left out.
+    """
+    markers = {}
+    previous = after
+    for i, name in enumerate(names):
+        found = passages(motion[:, i], fps)
+        if not found:
+            continue
+        strongest = max(peak for _, peak in found)
+        for onset, peak in found:
+            if onset > previous and peak >= PEAK_FRACTION * strongest:
+                markers[name] = int(onset)
+                previous = onset
+                break
+    return markers
+
+
+def detect_gates(video_path, rois, names=None, index=None, proxy_path=None, after=-1,
+                 progress_callback=None, cancel_event=None):
+    """Return {name: frame} of the gates found in a video's gate boxes
+
+    `names` defaults to "Gate 1", "Gate 2", ... in the order of `rois`.
+    Passages at or before frame `after` (e.g. the Start marker) are ignored.
+    """
+    if not rois:
+        return {}
+    names = list(names or [gate_name(i) for i in range(1, len(rois) + 1)])
+    motion, fps = gate_motion(video_path, rois, index, proxy_path,
+                              progress_callback, cancel_event)
+    return gates_from_motion(motion, names, fps, after)
+
+
+class GateDetector:
+    """Find the gates of a video on a background thread
+
+    `on_progress(percent)` and `on_done(markers_or_None, error_or_None)` are
+    called from the worker thread.
+    """
+
+    def __init__(self, video_path, on_done, on_progress=None, rois=(), names=None,
+                 index=None, proxy_path=None, after=-1):
+        self.video_path = video_path
+        self.rois = list(rois)
+        self.names = names
+        self.index = index
+        self.proxy_path = proxy_path
+        self.after = after
+        self._cancel_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(on_done, on_progress),
+                                        daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def _run(self, on_done, on_progress):
+        try:
+            markers = detect_gates(self.video_path, self.rois, self.names, self.index,
+                                   self.proxy_path, self.after, on_progress,
+                                   self._cancel_event)
+        except GateDetectionCancelled:
+            return
+        except Exception as e:
+            on_done(None, e)
+            return
+        on_done(markers, None)
@@ -0,0 +1,82 @@
+"""
+Split times window
+
+A table of the markers both runs passed (splits.py), refreshed by the app
+whenever a marker changes, with the controls for the gate boxes,
+automatic gate detection, syncing the shadow to the splits and saving the
+table as CSV.
+"""
+
+import tkinter as tk
+from tkinter import ttk
+
+
+# (column, heading, width in pixels) of the table
+COLUMNS = (("marker", "Marker", 80), ("time1", "Main", 70), ("split1", "Split", 70),
+           ("time2", "Shadow", 70), ("split2", "Split", 70),
+           ("split_delta", "Split Δ", 70), ("delta", "Δ", 70))
+
+KEYS_HELP = ("S start, G next gate, F finish, X remove: on the main video's frame; "
+             "with Shift on the shadow's")
+
+
+class SplitsWindow:
+    """Toplevel window of the split table; the app owns the variables and actions
+
+    `gates_var` turns drawing gate boxes on the main video on and off, and
+    `sync_var` syncing the shadow to the splits, with `on_sync()` called
+    when it is clicked. `on_detect()`, `on_clear_gates()` and `on_save()`
+    run the buttons, and `on_close()` is called once the window is closed.
+    """
+
+    def __init__(self, root, gates_var, sync_var, on_sync, on_detect, on_clear_gates,
+                 on_save, on_close):
+        self.on_close = on_close
+        self.window = tk.Toplevel(root)
+        self.window.title("Splits")
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+
+        frame = ttk.Frame(self.window, padding=10)
+        frame.pack(fill=tk.BOTH, expand=True)
+        ttk.Label(frame, text=KEYS_HELP).pack(anchor=tk.W, pady=(0, 5))
+
+        self.tree = ttk.Treeview(frame, columns=[name for name, _, _ in COLUMNS],
+                                 show="headings", height=10)
+        for name, heading, width in COLUMNS:
+            self.tree.heading(name, text=heading)
+            self.tree.column(name, width=width, anchor=tk.W if name == "marker" else tk.E)
+        self.tree.pack(fill=tk.BOTH, expand=True)
+
+        # Markers only one of the videos has
+        self.status_label = ttk.Label(frame, text="")
+        self.status_label.pack(anchor=tk.W, pady=(5, 0))
+
+        buttons = ttk.Frame(frame)
+        buttons.pack(fill=tk.X, pady=(10, 0))
+        ttk.Checkbutton(buttons, text="Draw gate boxes",
+                        variable=gates_var).pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Button(buttons, text="Clear Gates", command=on_clear_gates).pack(side=tk.LEFT,
+                                                                            padx=(0, 5))
+        ttk.Button(buttons, text="Detect Gates", command=on_detect).pack(side=tk.LEFT,
+                                                                        padx=(0, 20))
+        ttk.Checkbutton(buttons, text="Sync to splits", variable=sync_var,
+                        command=on_sync).pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Button(buttons, text="Save CSV...", command=on_save).pack(side=tk.RIGHT)
+
+    def set_splits(self, splits, status=""):
+        """Show a list of splits.Split and a status line"""
+        self.tree.delete(*self.tree.get_children())
+        for split in splits:
+            self.tree.insert("", tk.END, values=(
+                split.name, f"{split.time1:.3f}", f"{split.split1:.3f}", f"{split.time2:.3f}",
+                f"{split.split2:.3f}", f"{split.split_delta:+.3f}", f"{split.delta:+.3f}"))
+        self.status_label.config(text=status)
+
+    def show(self):
+        """Bring the window to the front"""
+        self.window.deiconify()
+        self.window.lift()
+
+    def close(self):
+        self.window.destroy()
+        self.on_close()
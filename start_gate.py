@@ -0,0 +1,286 @@
+"""
+Visual start-gate detection for syncing runs without usable audio
+
+The user marks the start line as a region of interest (ROI). The launch is
+the moment of strongest motion inside that region: each frame's ROI is
+cropped, converted to gray and shrunk to a few dozen pixels, and motion is
+the mean absolute difference between consecutive samples.
+
+The search is coarse to fine. The coarse pass only looks at a frame every
+fraction of a second. With ffmpeg installed it decodes nothing but the
+keyframes (`-skip_frame nokey`) and crops and shrinks them inside ffmpeg;
+otherwise OpenCV grabs every frame of the preview proxy (or the original)
+but only converts one per step. The fine pass decodes every frame around
+the strongest coarse change and places the launch where motion first
+reaches half its peak, interpolated between frames.
+"""
+
+import re
+import threading
+
+import cv2
+import numpy as np
+
+import export_engine
+from auto_sync import SyncEstimate
+from ffmpeg_tools import find_ffmpeg, keyframe_command, read_output
+
+
+# Seconds between coarse samples when not sampling at keyframes
+COARSE_STEP = 0.25
+
+# Keyframes further apart than this are too sparse for the coarse pass
+MAX_KEYFRAME_GAP = 2.0
+
+# Seconds decoded frame by frame on each side of the strongest coarse change
+FINE_MARGIN = 1.0
+
+# Width the ROI is shrunk to before comparing frames
+SIGNAL_WIDTH = 48
+
+_PTS_TIME = re.compile(rb"pts_time:\s*(-?[\d.]+)")
+
+
+class GateSyncCancelled(Exception):
+    """Raised when a start-gate search is cancelled"""
+
+
+class Launch:
+    """Time (seconds) of the launch in one video and how clearly it stands out"""
+
+    def __init__(self, time, frame_num, prominence):
+        self.time = time
+        self.frame_num = frame_num
+        self.prominence = prominence
+
+    def __repr__(self):
+        return f"Launch(time={self.time:.4f}, frame={self.frame_num}, prominence={self.prominence:.2f})"
+
+
+def normalize_roi(x0, y0, x1, y1):
+    """Return an (x0, y0, x1, y1) ROI in 0..1 frame coordinates, corners in order"""
+    x0, x1 = sorted((min(max(x0, 0.0), 1.0), min(max(x1, 0.0), 1.0)))
+    y0, y1 = sorted((min(max(y0, 0.0), 1.0), min(max(y1, 0.0), 1.0)))
+    return x0, y0, x1, y1
+
+
+def roi_pixels(roi, width, height):
+    """Return the (left, top, right, bottom) pixels of an ROI, at least one pixel wide"""
+    x0, y0, x1, y1 = roi
+    left, top = min(int(x0 * width), width - 1), min(int(y0 * height), height - 1)
+    right = max(left + 1, int(round(x1 * width)))
+    bottom = max(top + 1, int(round(y1 * height)))
+    return left, top, right, bottom
+
+
+def signal_size(crop_width, crop_height):
+    """Return the (width, height) an ROI crop is shrunk to"""
+    width = min(SIGNAL_WIDTH, crop_width)
+    return width, max(1, int(round(crop_height * width / crop_width)))
+
+
+def roi_signal(frame, roi):
+    """Return the ROI of a BGR frame as a small float32 gray image"""
+    left, top, right, bottom = roi_pixels(roi, frame.shape[1], frame.shape[0])
+    crop = cv2.cvtColor(frame[top:bottom, left:right], cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(crop, signal_size(right - left, bottom - top), interpolation=cv2.INTER_AREA)
+    return small.astype(np.float32)
+
+
+def motion(signal1, signal2):
+    return float(cv2.absdiff(signal1, signal2).mean())
+
+
+def _check_cancel(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise GateSyncCancelled()
+
+
+def keyframe_signals(ffmpeg, video_path, roi, width, height, cancel_event=None):
+    """Return (times, signals) of the keyframes of a video, decoded by ffmpeg
+
+    Only keyframes are decoded, and ffmpeg crops and shrinks them, so this
+    reads minutes of 1080p footage in seconds. Returns None if ffmpeg
+    could not read the video, or if the keyframes are too far apart to
+    find the launch between them.
+    """
+    left, top, right, bottom = roi_pixels(roi, width, height)
+    small_width, small_height = signal_size(right - left, bottom - top)
+    video_filter = (f"crop={right - left}:{bottom - top}:{left}:{top},"
+                    f"scale={small_width}:{small_height}:flags=area,format=gray,showinfo")
+    result = read_output(keyframe_command(ffmpeg, video_path, video_filter), cancel_event)
+    if result is None:
+        raise GateSyncCancelled()
+    returncode, data, output = result
+    if returncode != 0:
+        # Every frame is then sampled with OpenCV instead
+        return None
+    times = [float(match) for match in _PTS_TIME.findall(output)]
+    frame_size = small_width * small_height
+    count = min(len(times), len(data) // frame_size)
+    if count < 3 or np.median(np.diff(times[:count])) > MAX_KEYFRAME_GAP:
+        return None
+    frames = np.frombuffer(data[:count * frame_size], dtype=np.uint8)
+    frames = frames.reshape(count, small_height, small_width).astype(np.float32)
+    return times[:count], list(frames)
+
+
+def sampled_signals(reader, total_frames, fps, roi, progress_callback=None, cancel_event=None):
+    """Return (frame numbers, signals) of every COARSE_STEP seconds of a video
+
+    Frames in between are grabbed but not converted.
+    """
+    step = max(1, int(round(fps * COARSE_STEP)))
+    samples = list(range(0, total_frames, step))
+    signals = []
+    for i, frame_num in enumerate(samples):
+        _check_cancel(cancel_event)
+        frame = reader.read(frame_num)
+        if frame is None:
+            break
+        signals.append(roi_signal(frame, roi))
+        if progress_callback and i % 20 == 0:
+            progress_callback(80.0 * i / len(samples))
+    return samples[:len(signals)], signals
+
+
+def _strongest_change(values):
+    """Return (index of the largest value, how much it stands out from the rest)"""
+    best = int(np.argmax(values))
+    others = np.concatenate([values[:max(0, best - 1)], values[best + 2:]])
+    if values[best] <= 0:
+        return best, 0.0
+    if not len(others):
+        return best, 1.0
+    return best, float(np.clip(1.0 - others.max() / values[best], 0.0, 1.0))
+
+
+def find_launch(video_path, roi, index=None, proxy_path=None,
+                progress_callback=None, cancel_event=None):
+    """Return the Launch in the ROI of a video
+
+    `index` is the video's FrameIndex or None. `proxy_path` is a preview
+    proxy with the same frames as the video; without ffmpeg it is read
+    instead of the original, since its frames decode much faster.
+    """
+    ffmpeg = find_ffmpeg()
+    use_proxy = proxy_path is not None and not ffmpeg
+    cap = export_engine._open_capture(str(proxy_path if use_proxy else video_path))
+    try:
+        nominal = export_engine.capture_timing(cap)
+        timing = index or nominal
+        total_frames = timing.total_frames
+        if use_proxy:
+            total_frames = min(total_frames, nominal.total_frames)
+        if total_frames < 3:
+            raise ValueError(f"Video is too short to find the start: {video_path}")
+
+        # A proxy seeks by frame number exactly; the original through its index
+        reader = export_engine.SequentialReader(cap, nominal if use_proxy else timing)
+
+        # Coarse pass: motion between consecutive samples
+        coarse = None
+        if ffmpeg:
+            coarse = keyframe_signals(ffmpeg, video_path, roi,
+                                      int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                                      int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), cancel_event)
+        if coarse is not None:
+            times, signals = coarse
+            samples = [export_engine.clamp_frame(timing.frame_at(t), total_frames) for t in times]
+            if progress_callback:
+                progress_callback(80.0)
+        else:
+            samples, signals = sampled_signals(reader, total_frames, nominal.fps or 30.0, roi,
+                                               progress_callback, cancel_event)
+        if len(signals) < 3:
+            raise ValueError(f"Could not read enough frames from {video_path}")
+
+        changes = np.array([motion(a, b) for a, b in zip(signals, signals[1:])])
+        best, prominence = _strongest_change(changes)
+
+        # Fine pass: every frame around the change, wide enough that the
+        # whole burst of motion and its peak are inside
+        first = export_engine.clamp_frame(
+            timing.frame_at(timing.time_of(samples[best]) - FINE_MARGIN), total_frames)
+        last = export_engine.clamp_frame(
+            timing.frame_at(timing.time_of(samples[best + 1]) + FINE_MARGIN), total_frames)
+        fine = []
+        for frame_num in range(first, last + 1):
+            _check_cancel(cancel_event)
+            frame = reader.read(frame_num)
+            if frame is None:
+                break
+            fine.append(roi_signal(frame, roi))
+        if progress_callback:
+            progress_callback(100.0)
+    finally:
+        cap.release()
+
+    if len(fine) < 2:
+        launch_frame = samples[best + 1]
+        return Launch(timing.time_of(launch_frame), launch_frame, prominence)
+
+    # fine_changes[i] is the motion seen by frame first + i + 1
+    fine_changes = np.array([motion(a, b) for a, b in zip(fine, fine[1:])])
+    peak = int(np.argmax(fine_changes))
+    baseline = float(fine_changes[:peak + 1].min())
+    half = baseline + 0.5 * (fine_changes[peak] - baseline)
+    onset = peak
+    while onset > 0 and fine_changes[onset - 1] >= half:
+        onset -= 1
+
+    launch_frame = first + onset + 1
+    launch_time = timing.time_of(launch_frame)
+    if onset > 0 and fine_changes[onset] > fine_changes[onset - 1]:
+        # Interpolate where motion crossed half its peak
+        fraction = (half - fine_changes[onset - 1]) / (fine_changes[onset] - fine_changes[onset - 1])
+        previous_time = timing.time_of(launch_frame - 1)
+        launch_time = previous_time + fraction * (launch_time - previous_time)
+    return Launch(launch_time, launch_frame, prominence)
+
+
+def estimate_offset(video1, video2, roi, progress_callback=None, cancel_event=None):
+    """Return the SyncEstimate lining up the launches of two videos
+
+    `video1` and `video2` are (path, index_or_None, proxy_path_or_None).
+    """
+    launches = []
+    for i, (path, index, proxy_path) in enumerate((video1, video2)):
+        def progress(percent, i=i):
+            if progress_callback:
+                progress_callback((i * 100.0 + percent) / 2)
+        launches.append(find_launch(path, roi, index, proxy_path, progress, cancel_event))
+    launch1, launch2 = launches
+    return SyncEstimate(launch2.time - launch1.time,
+                        min(launch1.prominence, launch2.prominence))
+
+
+class GateSync:
+    """Find the launches of two videos in a start-gate ROI on a background thread
+
+    `on_progress(percent)` and `on_done(estimate_or_None, error_or_None)` are
+    called from the worker thread.
+    """
+
+    def __init__(self, video1, video2, roi, on_done, on_progress=None):
+        self.video1 = video1
+        self.video2 = video2
+        self.roi = roi
+        self._cancel_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(on_done, on_progress),
+                                        daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def _run(self, on_done, on_progress):
+        try:
+            estimate = estimate_offset(self.video1, self.video2, self.roi,
+                                       on_progress, self._cancel_event)
+        except GateSyncCancelled:
+            return
+        except Exception as e:
+            on_done(None, e)
+            return
+        on_done(estimate, None)
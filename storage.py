@@ -0,0 +1,60 @@
+"""
+Locations for files the analyzer derives from videos
+
+Frame indexes, proxies and other analysis results are written either next
+to the video (sidecar files) or into a per-user cache directory. The cache
+directory can be moved with the GYMKHANA_CACHE_DIR environment variable.
+"""
+
+import hashlib
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+
+
+def cache_root():
+    """Return the per-user cache directory of the analyzer"""
+    configured = os.environ.get("GYMKHANA_CACHE_DIR")
+    if configured:
+        return Path(configured)
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or Path.home() / "AppData" / "Local"
+        return Path(base) / "GymkhanaVideoAnalyzer" / "cache"
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "gymkhana_video_analyzer"
+
+
+def cache_dir(*parts):
+    """Return (and create) a subdirectory of the cache directory"""
+    path = cache_root().joinpath(*parts)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def file_signature(path):
+    """Return (size, mtime in ns) identifying the current contents of a file"""
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def path_key(path):
+    """Return a short stable name for a file path, for use in cache file names"""
+    resolved = str(Path(path).resolve())
+    return hashlib.sha1(resolved.encode("utf-8")).hexdigest()[:16]
+
+
+def save_arrays(path, compressed=False, **arrays):
+    """Write arrays to an .npz file without ever leaving a partly written one
+
+    The arrays go to a temporary file first, which then replaces `path`, so
+    a crash during the save keeps the old file, or no file at all.
+    """
+    path = Path(path)
+    temp_path = path.with_name(path.stem + ".part.npz")
+    if compressed:
+        np.savez_compressed(temp_path, **arrays)
+    else:
+        np.savez(temp_path, **arrays)
+    os.replace(temp_path, path)
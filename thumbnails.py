@@ -0,0 +1,260 @@
+"""
+Keyframe thumbnails of a video for the filmstrip under the timeline
+
+A filmstrip needs one small picture every few seconds, not exact frames,
+so only keyframes are decoded. With ffmpeg installed, it skips everything
+else (`-skip_frame nokey`), keeps keyframes at least a slot apart and
+shrinks them itself. Without ffmpeg, the keyframes nearest to evenly spaced
+times are looked up in the FrameIndex and seeked to, so each thumbnail
+costs one keyframe decode. Without an index, the seek uses the nominal
+frame rate.
+
+Strips are saved to the cache directory keyed by file size and mtime, and
+to an ArtifactStore (artifacts.py) by content if one is given, so the
+filmstrip of a known video appears at once.
+"""
+
+import re
+import threading
+
+import cv2
+import numpy as np
+
+import artifacts
+import export_engine
+import storage
+from ffmpeg_tools import find_ffmpeg, keyframe_command, read_output
+
+
+THUMBNAIL_VERSION = 1
+
+# Height of the thumbnails in pixels; the width follows the aspect ratio
+THUMBNAIL_HEIGHT = 54
+
+# At most this many thumbnails per video
+STRIP_THUMBNAILS = 160
+
+_PTS_TIME = re.compile(rb"pts_time:\s*(-?[\d.]+)")
+
+
+class ThumbnailsCancelled(Exception):
+    """Raised when sampling thumbnails is cancelled"""
+
+
+class ThumbnailStrip:
+    """Small RGB images of a video at increasing times (seconds)"""
+
+    def __init__(self, times, images):
+        self.times = np.asarray(times, dtype=np.float64)
+        self.images = np.asarray(images, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def size(self):
+        """(width, height) of each thumbnail"""
+        return self.images.shape[2], self.images.shape[1]
+
+    def image_at(self, time):
+        """Return the thumbnail nearest to `time`, or None if the strip is empty"""
+        if not len(self.times):
+            return None
+        i = int(np.searchsorted(self.times, time))
+        if i > 0 and (i == len(self.times) or time - self.times[i - 1] < self.times[i] - time):
+            i -= 1
+        return self.images[i]
+
+    def save(self, path, signature):
+        storage.save_arrays(path, version=THUMBNAIL_VERSION,
+                            signature=np.asarray(signature, dtype=np.int64),
+                            times=self.times, images=self.images)
+
+    @classmethod
+    def load(cls, path, signature):
+        """Load a saved strip, or return None if it is missing, stale or damaged"""
+        try:
+            with np.load(path) as data:
+                if int(data["version"]) != THUMBNAIL_VERSION:
+                    return None
+                if tuple(data["signature"]) != tuple(signature):
+                    return None
+                return cls(data["times"], data["images"])
+        except Exception:
+            # Not only OSError: a truncated file raises zipfile.BadZipFile or
+            # EOFError, and is recomputed like a missing one
+            return None
+
+
+def thumbnail_size(width, height, thumbnail_height=THUMBNAIL_HEIGHT):
+    """Return the (width, height) of thumbnails of frames of (width, height)"""
+    if width <= 0 or height <= 0:
+        return thumbnail_height * 16 // 9, thumbnail_height
+    return max(1, int(round(width * thumbnail_height / height))), thumbnail_height
+
+
+def keyframe_thumbnails(ffmpeg, video_path, size, step, cancel_event=None):
+    """Return (times, images) of keyframes at least `step` seconds apart, decoded by ffmpeg
+
+    Returns None if ffmpeg could not read the video.
+    """
+    width, height = size
+    video_filter = (f"select='isnan(prev_selected_t)+gte(t-prev_selected_t\\,{step:.3f})',"
+                    f"scale={width}:{height}:flags=area,format=rgb24,showinfo")
+    result = read_output(keyframe_command(ffmpeg, video_path, video_filter), cancel_event)
+    if result is None:
+        raise ThumbnailsCancelled()
+    returncode, data, output = result
+    times = [float(match) for match in _PTS_TIME.findall(output)]
+    frame_size = width * height * 3
+    count = min(len(times), len(data) // frame_size)
+    if returncode != 0 or count == 0:
+        return None
+    images = np.frombuffer(data[:count * frame_size], dtype=np.uint8)
+    # Presentation times count from the first frame, like the FrameIndex's
+    times = np.asarray(times[:count]) - times[0]
+    return times, images.reshape(count, height, width, 3)
+
+
+def sampled_thumbnails(cap, timing, index, size, count, progress_callback=None,
+                       cancel_event=None):
+    """Return (times, images) of the keyframes nearest to `count` evenly spaced times
+
+    Without an index the frames at those times are seeked to instead.
+    """
+    duration = timing.time_of(timing.total_frames - 1)
+    targets = np.array([timing.frame_at(t) for t in np.linspace(0.0, duration, count)])
+    if index is not None and len(index.keyframes) > 1:
+        keyframes = index.keyframes
+        after = np.clip(np.searchsorted(keyframes, targets), 1, len(keyframes) - 1)
+        before, after = keyframes[after - 1], keyframes[after]
+        targets = np.where(targets - before <= after - targets, before, after)
+    frame_nums = sorted({export_engine.clamp_frame(int(frame_num), timing.total_frames)
+                         for frame_num in targets})
+
+    times = []
+    images = []
+    for i, frame_num in enumerate(frame_nums):
+        if cancel_event is not None and cancel_event.is_set():
+            raise ThumbnailsCancelled()
+        if timing.seek(cap, frame_num):
+            ret, frame = cap.retrieve()
+            if ret:
+                small = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+                images.append(cv2.cvtColor(small, cv2.COLOR_BGR2RGB))
+                times.append(timing.time_of(frame_num))
+        if progress_callback and i % 10 == 0:
+            progress_callback(99.0 * i / len(frame_nums))
+    return times, images
+
+
+def sample_thumbnails(video_path, index=None, count=STRIP_THUMBNAILS,
+                      thumbnail_height=THUMBNAIL_HEIGHT, progress_callback=None,
+                      cancel_event=None):
+    """Return the ThumbnailStrip of a video, from keyframes only
+
+    `index` is the video's FrameIndex or None. `progress_callback`
+    receives percent done.
+    """
+    cap = export_engine._open_capture(str(video_path))
+    try:
+        timing = index or export_engine.capture_timing(cap)
+        if timing.total_frames < 1:
+            raise ValueError(f"Video has no frames: {video_path}")
+        size = thumbnail_size(int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                              int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), thumbnail_height)
+        duration = timing.time_of(timing.total_frames - 1)
+
+        sampled = None
+        ffmpeg = find_ffmpeg()
+        # With a keyframe every frame or two, ffmpeg would decode them all
+        dense = index is not None and len(index.keyframes) > 4 * count
+        if ffmpeg and not dense:
+            sampled = keyframe_thumbnails(ffmpeg, video_path, size,
+                                          duration / max(1, count - 1), cancel_event)
+        if sampled is None:
+            sampled = sampled_thumbnails(cap, timing, index, size, count,
+                                         progress_callback, cancel_event)
+    finally:
+        cap.release()
+
+    times, images = sampled
+    if not len(times):
+        raise ValueError(f"Could not read any keyframes from {video_path}")
+    if progress_callback:
+        progress_callback(100.0)
+    return ThumbnailStrip(times, np.stack(images))
+
+
+def cached_strip_path(video_path):
+    return storage.cache_dir("thumbnails") / (storage.path_key(video_path) + ".npz")
+
+
+def load_artifact(store, video_path):
+    """Return the thumbnails of a video from an ArtifactStore, or None if it has none"""
+    arrays = store.load("thumbnails", [artifacts.content_key(video_path)])
+    if arrays is None or int(arrays.get("version", -1)) != THUMBNAIL_VERSION:
+        return None
+    return ThumbnailStrip(arrays["times"], arrays["images"])
+
+
+def save_artifact(store, video_path, strip):
+    store.save("thumbnails", [artifacts.content_key(video_path)],
+               version=THUMBNAIL_VERSION, times=strip.times, images=strip.images)
+
+
+def load_or_sample_thumbnails(video_path, index=None, progress_callback=None,
+                              cancel_event=None, store=None):
+    """Return the saved thumbnails of a video, sampling and saving them if needed
+
+    `store` is an optional ArtifactStore checked first and kept up to date.
+    """
+    if store is not None:
+        strip = load_artifact(store, video_path)
+        if strip is not None:
+            return strip
+
+    signature = storage.file_signature(video_path)
+    path = cached_strip_path(video_path)
+    strip = ThumbnailStrip.load(path, signature)
+    if strip is None:
+        strip = sample_thumbnails(video_path, index, progress_callback=progress_callback,
+                                  cancel_event=cancel_event)
+        try:
+            strip.save(path, signature)
+        except OSError:
+            pass
+    if store is not None:
+        save_artifact(store, video_path, strip)
+    return strip
+
+
+class ThumbnailBuilder:
+    """Sample or load a video's thumbnails on a background thread
+
+    `on_progress(percent)` and `on_done(strip_or_None, error_or_None)` are
+    called from the worker thread.
+    """
+
+    def __init__(self, video_path, on_done, on_progress=None, index=None, store=None):
+        self.video_path = video_path
+        self.index = index
+        self.store = store
+        self._cancel_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(on_done, on_progress),
+                                        daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def _run(self, on_done, on_progress):
+        try:
+            strip = load_or_sample_thumbnails(self.video_path, self.index, on_progress,
+                                              self._cancel_event, self.store)
+        except ThumbnailsCancelled:
+            return
+        except Exception as e:
+            on_done(None, e)
+            return
+        on_done(strip, None)
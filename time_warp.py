@@ -0,0 +1,295 @@
+"""
+Time-warped alignment of two runs along the whole course
+
+A constant sync offset only lines the riders up at one moment: as soon as
+one is faster through a section the shadow drifts away. TimeWarp replaces
+the offset with a mapping from main video time to shadow video time,
+found by dynamic time warping (DTW) of a small per-frame descriptor of
+where the rider is.
+
+The descriptor is a 32x18 gray thumbnail minus the video's median
+thumbnail (the empty course, for a camera on a tripod), so it mostly shows
+the rider. Both videos are sampled at FEATURE_RATE per second and the
+warp is searched only within BAND_SECONDS of the constant sync offset,
+which keeps DTW to a few hundred thousand cells for a 2-minute run.
+
+Warps can be kept in an ArtifactStore (artifacts.py), keyed by the
+contents of both videos and the starting offset.
+"""
+
+import threading
+
+import cv2
+import numpy as np
+
+import artifacts
+import export_engine
+from ffmpeg_tools import find_ffmpeg, read_output
+
+
+FEATURE_RATE = 10.0
+FEATURE_SIZE = (32, 18)
+BAND_SECONDS = 8.0
+
+# Samples of the mapping averaged to remove the DTW staircase
+SMOOTHING = 5
+
+
+class TimeWarpCancelled(Exception):
+    """Raised when a time warp computation is cancelled"""
+
+
+class TimeWarp:
+    """Mapping from main video time to shadow video time
+
+    Holds matching (time1, time2) samples in seconds, both increasing, and
+    interpolates between them. Outside the aligned range the offset at the
+    nearest end is kept.
+    """
+
+    def __init__(self, times1, times2):
+        self.times1 = np.asarray(times1, dtype=np.float64)
+        self.times2 = np.asarray(times2, dtype=np.float64)
+
+    def shadow_time(self, time1):
+        """Return the shadow video time matching main video time `time1`"""
+        if time1 <= self.times1[0]:
+            return time1 + self.times2[0] - self.times1[0]
+        if time1 >= self.times1[-1]:
+            return time1 + self.times2[-1] - self.times1[-1]
+        return float(np.interp(time1, self.times1, self.times2))
+
+    def offset_at(self, time1):
+        """Return the sync offset in effect at main video time `time1`"""
+        return self.shadow_time(time1) - time1
+
+
+def _ffmpeg_thumbnails(ffmpeg, video_path, rate, cancel_event):
+    """Decode gray thumbnails at `rate` per second with ffmpeg, or None on failure"""
+    width, height = FEATURE_SIZE
+    cmd = [ffmpeg, "-hide_banner", "-loglevel", "error", "-i", str(video_path), "-an",
+           "-vf", f"fps={rate},scale={width}:{height}:flags=area,format=gray",
+           "-f", "rawvideo", "-"]
+    result = read_output(cmd, cancel_event)
+    if result is None:
+        raise TimeWarpCancelled()
+    returncode, data, _ = result
+    count = len(data) // (width * height)
+    if returncode != 0 or count == 0:
+        return None
+    return np.frombuffer(data[:count * width * height], dtype=np.uint8).reshape(count, height, width)
+
+
+def _opencv_thumbnails(video_path, index, rate, progress_callback, cancel_event):
+    """Decode gray thumbnails at `rate` per second with OpenCV"""
+    cap = export_engine._open_capture(str(video_path))
+    try:
+        timing = index or export_engine.capture_timing(cap)
+        reader = export_engine.SequentialReader(cap, index)
+        duration = timing.time_of(timing.total_frames - 1)
+        count = int(duration * rate) + 1
+        thumbnails = []
+        for k in range(count):
+            if cancel_event is not None and cancel_event.is_set():
+                raise TimeWarpCancelled()
+            frame_num = export_engine.clamp_frame(timing.frame_at(k / rate), timing.total_frames)
+            frame = reader.read(frame_num)
+            if frame is None:
+                break
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            thumbnails.append(cv2.resize(gray, FEATURE_SIZE, interpolation=cv2.INTER_AREA))
+            if progress_callback and k % 50 == 0:
+                progress_callback(100.0 * k / count)
+    finally:
+        cap.release()
+    return np.array(thumbnails, dtype=np.uint8)
+
+
+def rider_features(video_path, index=None, rate=FEATURE_RATE,
+                   progress_callback=None, cancel_event=None):
+    """Return one unit-length rider descriptor per 1/rate seconds of a video
+
+    Sample k is at k / rate seconds. Samples where nothing differs from the
+    empty course are all zeros.
+    """
+    ffmpeg = find_ffmpeg()
+    thumbnails = _ffmpeg_thumbnails(ffmpeg, video_path, rate, cancel_event) if ffmpeg else None
+    if thumbnails is None:
+        thumbnails = _opencv_thumbnails(video_path, index, rate, progress_callback, cancel_event)
+    if len(thumbnails) < 2:
+        raise ValueError(f"Could not read enough frames from {video_path}")
+
+    thumbnails = thumbnails.astype(np.float32)
+    background = np.median(thumbnails, axis=0)
+    features = np.abs(thumbnails - background).reshape(len(thumbnails), -1)
+
+    norms = np.linalg.norm(features, axis=1)
+    # Compression noise and lighting changes, not a rider
+    empty = norms < 0.1 * np.percentile(norms, 90)
+    features /= np.where(empty, 1.0, norms)[:, None]
+    features[empty] = 0.0
+    return features
+
+
+def banded_dtw(features1, features2, offset, band):
+    """Align two feature sequences and return the path as (i, j) index arrays
+
+    Only cells with |j - (i + offset)| <= band are considered. The cost of a
+    cell is the squared distance between the descriptors. The path may
+    start and end anywhere in the band of the first and last rows of
+    features1 that overlap features2.
+    """
+    n1, n2 = len(features1), len(features2)
+    width = 2 * band + 1
+    squared2 = np.einsum("ij,ij->i", features2, features2)
+
+    # cost[i, k] and total[i, k] are for column j = i + offset - band + k, so
+    # moving down a row shifts the band right by one: (i-1, j) is at k+1
+    # and (i-1, j-1) at k in the previous row
+    total = np.full((n1, width), np.inf, dtype=np.float64)
+    offsets = np.arange(width)
+    first_row = last_row = None
+    previous = None
+    for i in range(n1):
+        columns = i + offset - band + offsets
+        valid = (columns >= 0) & (columns < n2)
+        if not valid.any():
+            if first_row is not None:
+                break
+            continue
+        lo, hi = np.flatnonzero(valid)[[0, -1]]
+        js = columns[lo:hi + 1]
+        cost = (features1[i] @ features1[i]) + squared2[js] - 2.0 * (features2[js] @ features1[i])
+
+        if previous is None:
+            entry = cost.copy()
+            first_row = i
+        else:
+            up = np.append(previous[1:], np.inf)
+            entry = cost + np.minimum(previous, up)[lo:hi + 1]
+
+        # Moves along the row: total[k] = min over m <= k of entry[m] + cost[m+1..k],
+        # a running minimum on prefix sums instead of a Python loop
+        prefix = np.cumsum(cost)
+        total[i, lo:hi + 1] = prefix + np.minimum.accumulate(entry - prefix)
+        previous = total[i]
+        last_row = i
+
+    if first_row is None:
+        raise ValueError("The videos do not overlap at this sync offset")
+
+    # Walk back from the cheapest cell of the last row
+    i, k = last_row, int(np.argmin(total[last_row]))
+    path_i, path_j = [], []
+    while True:
+        path_i.append(i)
+        path_j.append(i + offset - band + k)
+        if i == first_row:
+            break
+        moves = [(total[i - 1, k], i - 1, k),
+                 (total[i - 1, k + 1] if k + 1 < width else np.inf, i - 1, k + 1),
+                 (total[i, k - 1] if k > 0 else np.inf, i, k - 1)]
+        _, i, k = min(moves, key=lambda move: move[0])
+    return np.array(path_i[::-1]), np.array(path_j[::-1])
+
+
+def warp_from_path(path_i, path_j, rate=FEATURE_RATE):
+    """Turn a DTW path into a smooth, increasing TimeWarp"""
+    rows = np.unique(path_i)
+    # Average the columns matched to each row, then smooth the staircase
+    columns = np.bincount(path_i - rows[0], weights=path_j)[rows - rows[0]]
+    columns /= np.bincount(path_i - rows[0])[rows - rows[0]]
+    if len(columns) >= SMOOTHING:
+        padded = np.pad(columns, SMOOTHING // 2, mode="edge")
+        columns = np.convolve(padded, np.ones(SMOOTHING) / SMOOTHING, mode="valid")
+    columns = np.maximum.accumulate(columns)
+    return TimeWarp(rows / rate, columns / rate)
+
+
+def align_videos(video1, video2, sync_offset, band_seconds=BAND_SECONDS,
+                 progress_callback=None, cancel_event=None):
+    """Return the TimeWarp aligning two runs, starting from a constant offset
+
+    `video1` and `video2` are (path, index_or_None).
+    """
+    features = []
+    for n, (path, index) in enumerate((video1, video2)):
+        def progress(percent, n=n):
+            if progress_callback:
+                progress_callback((n * 100.0 + percent) * 0.45)
+        features.append(rider_features(path, index, progress_callback=progress,
+                                       cancel_event=cancel_event))
+    if cancel_event is not None and cancel_event.is_set():
+        raise TimeWarpCancelled()
+    path_i, path_j = banded_dtw(features[0], features[1],
+                                int(round(sync_offset * FEATURE_RATE)),
+                                max(1, int(round(band_seconds * FEATURE_RATE))))
+    if progress_callback:
+        progress_callback(100.0)
+    return warp_from_path(path_i, path_j)
+
+
+def _artifact_keys(video1_path, video2_path, sync_offset):
+    # The search band is centred on the offset, rounded to the feature rate
+    return [artifacts.content_key(video1_path), artifacts.content_key(video2_path),
+            f"{int(round(sync_offset * FEATURE_RATE))}"]
+
+
+def load_artifact(store, video1_path, video2_path, sync_offset):
+    """Return the saved TimeWarp of a pair from an ArtifactStore, or None if it has none"""
+    arrays = store.load("timewarp", _artifact_keys(video1_path, video2_path, sync_offset))
+    if arrays is None:
+        return None
+    return TimeWarp(arrays["times1"], arrays["times2"])
+
+
+def save_artifact(store, video1_path, video2_path, sync_offset, warp):
+    store.save("timewarp", _artifact_keys(video1_path, video2_path, sync_offset),
+               times1=warp.times1, times2=warp.times2)
+
+
+def load_or_align(video1, video2, sync_offset, progress_callback=None, cancel_event=None,
+                  store=None):
+    """Return the saved TimeWarp of a pair from `store`, aligning and saving it if needed"""
+    if store is not None:
+        warp = load_artifact(store, video1[0], video2[0], sync_offset)
+        if warp is not None:
+            return warp
+    warp = align_videos(video1, video2, sync_offset, progress_callback=progress_callback,
+                        cancel_event=cancel_event)
+    if store is not None:
+        save_artifact(store, video1[0], video2[0], sync_offset, warp)
+    return warp
+
+
+class TimeWarpBuilder:
+    """Compute a TimeWarp on a background thread
+
+    `on_progress(percent)` and `on_done(warp_or_None, error_or_None)` are
+    called from the worker thread.
+    """
+
+    def __init__(self, video1, video2, sync_offset, on_done, on_progress=None, store=None):
+        self.video1 = video1
+        self.video2 = video2
+        self.sync_offset = sync_offset
+        self.store = store
+        self._cancel_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(on_done, on_progress),
+                                        daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def _run(self, on_done, on_progress):
+        try:
+            warp = load_or_align(self.video1, self.video2, self.sync_offset,
+                                 progress_callback=on_progress,
+                                 cancel_event=self._cancel_event, store=self.store)
+        except TimeWarpCancelled:
+            return
+        except Exception as e:
+            on_done(None, e)
+            return
+        on_done(warp, None)
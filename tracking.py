@@ -0,0 +1,380 @@
+"""
+Rider tracking and the racing line overlay
+
+The user draws a box around the rider in one frame. From there the rider
+is followed forward through the video on small gray frames (TRACK_WIDTH
+pixels wide): each tracked frame, the rider's appearance is searched for
+by normalized cross-correlation (cv2.matchTemplate) in a window around
+where the last positions predict it, and the template slowly adapts as
+the rider turns. The model-free OpenCV trackers (e.g. TrackerMIL) take
+tens of milliseconds per frame even at this size; a correlation search
+takes well under one.
+
+Only TRACK_RATE frames per second are converted and tracked; frames in
+between are grabbed but not converted, and their positions interpolated.
+Decoding is the remaining cost, so the preview proxy is read instead of
+the original when there is one.
+
+The result is a Trajectory: one TRACK_DTYPE record per frame of the video
+with the box centre and size in 0..1 frame coordinates, saved to the
+cache directory and to an ArtifactStore (artifacts.py) by content, box
+and start frame, so replays, exports and reopened projects reuse it.
+"""
+
+import hashlib
+import threading
+
+import cv2
+import numpy as np
+
+import artifacts
+import export_engine
+import storage
+import start_gate
+
+
+TRACK_VERSION = 1
+
+# Box centre and size in 0..1 frame coordinates, and whether the rider was found
+TRACK_DTYPE = np.dtype([("x", np.float32), ("y", np.float32), ("w", np.float32),
+                        ("h", np.float32), ("found", np.bool_)])
+
+# Width of the gray frames the rider is tracked on
+TRACK_WIDTH = 480
+
+# Tracked frames per second of video; frames in between are interpolated
+TRACK_RATE = 15.0
+
+# Correlation below which the rider counts as lost in a frame
+MIN_SCORE = 0.5
+
+# A match scoring below this fraction of the recent ones is something else
+SCORE_DROP = 0.8
+
+# How fast the template and the typical score follow the rider's changing appearance
+TEMPLATE_RATE = 0.1
+
+# Path colours (RGB) by layer: the main video, the shadow, further layers
+PATH_COLORS = [(255, 220, 0), (0, 200, 255), (255, 80, 200), (120, 255, 80)]
+
+
+class TrackingCancelled(Exception):
+    """Raised when tracking is cancelled"""
+
+
+class TemplateTracker:
+    """Follow a box through gray frames of one size by normalized cross-correlation"""
+
+    def __init__(self, frame, rect):
+        self.frame_size = frame.shape[1], frame.shape[0]
+        x, y, width, height = rect
+        self.size = width, height
+        self.template = frame[y:y + height, x:x + width].astype(np.float32)
+        self.position = np.array([x, y], dtype=np.float64)
+        self.velocity = np.zeros(2)
+        self.lost = 0
+        # Running average of the scores of recent matches
+        self.score = 1.0
+
+    def update(self, frame):
+        """Return (found, (x, y, width, height)) of the box in the next tracked frame"""
+        frame_width, frame_height = self.frame_size
+        width, height = self.size
+        # Where the rider would be at the same speed, counting the frames it was lost
+        predicted = np.clip(self.position + self.velocity * (1 + self.lost), 0,
+                            [frame_width - width, frame_height - height])
+        # The search window grows while the rider is lost, up to the whole frame
+        margin = max(width, height) * (1 + self.lost) + np.abs(self.velocity).max()
+        left = int(np.clip(predicted[0] - margin, 0, frame_width - width))
+        top = int(np.clip(predicted[1] - margin, 0, frame_height - height))
+        right = int(np.clip(predicted[0] + width + margin, left + width, frame_width))
+        bottom = int(np.clip(predicted[1] + height + margin, top + height, frame_height))
+
+        window = frame[top:bottom, left:right].astype(np.float32)
+        scores = cv2.matchTemplate(window, self.template, cv2.TM_CCOEFF_NORMED)
+        _, score, _, (x, y) = cv2.minMaxLoc(scores)
+        if score < MIN_SCORE or score < SCORE_DROP * self.score:
+            self.lost += 1
+            return False, self._rect(predicted)
+
+        position = np.array([left + x, top + y], dtype=np.float64)
+        self.velocity = (position - self.position) / (1 + self.lost)
+        self.position = position
+        self.lost = 0
+        self.score += TEMPLATE_RATE * (score - self.score)
+        patch = window[y:y + height, x:x + width]
+        cv2.accumulateWeighted(patch, self.template, TEMPLATE_RATE)
+        return True, self._rect(position)
+
+    def _rect(self, position):
+        return (int(round(position[0])), int(round(position[1]))) + self.size
+
+
+def track_size(width, height, track_width=TRACK_WIDTH):
+    """Return the (width, height) frames of (width, height) are tracked at"""
+    if width <= track_width:
+        return width, height
+    return track_width, max(1, int(round(height * track_width / width)))
+
+
+def _gray(frame, size):
+    small = cv2.resize(frame, size, interpolation=cv2.INTER_LINEAR)
+    return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+
+def interpolate_positions(positions, tracked):
+    """Fill the records between tracked frames where the rider was found on both sides"""
+    found = tracked[positions["found"][tracked]]
+    if len(found) < 2:
+        return positions
+    frames = np.arange(found[0], found[-1] + 1)
+    for field in ("x", "y", "w", "h"):
+        positions[field][frames] = np.interp(frames, found, positions[field][found])
+    # Frames in a gap where the rider was lost stay unfound
+    gaps = np.flatnonzero(np.diff(found) > np.diff(tracked).max(initial=1))
+    positions["found"][frames] = True
+    for gap in gaps:
+        positions["found"][found[gap] + 1:found[gap + 1]] = False
+    return positions
+
+
+def track_rider(video_path, box, start_frame=0, index=None, proxy_path=None,
+                progress_callback=None, cancel_event=None):
+    """Return the Trajectory of the rider inside `box` at `start_frame`, tracked to the end
+
+    `box` is (x0, y0, x1, y1) in 0..1 frame coordinates. `index` is the
+    video's FrameIndex or None, and `proxy_path` a preview proxy with the
+    same frames, read instead of the original when given.
+    `progress_callback` receives percent done.
+    """
+    box = start_gate.normalize_roi(*box)
+    cap = export_engine._open_capture(str(proxy_path or video_path))
+    try:
+        nominal = export_engine.capture_timing(cap)
+        timing = index or nominal
+        total_frames = timing.total_frames
+        if proxy_path:
+            total_frames = min(total_frames, nominal.total_frames)
+        start_frame = export_engine.clamp_frame(start_frame, total_frames)
+        # A proxy seeks by frame number exactly; the original through its index
+        reader = export_engine.SequentialReader(cap, nominal if proxy_path else timing)
+        size = track_size(int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                          int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        width, height = size
+
+        frame = reader.read(start_frame)
+        if frame is None:
+            raise ValueError(f"Could not read frame {start_frame} of {video_path}")
+        left, top, right, bottom = start_gate.roi_pixels(box, width, height)
+        rect = (left, top, right - left, bottom - top)
+        tracker = TemplateTracker(_gray(frame, size), rect)
+
+        positions = np.zeros(total_frames, dtype=TRACK_DTYPE)
+        fps = nominal.fps or 30.0
+        step = max(1, int(round(fps / TRACK_RATE)))
+        tracked = list(range(start_frame, total_frames, step))
+        done = []
+        for i, frame_num in enumerate(tracked):
+            if cancel_event is not None and cancel_event.is_set():
+                raise TrackingCancelled()
+            if frame_num == start_frame:
+                found, (x, y, w, h) = True, rect
+            else:
+                frame = reader.read(frame_num)
+                if frame is None:
+                    break
+                found, (x, y, w, h) = tracker.update(_gray(frame, size))
+            positions[frame_num] = ((x + w / 2) / width, (y + h / 2) / height,
+                                    w / width, h / height, found)
+            done.append(frame_num)
+            if progress_callback and i % 30 == 0:
+                progress_callback(100.0 * i / len(tracked))
+    finally:
+        cap.release()
+
+    if progress_callback:
+        progress_callback(100.0)
+    positions = interpolate_positions(positions, np.array(done, dtype=np.int64))
+    return Trajectory(positions, box, start_frame)
+
+
+class Trajectory:
+    """Tracked rider positions of a video, one TRACK_DTYPE record per frame
+
+    `box` and `start_frame` are the selection tracking started from.
+    """
+
+    def __init__(self, positions, box, start_frame):
+        self.positions = np.asarray(positions, dtype=TRACK_DTYPE)
+        self.box = tuple(float(v) for v in box)
+        self.start_frame = int(start_frame)
+        # Pixel polylines by frame (width, height)
+        self._paths = {}
+
+    def __len__(self):
+        return len(self.positions)
+
+    def position(self, frame_num):
+        """Return the (x, y) of the rider in 0..1 frame coordinates, or None if unknown"""
+        if not 0 <= frame_num < len(self.positions):
+            return None
+        record = self.positions[frame_num]
+        if not record["found"]:
+            return None
+        return float(record["x"]), float(record["y"])
+
+    def runs(self):
+        """Return the (N, 2) point arrays of each run of frames where the rider was found"""
+        found = self.positions["found"]
+        edges = np.flatnonzero(np.diff(np.concatenate([[False], found, [False]]).astype(np.int8)))
+        points = np.stack([self.positions["x"], self.positions["y"]], axis=1)
+        return [points[start:end] for start, end in zip(edges[::2], edges[1::2])
+                if end - start > 1]
+
+    def path(self, width, height):
+        """Return the polylines of the path in pixels of a (width, height) frame"""
+        paths = self._paths.get((width, height))
+        if paths is None:
+            paths = self._paths[(width, height)] = [
+                np.round(run * (width, height)).astype(np.int32) for run in self.runs()]
+        return paths
+
+    def draw(self, frame, frame_num, color_index=0, rgb=False, matrix=None):
+        """Draw the path and the rider's position at `frame_num` onto `frame` in place
+
+        `matrix` is a relative-coordinate transform (registration.py)
+        mapping this video's frames onto `frame`, or None.
+        """
+        height, width = frame.shape[:2]
+        color = PATH_COLORS[color_index % len(PATH_COLORS)]
+        if not rgb:
+            color = color[::-1]
+        thickness = max(1, height // 360)
+        if matrix is None:
+            paths = self.path(width, height)
+        else:
+            # The current frame's transform moves the whole path
+            to_pixels = np.diag([float(width), float(height), 1.0]) @ matrix
+            paths = [np.round(cv2.transform(run.reshape(-1, 1, 2), to_pixels[:2]))
+                     .astype(np.int32) for run in self.runs()]
+        if paths:
+            cv2.polylines(frame, paths, False, color, thickness, cv2.LINE_AA)
+        position = self.position(frame_num)
+        if position is not None:
+            point = np.array([[position]], dtype=np.float64)
+            if matrix is not None:
+                point = cv2.transform(point, matrix[:2])
+            center = (int(round(point[0, 0, 0] * width)), int(round(point[0, 0, 1] * height)))
+            cv2.circle(frame, center, 4 * thickness, color, -1, cv2.LINE_AA)
+            cv2.circle(frame, center, 4 * thickness, (0, 0, 0), thickness, cv2.LINE_AA)
+        return frame
+
+    def save(self, path, signature):
+        storage.save_arrays(path, version=TRACK_VERSION,
+                            signature=np.asarray(signature, dtype=np.int64),
+                            positions=self.positions, box=np.asarray(self.box),
+                            start_frame=self.start_frame)
+
+    @classmethod
+    def load(cls, path, signature):
+        """Load a saved trajectory, or return None if it is missing, stale or damaged"""
+        try:
+            with np.load(path) as data:
+                if int(data["version"]) != TRACK_VERSION:
+                    return None
+                if tuple(data["signature"]) != tuple(signature):
+                    return None
+                return cls(data["positions"], data["box"], int(data["start_frame"]))
+        except Exception:
+            # Not only OSError: a truncated file raises zipfile.BadZipFile or
+            # EOFError, and is recomputed like a missing one
+            return None
+
+
+def selection_key(box, start_frame):
+    """Return a short key for a rider selection, the same for boxes a fraction of a pixel apart"""
+    rounded = ",".join(f"{v:.4f}" for v in start_gate.normalize_roi(*box))
+    return hashlib.sha1(f"{rounded}@{int(start_frame)}".encode("ascii")).hexdigest()[:12]
+
+
+def cached_trajectory_path(video_path, box, start_frame):
+    return storage.cache_dir("tracks") / (f"{storage.path_key(video_path)}_"
+                                          f"{selection_key(box, start_frame)}.npz")
+
+
+def load_artifact(store, video_path, box, start_frame):
+    """Return a trajectory from an ArtifactStore, or None if it has none"""
+    arrays = store.load("track", [artifacts.content_key(video_path),
+                                  selection_key(box, start_frame)])
+    if arrays is None or int(arrays.get("version", -1)) != TRACK_VERSION:
+        return None
+    return Trajectory(arrays["positions"], arrays["box"], int(arrays["start_frame"]))
+
+
+def save_artifact(store, video_path, trajectory):
+    store.save("track", [artifacts.content_key(video_path),
+                         selection_key(trajectory.box, trajectory.start_frame)],
+               version=TRACK_VERSION, positions=trajectory.positions,
+               box=np.asarray(trajectory.box), start_frame=trajectory.start_frame)
+
+
+def load_or_track_rider(video_path, box, start_frame=0, index=None, proxy_path=None,
+                        progress_callback=None, cancel_event=None, store=None):
+    """Return the saved trajectory for a selection, tracking and saving it if needed
+
+    `store` is an optional ArtifactStore checked first and kept up to date.
+    """
+    if store is not None:
+        trajectory = load_artifact(store, video_path, box, start_frame)
+        if trajectory is not None:
+            return trajectory
+
+    signature = storage.file_signature(video_path)
+    path = cached_trajectory_path(video_path, box, start_frame)
+    trajectory = Trajectory.load(path, signature)
+    if trajectory is None:
+        trajectory = track_rider(video_path, box, start_frame, index, proxy_path,
+                                 progress_callback, cancel_event)
+        try:
+            trajectory.save(path, signature)
+        except OSError:
+            pass
+    if store is not None:
+        save_artifact(store, video_path, trajectory)
+    return trajectory
+
+
+class TrackBuilder:
+    """Track or load a rider's trajectory on a background thread
+
+    `on_progress(percent)` and `on_done(trajectory_or_None, error_or_None)`
+    are called from the worker thread.
+    """
+
+    def __init__(self, video_path, on_done, on_progress=None, box=None, start_frame=0,
+                 index=None, proxy_path=None, store=None):
+        self.video_path = video_path
+        self.box = box
+        self.start_frame = start_frame
+        self.index = index
+        self.proxy_path = proxy_path
+        self.store = store
+        self._cancel_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(on_done, on_progress),
+                                        daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def _run(self, on_done, on_progress):
+        try:
+            trajectory = load_or_track_rider(self.video_path, self.box, self.start_frame,
+                                             self.index, self.proxy_path, on_progress,
+                                             self._cancel_event, self.store)
+        except TrackingCancelled:
+            return
+        except Exception as e:
+            on_done(None, e)
+            return
+        on_done(trajectory, None)